@@ -1,8 +1,8 @@
+import copy
 import math
-import random
-from collections import namedtuple
-
-from collections import namedtuple, deque
+import os
+import queue
+import time
 
 import numpy as np
 import torch
@@ -10,95 +10,192 @@ import torch.optim as optim
 import torch.nn.functional as F
 import torchvision.transforms as T
 from itertools import count
+from typing import NamedTuple
 
 from PIL import Image
-from torch import nn
 from torchvision.transforms import InterpolationMode
 
 import torch
 
+from environment import VecContainerEnv
+from instrumentation import instrumented, measure
+from packages import ORIENTATIONS
+from replay import ReplayBuffer
+
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 PACKAGE_DIM = 3
 PACKAGE_INPUT_NUM = 5
 INPUT_IMAGE_SIZE = 500
 
-Transition = namedtuple('Transition',
-                        ('state', 'action', 'next_state', 'reward'))
-
-
-class ReplayMemory(object):
-
-    def __init__(self, capacity):
-        self.memory = deque([], maxlen=capacity)
-
-    def push(self, *args):
-        """Save a transition"""
-        self.memory.append(Transition(*args))
-
-    def sample(self, batch_size):
-        return random.sample(self.memory, batch_size)
-
-    def __len__(self):
-        return len(self.memory)
-
-
 # Create Ai Neural Network that takes a
-# (2d image of the container + the dimensions of 10 packages) and outputs the best position and rotation for a package
+# (2d image of the container + the dimensions of 10 packages) and outputs a Q-value for every placement of a package
 class Net(torch.nn.Module):
-    def __init__(self):
+    def __init__(self, channels: tuple = (32, 64, 128, 128), pooled_size: int = 4, hidden_sizes: tuple = (512, 256),
+                 action_stride: int = 4, rotations: int = len(ORIENTATIONS), package_slots: int = PACKAGE_INPUT_NUM,
+                 decoder_channels: int = 32):
+        """
+        Only the lowest corners of the floor cells are actions, with an action_stride of s the packages can be placed
+        at 1/s^2 of the height map positions, at the default stride of 4 15/16 of the positions are unreachable.
+
+        :param channels: The output channels of the convolutional stages, every stage halves the resolution.
+        :param pooled_size: The side of the grid the feature map is pooled to, 1 is global average pooling.
+        :param hidden_sizes: The sizes of the hidden dense layers.
+        :param action_stride: The side in pixels of the floor cells of the Q-map, a power of 2 up to
+            2^len(channels), a package is placed at the lowest corner of a cell.
+        :param rotations: The number of rotations of a package.
+        :param package_slots: The number of packages to choose from.
+        :param decoder_channels: The channels of the decoder levels and of the Q-map head. The activations of the
+            finest levels dominate the memory of a training step, they are kept narrow.
+        """
         super(Net, self).__init__()
         self.input_size = (1, INPUT_IMAGE_SIZE, INPUT_IMAGE_SIZE)
-        # the output size of the dense layers is
-        # (position_x,position_y, rotation, index) where index a one-hot encoded as a vector
-        self.output_size = (2 + 1 + PACKAGE_INPUT_NUM)
-        # the conv layer model consists of 3 layers of convolutional neural networks
-        self.conv_layers = torch.nn.Sequential(
-            torch.nn.Conv2d(1, 32, kernel_size=3, stride=1, padding=1),
-            torch.nn.ReLU(),
-            torch.nn.Conv2d(32, 64, kernel_size=3, stride=1, padding=1),
-            torch.nn.ReLU(),
-            torch.nn.Conv2d(64, 128, kernel_size=3, stride=1, padding=1),
-            torch.nn.ReLU(),
-        )
-
-        # Number of Linear input connections depends on output of conv2d layers
-        # and therefore the input image size, so compute it.
-        def conv2d_size_out(size, kernel_size=3, stride=1):
-            return (size - (kernel_size - 1) - 1) // stride + 1
-
-        convw = conv2d_size_out(conv2d_size_out(conv2d_size_out(INPUT_IMAGE_SIZE)))
-        convh = conv2d_size_out(conv2d_size_out(conv2d_size_out(INPUT_IMAGE_SIZE)))
-        linear_input_size = convw * convh * 128 + PACKAGE_INPUT_NUM * PACKAGE_DIM
-        # the dense layer model is composed of 4 fully connected layers with relu activation functions
-        # and a linear output layer.
-        # The dimensions data of the packages is concatenated to the output of the last convolutional layer.
-        # The output of the dense layer is the position and rotation of the package
-        # as well as the selected package index
-        self.dense_layers = torch.nn.Sequential(
-            torch.nn.Linear(linear_input_size, 1024),
-            torch.nn.ReLU(),
-            torch.nn.Linear(1024, 512),
-            torch.nn.ReLU(),
-            torch.nn.Linear(512, 256),
-            torch.nn.ReLU(),
-            torch.nn.Linear(256, 128),
-            torch.nn.ReLU(),
-            torch.nn.Linear(128, self.output_size),
-        )
+        self.action_stride = action_stride
+        self.rotations = rotations
+        self.package_slots = package_slots
+        # the Q-map has output_size channels per floor cell, one per (rotation, package slot)
+        self.output_size = rotations * package_slots
+        # the Q-map has the resolution of the features after action_level stages
+        self.action_level = int(action_stride).bit_length() - 1
+        if action_stride != 1 << self.action_level or self.action_level > len(channels):
+            raise ValueError(f'action_stride must be a power of 2 up to {1 << len(channels)}, got {action_stride}')
+        # the conv layer model is a stack of stride 2 convolutions, the cost of a stage drops by 4 with every stage
+        self.conv_layers = torch.nn.ModuleList()
+        in_channels = 1
+        for out_channels in channels:
+            # the ReLUs are in place, the backward pass of a convolution does not need its output
+            self.conv_layers.append(torch.nn.Sequential(
+                torch.nn.Conv2d(in_channels, out_channels, kernel_size=3, stride=2, padding=1),
+                torch.nn.ReLU(inplace=True)))
+            in_channels = out_channels
+        # the feature map is pooled to a fixed grid, so the number of Linear input connections
+        # and the weights of the dense layers do not depend on the input image size
+        self.pool = torch.nn.AdaptiveAvgPool2d(pooled_size)
+        linear_input_size = in_channels * pooled_size * pooled_size + package_slots * PACKAGE_DIM
+        # the dense layer model turns the pooled layout and the dimensions of the packages into a context vector
+        # that is added to the features of every cell, the cells know the packages and the whole layout
+        dense_layers = []
+        for hidden_size in hidden_sizes:
+            dense_layers.append(torch.nn.Linear(linear_input_size, hidden_size))
+            dense_layers.append(torch.nn.ReLU())
+            linear_input_size = hidden_size
+        dense_layers.append(torch.nn.Linear(linear_input_size, in_channels))
+        self.dense_layers = torch.nn.Sequential(*dense_layers)
+        # the decoder brings the deepest features back up to the resolution of the Q-map, every level doubles the
+        # resolution and adds the encoder features of that resolution, so every floor cell gets its own values.
+        # the maps of the decoder have decoder_channels, the encoder features are projected to them instead of being
+        # concatenated, a concatenation would keep a map as wide as both for the backward pass
+        skip_channels = (1,) + tuple(channels[:-1])
+        self.decoder_input = torch.nn.Conv2d(in_channels, decoder_channels, kernel_size=1)
+        self.skip_layers = torch.nn.ModuleList()
+        self.decoder_layers = torch.nn.ModuleList()
+        for level in range(len(channels) - 1, self.action_level - 1, -1):
+            self.skip_layers.append(torch.nn.Conv2d(skip_channels[level], decoder_channels, kernel_size=1))
+            self.decoder_layers.append(torch.nn.Sequential(
+                torch.nn.Conv2d(decoder_channels, decoder_channels, kernel_size=3, padding=1),
+                torch.nn.ReLU(inplace=True)))
+        # the head is fully convolutional, its weights do not depend on the number of cells
+        self.q_map_head = torch.nn.Sequential(torch.nn.Conv2d(decoder_channels, decoder_channels, kernel_size=1),
+                                              torch.nn.ReLU(inplace=True),
+                                              torch.nn.Conv2d(decoder_channels, self.output_size, kernel_size=1))
+
+    def get_action_grid_shape(self, resolution_x: int, resolution_y: int):
+        """
+        :return: The number of floor cells of the Q-map in x and y direction.
+        """
+        return -(-resolution_x // self.action_stride), -(-resolution_y // self.action_stride)
+
+    def get_action_count(self, resolution_x: int, resolution_y: int):
+        grid_x, grid_y = self.get_action_grid_shape(resolution_x, resolution_y)
+        return grid_x * grid_y * self.output_size
 
     def forward(self, image, list_of_package_dimensions):
-        # the input image is passed through the convolutional layers
-        x = self.conv_layers(image)
-        # the output of the convolutional layers is flattened
-        x = x.view(x.size(0), -1)
+        """
+        :return: (N, grid_x * grid_y * rotations * package_slots) Q-values, the flat index of an action is
+            ((x * grid_y + y) * rotations + rotation) * package_slots + package_slot.
+        """
+        # the input image is passed through the convolutional layers, the output of every stage is kept for the
+        # decoder, features[level] has 1/2^level of the input resolution
+        features = [image]
+        for stage in self.conv_layers:
+            features.append(stage(features[-1]))
+        # the output of the convolutional layers is pooled and flattened
+        x = self.pool(features[-1]).flatten(1)
         # the package dimensions are concatenated to the output of the convolutional layers
         x = torch.cat((x, list_of_package_dimensions), 1)
-        # the output of the convolutional layers is passed through the dense layers
-        x = self.dense_layers(x)
-        return x
-
-
-BATCH_SIZE = 128
+        # the context vector is broadcast over the cells of the feature map
+        context = self.dense_layers(x)
+        x = self.decoder_input(features[-1] + context[:, :, None, None])
+        for level, skip_layer, decoder_layer in zip(range(len(features) - 2, -1, -1), self.skip_layers,
+                                                    self.decoder_layers):
+            # a stride 2 convolution of n cells has ceil(n / 2) outputs, the upsampled map is cropped to the skip
+            skip = features[level]
+            x = F.interpolate(x, scale_factor=2, mode='nearest')[:, :, :skip.size(2), :skip.size(3)]
+            x = decoder_layer(x + skip_layer(skip))
+        q_map = self.q_map_head(x)
+        return q_map.permute(0, 2, 3, 1).flatten(1)
+
+    def get_parameter_count(self):
+        return sum(parameter.numel() for parameter in self.parameters())
+
+
+def describe_net(net: Net, resolutions=(100, 250, 500), batch_size: int = 1, repeats: int = 10):
+    """
+    Measures the cost of a Net at several input image sizes.
+
+    :return: A dict per resolution with the parameter count, the multiply-accumulates of the convolutions,
+        the mean forward latency in seconds and the bytes per image that a training step keeps for the backward pass.
+    """
+    results = []
+    convolution_macs = []
+    parameter_storages = {parameter.untyped_storage().data_ptr() for parameter in net.parameters()}
+    saved_storages = {}
+
+    def save_activation(tensor):
+        # the weights are saved by reference, views of one activation share its storage
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in parameter_storages:
+            saved_storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    def count_macs(module, inputs, output):
+        convolution_macs.append(output.numel() * module.in_channels // module.groups *
+                                module.kernel_size[0] * module.kernel_size[1])
+
+    hooks = [module.register_forward_hook(count_macs) for module in net.modules()
+             if isinstance(module, torch.nn.Conv2d)]
+    device = next(net.parameters()).device
+    try:
+        with torch.no_grad():
+            for resolution in resolutions:
+                image = torch.rand(batch_size, 1, resolution, resolution, device=device)
+                package_dimensions = torch.rand(batch_size, PACKAGE_INPUT_NUM * PACKAGE_DIM, device=device)
+                convolution_macs.clear()
+                net(image, package_dimensions)
+                macs = sum(convolution_macs) // batch_size
+                start_time = time.perf_counter()
+                for _ in range(repeats):
+                    net(image, package_dimensions)
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                latency = (time.perf_counter() - start_time) / repeats
+                saved_storages.clear()
+                with torch.enable_grad(), torch.autograd.graph.saved_tensors_hooks(save_activation, lambda x: x):
+                    net(image, package_dimensions)
+                activation_bytes = sum(saved_storages.values()) // batch_size
+                results.append({'resolution': resolution, 'parameters': net.get_parameter_count(),
+                                'convolution_macs': macs, 'forward_seconds': latency,
+                                'activation_bytes': activation_bytes})
+                print(f'{resolution:>4} px: {net.get_parameter_count()} parameters, '
+                      f'{macs / 1e6:.1f} M conv MACs per image, {latency * 1e3:.2f} ms per forward '
+                      f'(batch {batch_size}), {activation_bytes / 2 ** 20:.1f} MiB of activations per image')
+    finally:
+        for hook in hooks:
+            hook.remove()
+    return results
+
+
+# a training step keeps about 22 MiB of activations per 500 px image for the backward pass, see describe_net
+BATCH_SIZE = 32
 GAMMA = 0.999
 EPS_START = 0.9
 EPS_END = 0.05
@@ -108,75 +205,171 @@ BURN_IN = 1000
 LEARN_EVERY = 1
 LEARNING_RATE = 1e-4
 SYNC_TARGET_EVERY = 1000
-
-# the policy network is the network that is trained
-policy_net = Net().to(device)
-# the target network is the network that is used to calculate the target value
-target_net = Net().to(device)
-target_net.load_state_dict(policy_net.state_dict())
-target_net.eval()
-
-optimizer = optim.RMSprop(policy_net.parameters(), lr=LEARNING_RATE)
-memory = ReplayMemory(10000)
+REPLAY_CAPACITY = 10000
+# sample the replay memory proportionally to the temporal difference errors instead of uniformly
+PRIORITIZED_REPLAY = False
+# the height maps are normalized to [0, 1], 256 levels keep a 500x500 frame at 250 kB instead of 1 MB
+REPLAY_IMAGE_DTYPE = torch.uint8
+# set to a file on a local disk to keep the replay frames in a memory mapped file instead of RAM
+REPLAY_STORAGE_PATH = None
+# parallel training: the learner publishes the policy weights every PUBLISH_POLICY_EVERY optimization steps and
+# the actors load the published weights every ACTOR_SYNC_EVERY environment steps
+PUBLISH_POLICY_EVERY = 50
+ACTOR_SYNC_EVERY = 20
+# the number of transition batches that can wait for the learner, a full queue makes the actors wait
+ACTOR_QUEUE_SIZE = 64
+
+
+
+class ActorSettings(NamedTuple):
+    """
+    The settings of the learner that the actor processes of train_parallel follow, the actors start from a fresh
+    interpreter and would otherwise see the defaults of the module.
+    """
+    sync_every: int
+    eps_start: float
+    eps_end: float
+    eps_decay: float
+
+    @classmethod
+    def from_module(cls):
+        return cls(ACTOR_SYNC_EVERY, EPS_START, EPS_END, EPS_DECAY)
+
+
+# the policy network is the network that is trained, the target network is the network that is used to calculate
+# the target value. they are created on device by create_networks, the actor processes of train_parallel act with
+# a cpu copy of the published weights and never create them
+policy_net = None
+target_net = None
+optimizer = None
+# the replay memory is created by train and train_parallel, its frames have the shape of the observations
+memory = None
 
 steps_done = 0
 
 
-def select_action(state):
+def create_networks():
+    """
+    Creates the policy and target networks and their optimizer, unless they exist.
+
+    :return: The policy network, it is also the module's policy_net.
+    """
+    global policy_net, target_net, optimizer
+    if policy_net is None:
+        policy_net = Net().to(device)
+        target_net = Net().to(device)
+        target_net.load_state_dict(policy_net.state_dict())
+        target_net.eval()
+        optimizer = optim.RMSprop(policy_net.parameters(), lr=LEARNING_RATE)
+    return policy_net
+
+
+def create_memory(state):
+    """
+    Creates the replay memory for the observations of an environment, unless the current one already fits them.
+
+    :param state: (images, package_dimensions) batch, e.g. from VecContainerEnv.get_observations.
+    :return: The ReplayBuffer, it is also the module's memory.
+    """
+    global memory
+    images, package_dimensions = state
+    if memory is None or tuple(memory.frames.shape[1:]) != tuple(images.shape[1:]) or \
+            memory.package_dimensions.size(1) != package_dimensions.size(1):
+        memory = ReplayBuffer(REPLAY_CAPACITY, tuple(images.shape[1:]), package_dimensions.size(1),
+                              prioritized=PRIORITIZED_REPLAY, device=device, image_dtype=REPLAY_IMAGE_DTYPE,
+                              storage_path=REPLAY_STORAGE_PATH)
+    return memory
+
+
+def decode_actions(actions, resolution_x, resolution_y, net: Net = None):
+    """
+    Converts flat Q-map indices into environment actions.
+
+    :param actions: (N, 1) flat indices into the outputs of the Net.
+    :param resolution_x: The height map resolution in x direction.
+    :param resolution_y: The height map resolution in y direction.
+    :param net: The Net whose Q-map layout is used, the policy network if None.
+    :return: (N, 4) long tensor of (x, y, rotation, package slot).
+    """
+    net = create_networks() if net is None else net
+    _, grid_y = net.get_action_grid_shape(resolution_x, resolution_y)
+    actions = actions.view(-1)
+    package_slot = actions % net.package_slots
+    actions = actions // net.package_slots
+    rotation = actions % net.rotations
+    cells = actions // net.rotations
+    # a package is placed at the lowest corner of its floor cell
+    x = (cells // grid_y) * net.action_stride
+    y = (cells % grid_y) * net.action_stride
+    return torch.stack((x, y, rotation, package_slot), 1)
+
+
+@instrumented('select_action')
+def select_action(state, net: Net = None, settings: ActorSettings = None):
+    """
+    Selects actions for a batch of states with an epsilon-greedy policy, every state is explored independently.
+    The Q-values of all placements of a state come from one forward pass and the greedy actions are one argmax.
+
+    :param state: (images, package_dimensions) batch, e.g. from VecContainerEnv.get_observations.
+    :param net: The network that is acted with, the policy network if None.
+    :param settings: The exploration schedule, the module's EPS_START, EPS_END and EPS_DECAY if None.
+    :return: (N, 1) selected flat Q-map indices and (N, 4) environment actions.
+    """
     global steps_done
-    sample = random.random()
-    eps_threshold = EPS_END + (EPS_START - EPS_END) * math.exp(-1. * steps_done / EPS_DECAY)
-    steps_done += 1
-    if sample > eps_threshold:
-        with torch.no_grad():
-            # t.max(1) will return largest column value of each row.
-            # second column on max result is index of where max element was
-            # found, so we pick action with the larger expected reward.
-            return policy_net(state).max(1)[1].view(1, 1)
-    else:
-        return torch.tensor([[random.randrange(n_actions)]], device=device, dtype=torch.long)
+    net = create_networks() if net is None else net
+    settings = ActorSettings.from_module() if settings is None else settings
+    images, package_dimensions = state
+    batch_size = images.size(0)
+    eps_threshold = settings.eps_end + (settings.eps_start - settings.eps_end) * \
+        math.exp(-1. * steps_done / settings.eps_decay)
+    steps_done += batch_size
+    with torch.no_grad():
+        # the argmax over the flattened Q-map of each row is the placement with the largest expected reward
+        output = net(images, package_dimensions)
+    action = output.argmax(1).view(-1, 1)
+
+    explore = torch.rand(batch_size, device=images.device) <= eps_threshold
+    random_action = torch.randint(output.size(1), (batch_size, 1), device=images.device)
+    action = torch.where(explore.view(-1, 1), random_action, action)
+    return action, decode_actions(action, images.size(2), images.size(3), net)
 
 
 episode_durations = []
 
 
-def optimize_model():
-    if len(memory) < BATCH_SIZE:
+@instrumented('optimize_model')
+def optimize_model(batch_size: int = None):
+    """
+    Runs one optimization step of the policy network on a batch sampled from the replay memory.
+
+    :param batch_size: The number of sampled transitions, BATCH_SIZE if None.
+    """
+    batch_size = BATCH_SIZE if batch_size is None else batch_size
+    create_networks()
+    if len(memory) < batch_size:
         return
-    transitions = memory.sample(BATCH_SIZE)
-    # Transpose the batch (see https://stackoverflow.com/a/19343/3343043 for
-    # detailed explanation). This converts batch-array of Transitions
-    # to Transition of batch-arrays.
-    batch = Transition(*zip(*transitions))
-
-    # Compute a mask of non-final states and concatenate the batch elements
-    # (a final state would've been the one after which simulation ended)
-    non_final_mask = torch.tensor(tuple(map(lambda s: s is not None,
-                                            batch.next_state)), device=device, dtype=torch.bool)
-    non_final_next_states = torch.cat([s for s in batch.next_state
-                                       if s is not None])
-    state_batch = torch.cat(batch.state)
-    action_batch = torch.cat(batch.action)
-    reward_batch = torch.cat(batch.reward)
+    batch = memory.sample(batch_size)
 
     # Compute Q(s_t, a) - the model computes Q(s_t), then we select the
     # columns of actions taken. These are the actions which would've been taken
     # for each batch state according to policy_net
-    state_action_values = policy_net(state_batch).gather(1, action_batch)
+    state_action_values = policy_net(*batch.states).gather(1, batch.actions)
 
     # Compute V(s_{t+1}) for all next states.
-    # Expected values of actions for non_final_next_states are computed based
+    # Expected values of actions for the next states are computed based
     # on the "older" target_net; selecting their best reward with max(1)[0].
-    # This is merged based on the mask, such that we'll have either the expected
-    # state value or 0 in case the state was final.
-    next_state_values = torch.zeros(BATCH_SIZE, device=device)
-    next_state_values[non_final_mask] = target_net(non_final_next_states).max(1)[0].detach()
+    # The value of final states is 0, the batch is evaluated whole instead of gathering the non final states.
+    with torch.no_grad():
+        next_state_values = target_net(*batch.next_states).max(1)[0]
+    next_state_values = next_state_values.masked_fill(batch.dones, 0)
     # Compute the expected Q values
-    expected_state_action_values = (next_state_values * GAMMA) + reward_batch
+    expected_state_action_values = (next_state_values * GAMMA) + batch.rewards
 
-    # Compute Huber loss
-    criterion = nn.SmoothL1Loss()
-    loss = criterion(state_action_values, expected_state_action_values.unsqueeze(1))
+    # Compute Huber loss, weighted by the importance sampling weights of a prioritized replay
+    errors = state_action_values.squeeze(1) - expected_state_action_values
+    loss = (F.smooth_l1_loss(state_action_values.squeeze(1), expected_state_action_values, reduction='none') *
+            batch.weights).mean()
+    memory.update_priorities(batch.indices, errors)
 
     # Optimize the model
     optimizer.zero_grad()
@@ -184,3 +377,164 @@ def optimize_model():
     for param in policy_net.parameters():
         param.grad.data.clamp_(-1, 1)
     optimizer.step()
+
+
+def train(env, num_steps):
+    """
+    Trains the policy network on a VecContainerEnv, every step acts in all environments at once.
+
+    :param env: The batched environment.
+    :param num_steps: The number of batched environment steps.
+    """
+    state = env.get_observations()
+    create_networks()
+    create_memory(state)
+    optimization_steps = 0
+    for step in range(num_steps):
+        action, env_action = select_action(state)
+        next_state, reward, done = env.step(env_action)
+        memory.push_batch(state, action, next_state, reward, done)
+        state = next_state
+
+        if len(memory) >= BURN_IN and step % LEARN_EVERY == 0:
+            optimize_model()
+            optimization_steps += 1
+            if optimization_steps % SYNC_TARGET_EVERY == 0:
+                with measure('sync_target_net'):
+                    target_net.load_state_dict(policy_net.state_dict())
+
+
+
+def run_actor(actor_id: int, training_instance, num_envs: int, shared_net: Net, version, transitions, stop,
+              seed: int, settings: ActorSettings):
+    """
+    Actor process of train_parallel: steps a VecContainerEnv with a cpu copy of the policy network and sends the
+    transitions to the learner. The module's networks are not created, the actor does not touch the device of the
+    learner.
+
+    :param actor_id: The index of the actor.
+    :param training_instance: The TrainingInstance of the environments.
+    :param num_envs: The number of environments stepped together.
+    :param shared_net: The policy weights published by the learner, in shared memory.
+    :param version: Shared counter of the publications, its lock guards the shared weights.
+    :param transitions: The queue to the learner.
+    :param stop: Event set by the learner when the training is over.
+    :param seed: The seed of the environments and of the exploration.
+    :param settings: The settings of the learner.
+    """
+    # the actors share the cores, one thread each
+    torch.set_num_threads(1)
+    torch.manual_seed(seed)
+    # the copy has the architecture of the learner's network and its own memory
+    with version.get_lock():
+        net = copy.deepcopy(shared_net)
+        loaded_version = version.value
+    net.eval()
+    env = VecContainerEnv(training_instance, num_envs, package_slots=net.package_slots, seed=seed)
+    state = env.get_observations()
+    continues = False
+    step = 0
+    while not stop.is_set():
+        action, env_action = select_action(state, net, settings)
+        next_state, reward, done = env.step(env_action)
+        # the states of a step are the next states of the step before, they are only sent the first time.
+        # the tensors are sent as arrays, shared tensors would need the actor alive until the learner reads them
+        transitions.put((actor_id, None if continues else [tensor.numpy() for tensor in state], action.numpy(),
+                         [tensor.numpy() for tensor in next_state], reward.numpy(), done.numpy()))
+        state = next_state
+        continues = True
+        step += 1
+        if step % settings.sync_every == 0 and version.value != loaded_version:
+            with version.get_lock():
+                net.load_state_dict(shared_net.state_dict())
+                loaded_version = version.value
+
+
+def train_parallel(training_instance, num_optimization_steps: int, num_actors: int = None, envs_per_actor: int = 8,
+                   seed: int = 0):
+    """
+    Trains the policy network with actor processes that generate the transitions while this process learns.
+    The actors run select_action and the environment steps on their own cores and stream the transitions into the
+    replay memory of the learner, which runs optimize_model without waiting for the environments.
+
+    :param training_instance: The TrainingInstance of the environments.
+    :param num_optimization_steps: The number of optimize_model calls.
+    :param num_actors: The number of actor processes, one per core but the learner's if None.
+    :param envs_per_actor: The number of environments every actor steps together.
+    :param seed: The seed of the first actor, the others get the next seeds.
+    :return: Dict with the numbers of transitions and optimization steps, the seconds and their rates.
+    """
+    if num_actors is None:
+        num_actors = max((os.cpu_count() or 2) - 1, 1)
+    # cuda and fork do not mix, the actors start from a fresh interpreter
+    context = torch.multiprocessing.get_context('spawn')
+    # the shared weights stay on the cpu, the actors copy them
+    shared_net = copy.deepcopy(create_networks()).cpu()
+    shared_net.share_memory()
+    settings = ActorSettings.from_module()
+    version = context.Value('l', 0)
+    transitions = context.Queue(ACTOR_QUEUE_SIZE)
+    stop = context.Event()
+    actors = [context.Process(target=run_actor, args=(actor_id, training_instance, envs_per_actor, shared_net,
+                                                      version, transitions, stop, seed + actor_id, settings),
+                              daemon=True)
+              for actor_id in range(num_actors)]
+    for actor in actors:
+        actor.start()
+
+    # the replay memory is shaped after the observations of the environments of the actors
+    create_memory(VecContainerEnv(training_instance, 1, package_slots=shared_net.package_slots).get_observations())
+    # the last next states of every actor, the states of its next batch
+    last_next_states = {}
+    transition_count = 0
+    optimization_steps = 0
+    start_time = time.perf_counter()
+    try:
+        while optimization_steps < num_optimization_steps:
+            # take everything the actors sent, wait for data while the replay memory is filling
+            batches = []
+            while len(batches) < ACTOR_QUEUE_SIZE:
+                try:
+                    batches.append(transitions.get(block=len(memory) < BURN_IN and not batches, timeout=1.0))
+                except queue.Empty:
+                    if len(memory) < BURN_IN and not batches and not any(actor.is_alive() for actor in actors):
+                        raise RuntimeError('all actors exited before the replay memory was filled')
+                    if len(memory) >= BURN_IN or batches:
+                        break
+            with measure('push_transitions'):
+                for actor_id, states, action, next_states, reward, done in batches:
+                    states = last_next_states[actor_id] if states is None else tuple(map(torch.from_numpy, states))
+                    next_states = tuple(map(torch.from_numpy, next_states))
+                    action, reward, done = torch.from_numpy(action), torch.from_numpy(reward), torch.from_numpy(done)
+                    # every actor is its own stream, the replay memory stores the frames its batches share once
+                    memory.push_batch(states, action, next_states, reward, done, stream=actor_id)
+                    last_next_states[actor_id] = next_states
+                    transition_count += action.size(0)
+
+            if len(memory) >= BURN_IN:
+                optimize_model()
+                optimization_steps += 1
+                if optimization_steps % SYNC_TARGET_EVERY == 0:
+                    with measure('sync_target_net'):
+                        target_net.load_state_dict(policy_net.state_dict())
+                if optimization_steps % PUBLISH_POLICY_EVERY == 0:
+                    with measure('publish_policy'), version.get_lock():
+                        shared_net.load_state_dict(policy_net.state_dict())
+                        version.value += 1
+    finally:
+        stop.set()
+        # an actor waiting on the full queue only sees the stop event after its batch went through
+        while any(actor.is_alive() for actor in actors):
+            try:
+                transitions.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        for actor in actors:
+            actor.join()
+    seconds = time.perf_counter() - start_time
+    return {'actors': num_actors, 'transitions': transition_count, 'optimization_steps': optimization_steps,
+            'seconds': seconds, 'transitions_per_second': transition_count / seconds,
+            'optimization_steps_per_second': optimization_steps / seconds}
+
+if __name__ == '__main__':
+    describe_net(create_networks())
@@ -0,0 +1,220 @@
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import time
+
+import numpy
+
+import kernels
+from packages import ORIENTATIONS, Container, Package, TrainingInstance
+
+SIZES = (100, 1000, 10000, 50000)
+# the learning benchmarks run at the height map resolution of the training environments with a bounded batch,
+# a training step at ai_pytorch.INPUT_IMAGE_SIZE with BATCH_SIZE samples does not fit into the memory of a laptop
+LEARNING_RESOLUTION = 100
+LEARNING_BATCH_SIZE = 32
+
+
+def make_manifest(size: int, rng: numpy.random.Generator):
+    """
+    Get a container whose floor grows with the package count and random packages with random floor positions.
+
+    :return: The container dimensions, the (size, 3) package dimensions, the (size,) weights and
+        the (size, 2) positions.
+    """
+    side = float(numpy.ceil(10 * numpy.sqrt(size)))
+    container_dimensions = numpy.array([side, side, 100.0])
+    package_dimensions = rng.integers(1, 11, (size, 3)).astype(float)
+    package_weights = rng.uniform(1, 10, size)
+    positions = rng.integers(0, int(side) - 10, (size, 2)).astype(float)
+    return container_dimensions, package_dimensions, package_weights, positions
+
+
+def measure(name: str, size: int, function, calls: int = 1):
+    """
+    Times calls of a function and records the peak resident memory of the process afterwards.
+    The memory is not traced while timing, tracing would slow the hot paths down.
+
+    :return: The result dict and the return value of the last call.
+    """
+    start_time = time.perf_counter()
+    value = None
+    for _ in range(calls):
+        value = function()
+    elapsed = time.perf_counter() - start_time
+    # ru_maxrss is in kilobytes on linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {'name': name, 'packages': size, 'calls': calls, 'seconds': elapsed, 'seconds_per_call': elapsed / calls,
+            'max_rss_bytes': max_rss}, value
+
+
+def skipped(name: str, size: int, reason: str):
+    return {'name': name, 'packages': size, 'skipped': reason}
+
+
+def attempt(name: str, size: int, function, calls: int = 1):
+    """
+    Measures a function like measure, but records an allocation failure as a failed result instead of raising.
+
+    :return: The result dict.
+    """
+    try:
+        return measure(name, size, function, calls)[0]
+    except (MemoryError, RuntimeError) as error:
+        # torch raises its out of memory errors as RuntimeError
+        return {'name': name, 'packages': size, 'failed': f'{type(error).__name__}: {error}'}
+
+
+def benchmark_packing(size: int, rng: numpy.random.Generator):
+    container_dimensions, package_dimensions, package_weights, positions = make_manifest(size, rng)
+    resolution = int(container_dimensions[0])
+    instance = TrainingInstance(container_dimensions, None, None, None, container_dimensions / 2)
+    instance.container = Container(container_dimensions, numpy.array([0, 0, 0]), resolution, resolution,
+                                   package_capacity=size)
+    container = instance.container
+    rotations = rng.integers(0, len(ORIENTATIONS), size)
+
+    def add_packages():
+        for index in range(size):
+            container.add_package(Package(package_weights[index], package_dimensions[index]), positions[index],
+                                  rotations[index])
+
+    result, _ = measure('Container.add_package', size, add_packages)
+    result['calls'] = size
+    result['seconds_per_call'] = result['seconds'] / size
+    results = [result]
+    results.append(measure('Container.generate_top_down_view', size,
+                           lambda: container.generate_top_down_view(200, 200), calls=3)[0])
+    results.append(measure('Container.get_top_down_view', size, container.get_top_down_view, calls=100)[0])
+    results.append(measure('TrainingInstance.update_fitness', size, instance.update_fitness, calls=1000)[0])
+    results.append({'name': 'Container.memory', 'packages': size,
+                    'array_bytes': int(container.height_map.nbytes + container.top_package_map.nbytes +
+                                       container.image.nbytes + sum(
+                                           getattr(container.packages, name).nbytes for name in (
+                                               '_positions', '_dimensions', '_weights', '_orientations',
+                                               '_support_ratios', '_stacked_loads')))})
+    return results, container
+
+
+def benchmark_learning(size: int, container: Container):
+    """
+    Times a forward pass and an optimization step of the policy network on the height map of the container,
+    scaled to the observation resolution of the training environments. A training step keeps the activations
+    of the batch for the backward pass, its memory grows with the batch and the square of the resolution.
+
+    :return: Generator of the result dicts, a step that runs out of memory is recorded as failed.
+    """
+    names = ('Net.forward', 'optimize_model')
+    try:
+        import torch
+        import ai_pytorch
+    except Exception as error:
+        yield from (skipped(name, size, f'{type(error).__name__}: {error}') for name in names)
+        return
+
+    image = torch.nn.functional.interpolate(
+        torch.as_tensor(container.height_map / container.dimensions[2], dtype=torch.float32)[None, None],
+        size=(LEARNING_RESOLUTION, LEARNING_RESOLUTION)).to(ai_pytorch.device)
+    package_dimensions = torch.rand(1, ai_pytorch.PACKAGE_INPUT_NUM * ai_pytorch.PACKAGE_DIM,
+                                    device=ai_pytorch.device)
+    policy_net = ai_pytorch.create_networks()
+    with torch.no_grad():
+        result = attempt('Net.forward', size, lambda: policy_net(image, package_dimensions), calls=10)
+    result.update(resolution=LEARNING_RESOLUTION, batch_size=1)
+    yield result
+
+    # fill the replay memory with copies of the observation so that optimize_model runs a full batch
+    ai_pytorch.create_memory((image, package_dimensions))
+    while len(ai_pytorch.memory) < LEARNING_BATCH_SIZE:
+        action = torch.zeros((1, 1), dtype=torch.long, device=ai_pytorch.device)
+        ai_pytorch.memory.push((image, package_dimensions), action, (image, package_dimensions),
+                               torch.zeros(1, device=ai_pytorch.device))
+    result = attempt('optimize_model', size, lambda: ai_pytorch.optimize_model(LEARNING_BATCH_SIZE), calls=3)
+    result.update(resolution=LEARNING_RESOLUTION, batch_size=LEARNING_BATCH_SIZE)
+    yield result
+
+
+def benchmark_rendering(size: int, container: Container, max_packages: int = 2000):
+    name = 'World.makePackage'
+    try:
+        from panda3d.core import loadPrcFileData
+        loadPrcFileData('', 'window-type offscreen')
+        from direct.showbase.ShowBase import ShowBase
+        from viewer_camera import World
+    except ImportError as error:
+        return [skipped(name, size, f'{type(error).__name__}: {error}')]
+
+    global _render_world
+    if _render_world is None:
+        _render_world = World(ShowBase())
+    packages = [container.packages[index] for index in range(min(size, max_packages))]
+
+    def make_packages():
+        for package in packages:
+            _render_world.makePackage(package, [1, 0, 0, 0.5])
+
+    result, _ = measure(name, size, make_packages)
+    result['calls'] = len(packages)
+    result['seconds_per_call'] = result['seconds'] / len(packages)
+    return [result]
+
+
+_render_world = None
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result: dict):
+    size = result['packages']
+    if 'seconds_per_call' in result:
+        print(f'{size:>6} packages {result["name"]:<35} {result["seconds_per_call"] * 1e6:12.1f} us per call, '
+              f'max rss {result["max_rss_bytes"] / 2 ** 20:8.1f} MiB')
+    elif 'skipped' in result:
+        print(f'{size:>6} packages {result["name"]:<35} skipped ({result["skipped"]})')
+    elif 'failed' in result:
+        print(f'{size:>6} packages {result["name"]:<35} failed ({result["failed"]})')
+
+
+def run(sizes=SIZES, output: str = 'benchmark_results.json', seed: int = 0):
+    """
+    Runs the benchmarks for every package count and writes the results to a JSON file.
+    Benchmarks whose dependencies (torch, panda3d) are missing are recorded as skipped.
+    The file is rewritten after every result, a benchmark that takes the process down keeps the results before it.
+
+    :return: The report dict.
+    """
+    rng = numpy.random.default_rng(seed)
+    results = []
+    report = {'commit': get_commit(), 'time': time.time(), 'python': platform.python_version(),
+              'numpy': numpy.__version__, 'numba': kernels.NUMBA_AVAILABLE, 'results': results}
+
+    def record(entries):
+        for result in entries:
+            results.append(result)
+            print_result(result)
+            with open(output, 'w') as file:
+                json.dump(report, file, indent=2)
+
+    for size in sizes:
+        packing_results, container = benchmark_packing(size, rng)
+        record(packing_results)
+        record(benchmark_learning(size, container))
+        record(benchmark_rendering(size, container))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the packing, rendering and learning hot paths.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+    run(arguments.sizes, arguments.output, arguments.seed)
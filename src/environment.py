@@ -0,0 +1,169 @@
+import numpy
+import torch
+
+import kernels
+from instrumentation import instrumented
+from packages import ORIENTATIONS, TrainingInstance
+
+# permutations of the package dimensions, the same orientations as Package.rotate
+ROTATIONS = ORIENTATIONS
+
+
+class VecContainerEnv:
+    """
+    N containers of a training instance stepped together.
+
+    The containers are kept as batched arrays (height maps, centers of gravity, weights, volumes) and every
+    container has a queue of package_slots packages to choose from. An action is (x, y, rotation, package_slot)
+    with x and y in height map cells.
+
+    The reward of a placement is the change of the fitness of the layout (see TrainingInstance.update_fitness),
+    so the return of an episode is the fitness of its final layout minus the one of the empty container.
+    The fitness is in [-1, 1], invalid_action_reward is on the same scale.
+    """
+
+    def __init__(self, training_instance: TrainingInstance, num_envs: int, package_slots: int = 5,
+                 invalid_action_reward: float = -1.0, seed: int = None, device: torch.device = torch.device('cpu')):
+        self.training_instance = training_instance
+        self.num_envs = num_envs
+        self.package_slots = package_slots
+        self.invalid_action_reward = invalid_action_reward
+        self.device = device
+        self.rng = numpy.random.default_rng(seed)
+
+        container = training_instance.container
+        self.container_dimensions = numpy.asarray(container.dimensions, dtype=float)
+        self.resolution_x, self.resolution_y = container.height_map.shape
+        self.cell_size = container.cell_size
+        self.empty_weight = container.empty_weight
+        self.empty_center_of_gravity = container.get_local_center()
+        self.target_center_of_gravity = numpy.asarray(training_instance.target_center_of_gravity, dtype=float)
+        self.cells_x = numpy.arange(self.resolution_x)
+        self.cells_y = numpy.arange(self.resolution_y)
+
+        self.height_maps = numpy.zeros((num_envs, self.resolution_x, self.resolution_y), dtype=float)
+        self.centers_of_gravity = numpy.zeros((num_envs, 3), dtype=float)
+        self.total_weights = numpy.zeros(num_envs, dtype=float)
+        self.package_volumes = numpy.zeros(num_envs, dtype=float)
+        self.max_heights = numpy.zeros(num_envs, dtype=float)
+        self.placed_counts = numpy.zeros(num_envs, dtype=numpy.int64)
+        self.package_counts = numpy.zeros(num_envs, dtype=numpy.int64)
+        self.package_dimensions = numpy.zeros((num_envs, package_slots, 3), dtype=float)
+        self.package_weights = numpy.zeros((num_envs, package_slots), dtype=float)
+        self.empty_fitness = self.get_fitness(numpy.zeros(1), numpy.zeros(1),
+                                              self.empty_center_of_gravity[numpy.newaxis])[0]
+        self.fitnesses = numpy.zeros(num_envs, dtype=float)
+        self.reset()
+
+    def reset(self, mask: numpy.array = None):
+        """
+        Empties containers and draws new package queues.
+
+        :param mask: (N,) boolean array of the containers to reset, all of them if None.
+        :return: The observations, see get_observations.
+        """
+        if mask is None:
+            mask = numpy.ones(self.num_envs, dtype=bool)
+        count = int(mask.sum())
+        self.height_maps[mask] = 0
+        self.centers_of_gravity[mask] = self.empty_center_of_gravity
+        self.total_weights[mask] = self.empty_weight
+        self.package_volumes[mask] = 0
+        self.max_heights[mask] = 0
+        self.placed_counts[mask] = 0
+        self.fitnesses[mask] = self.empty_fitness
+        self.package_counts[mask] = [self.training_instance.sample_package_count(self.rng) for _ in range(count)]
+        dimensions, weights = self.training_instance.sample_packages(count * self.package_slots, self.rng)
+        self.package_dimensions[mask] = dimensions.reshape(count, self.package_slots, 3)
+        self.package_weights[mask] = weights.reshape(count, self.package_slots)
+        return self.get_observations()
+
+    def get_fitness(self, max_heights: numpy.array, package_volumes: numpy.array, centers_of_gravity: numpy.array):
+        """
+        The same fitness as TrainingInstance.update_fitness for many layouts at once, a center of gravity on the
+        target or an empty container do not give inf or nan.
+        """
+        fitness = kernels.fitness_batch(self.container_dimensions, max_heights, package_volumes, centers_of_gravity,
+                                        self.target_center_of_gravity)
+        return numpy.nan_to_num(fitness, nan=0.0, posinf=1.0, neginf=-1.0)
+
+    def get_observations(self):
+        """
+        Get the observations of all containers.
+
+        :return: (N, 1, resolution_x, resolution_y) height maps normalized by the container height and
+            (N, package_slots * 3) dimensions of the queued packages.
+        """
+        images = torch.as_tensor(self.height_maps / self.container_dimensions[2], dtype=torch.float32,
+                                 device=self.device).unsqueeze(1)
+        package_dimensions = torch.as_tensor(self.package_dimensions.reshape(self.num_envs, -1),
+                                             dtype=torch.float32, device=self.device)
+        return images, package_dimensions
+
+    @instrumented('VecContainerEnv.step')
+    def step(self, actions):
+        """
+        Places one package in every container.
+        Actions whose package sticks out of the container are not applied, they get invalid_action_reward and
+        end the episode. Finished containers are reset, the returned observations are the ones after the reset.
+
+        :param actions: (N, 4) integer array or tensor of (x, y, rotation, package_slot).
+        :return: The observations, the (N,) rewards and the (N,) done flags as tensors.
+        """
+        if isinstance(actions, torch.Tensor):
+            actions = actions.detach().cpu().numpy()
+        actions = numpy.asarray(actions, dtype=numpy.int64).reshape(self.num_envs, 4)
+        env_indices = numpy.arange(self.num_envs)
+        slots = actions[:, 3] % self.package_slots
+        dimensions = self.package_dimensions[env_indices, slots]
+        dimensions = dimensions[env_indices[:, numpy.newaxis], ROTATIONS[actions[:, 2] % len(ROTATIONS)]]
+        weights = self.package_weights[env_indices, slots]
+
+        # footprints in cells, same rounding as Container.get_footprint_cells for positions on the grid
+        x_start = numpy.clip(actions[:, 0], 0, self.resolution_x - 1)
+        y_start = numpy.clip(actions[:, 1], 0, self.resolution_y - 1)
+        x_end = x_start + numpy.maximum(numpy.ceil(dimensions[:, 0] / self.cell_size[0] - 1e-9), 1).astype(numpy.int64)
+        y_end = y_start + numpy.maximum(numpy.ceil(dimensions[:, 1] / self.cell_size[1] - 1e-9), 1).astype(numpy.int64)
+        footprints = (self.cells_x[numpy.newaxis, :, numpy.newaxis] >= x_start[:, numpy.newaxis, numpy.newaxis]) & \
+                     (self.cells_x[numpy.newaxis, :, numpy.newaxis] < x_end[:, numpy.newaxis, numpy.newaxis]) & \
+                     (self.cells_y[numpy.newaxis, numpy.newaxis, :] >= y_start[:, numpy.newaxis, numpy.newaxis]) & \
+                     (self.cells_y[numpy.newaxis, numpy.newaxis, :] < y_end[:, numpy.newaxis, numpy.newaxis])
+        landing_heights = numpy.where(footprints, self.height_maps, 0).max(axis=(1, 2))
+        tops = landing_heights + dimensions[:, 2]
+        valid = (x_end <= self.resolution_x) & (y_end <= self.resolution_y) & \
+                (tops <= self.container_dimensions[2])
+
+        # apply the valid placements
+        footprints &= valid[:, numpy.newaxis, numpy.newaxis]
+        self.height_maps = numpy.where(footprints, tops[:, numpy.newaxis, numpy.newaxis], self.height_maps)
+        centers = numpy.stack((x_start * self.cell_size[0] + dimensions[:, 0] / 2,
+                               y_start * self.cell_size[1] + dimensions[:, 1] / 2,
+                               landing_heights + dimensions[:, 2] / 2), axis=1)
+        added_weights = numpy.where(valid, weights, 0)
+        self.centers_of_gravity = (self.centers_of_gravity * self.total_weights[:, numpy.newaxis] +
+                                   centers * added_weights[:, numpy.newaxis]) / \
+                                  (self.total_weights + added_weights)[:, numpy.newaxis]
+        self.total_weights += added_weights
+        self.package_volumes += numpy.where(valid, numpy.prod(dimensions, axis=1), 0)
+        self.max_heights = numpy.where(valid, numpy.maximum(self.max_heights, tops), self.max_heights)
+        self.placed_counts += valid
+
+        # the reward of a valid placement is how much it changed the fitness of the layout
+        rewards = numpy.full(self.num_envs, self.invalid_action_reward, dtype=float)
+        if valid.any():
+            fitnesses = self.get_fitness(self.max_heights[valid], self.package_volumes[valid],
+                                         self.centers_of_gravity[valid])
+            rewards[valid] = fitnesses - self.fitnesses[valid]
+            self.fitnesses[valid] = fitnesses
+
+        # refill the used package slots
+        if valid.any():
+            new_dimensions, new_weights = self.training_instance.sample_packages(int(valid.sum()), self.rng)
+            self.package_dimensions[env_indices[valid], slots[valid]] = new_dimensions
+            self.package_weights[env_indices[valid], slots[valid]] = new_weights
+
+        dones = ~valid | (self.placed_counts >= self.package_counts)
+        if dones.any():
+            self.reset(dones)
+        return (self.get_observations(), torch.as_tensor(rewards, dtype=torch.float32, device=self.device),
+                torch.as_tensor(dones, device=self.device))
@@ -0,0 +1,214 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from packages import ORIENTATIONS, Package, TrainingInstance
+from solver import Layout
+
+
+def decode_individual(container_dimensions: numpy.array, package_dimensions: numpy.array,
+                      package_weights: numpy.array, target_center_of_gravity: numpy.array, order: numpy.array,
+                      rotations: numpy.array):
+    """
+    Packs the manifest in the order of an individual and scores the layout with TrainingInstance.update_fitness.
+    Every package goes to the lowest extreme point candidate of its rotation gene, if it only fits in another
+    rotation that one is used instead.
+
+    :param order: The (n,) manifest indices in placement order.
+    :param rotations: The (n,) rotation gene of every manifest index.
+    :return: The Layout.
+    """
+    instance = TrainingInstance(container_dimensions, None, None, None, target_center_of_gravity)
+    container = instance.container
+    placed = []
+    positions = []
+    placed_rotations = []
+    for index in order:
+        package = Package(package_weights[index], package_dimensions[index].copy())
+        candidate_positions, candidate_rotations = container.get_candidate_placements(package)
+        if len(candidate_rotations) == 0:
+            continue
+        preferred = candidate_rotations == rotations[index]
+        if preferred.any():
+            candidate_positions, candidate_rotations = candidate_positions[preferred], candidate_rotations[preferred]
+        best = numpy.lexsort((candidate_positions[:, 0], candidate_positions[:, 1], candidate_positions[:, 2]))[0]
+        container.add_package(package, candidate_positions[best][:2], int(candidate_rotations[best]))
+        placed.append(index)
+        positions.append(candidate_positions[best][:2])
+        placed_rotations.append(candidate_rotations[best])
+
+    fitness = -numpy.inf
+    if placed:
+        instance.update_fitness()
+        fitness = float(instance.fitness)
+    return Layout(fitness, -1, 'genetic', 'genetic', numpy.array(placed, dtype=numpy.int32),
+                  numpy.array(positions, dtype=float).reshape(-1, 2),
+                  numpy.array(placed_rotations, dtype=numpy.int8))
+
+
+# the manifest is sent once to every worker process instead of once per individual
+_worker_manifest = None
+
+
+def _initialize_worker(manifest):
+    global _worker_manifest
+    _worker_manifest = manifest
+
+
+def _decode_worker_individual(genes):
+    return decode_individual(*_worker_manifest, *genes)
+
+
+def order_crossover(parent_a: numpy.array, parent_b: numpy.array, rng: numpy.random.Generator):
+    """
+    Order crossover (OX) of two permutations: a slice of parent_a is kept in place and the remaining
+    positions are filled with the missing indices in the order they appear in parent_b.
+    """
+    size = len(parent_a)
+    start, end = numpy.sort(rng.choice(size + 1, 2, replace=False))
+    child = numpy.empty_like(parent_a)
+    child[start:end] = parent_a[start:end]
+    kept = numpy.zeros(size, dtype=bool)
+    kept[parent_a[start:end]] = True
+    remaining = parent_b[~kept[parent_b]]
+    child[:start] = remaining[:start]
+    child[end:] = remaining[start:]
+    return child
+
+
+class GeneticAlgorithm:
+    """
+    Evolves package orders and rotations for a manifest drawn from a TrainingInstance.
+    A generation is decoded and scored in one pooled step, history holds the per-generation timings and fitness.
+    """
+
+    def __init__(self, training_instance: TrainingInstance, population_size: int = 32, elite_count: int = 2,
+                 crossover_rate: float = 0.9, swap_mutation_rate: float = 0.2, rotation_mutation_rate: float = 0.05,
+                 tournament_size: int = 3, processes: int = None, seed: int = None,
+                 package_dimensions: numpy.array = None, package_weights: numpy.array = None):
+        self.training_instance = training_instance
+        self.population_size = population_size
+        self.elite_count = elite_count
+        self.crossover_rate = crossover_rate
+        self.swap_mutation_rate = swap_mutation_rate
+        self.rotation_mutation_rate = rotation_mutation_rate
+        self.tournament_size = tournament_size
+        self.processes = processes or os.cpu_count()
+        self.rng = numpy.random.default_rng(seed)
+        if package_dimensions is None:
+            count = training_instance.sample_package_count(self.rng)
+            package_dimensions, package_weights = training_instance.sample_packages(count, self.rng)
+        self.manifest = (numpy.asarray(training_instance.container_dimensions),
+                         numpy.asarray(package_dimensions, dtype=float), numpy.asarray(package_weights, dtype=float),
+                         numpy.asarray(training_instance.target_center_of_gravity, dtype=float))
+        package_count = len(self.manifest[2])
+        self.orders = numpy.array([self.rng.permutation(package_count) for _ in range(population_size)])
+        self.rotations = self.rng.integers(0, len(ORIENTATIONS), (population_size, package_count))
+        self.fitness = None
+        self.best_layout = None
+        self.history = []
+
+    def evaluate(self, executor: ProcessPoolExecutor = None):
+        """
+        Decodes and scores the whole population.
+
+        :param executor: The pool the individuals are decoded on, in this process if None.
+        :return: The list of layouts.
+        """
+        genes = list(zip(self.orders, self.rotations))
+        if executor is None:
+            layouts = [decode_individual(*self.manifest, *individual) for individual in genes]
+        else:
+            chunk_size = max(1, len(genes) // (4 * self.processes))
+            layouts = list(executor.map(_decode_worker_individual, genes, chunksize=chunk_size))
+        self.fitness = numpy.array([layout.fitness for layout in layouts])
+        best = int(numpy.argmax(self.fitness))
+        if self.best_layout is None or layouts[best].fitness > self.best_layout.fitness:
+            self.best_layout = layouts[best]
+        return layouts
+
+    def select(self):
+        """Tournament selection, get the index of one parent."""
+        contestants = self.rng.integers(0, self.population_size, self.tournament_size)
+        return contestants[numpy.argmax(self.fitness[contestants])]
+
+    def breed(self):
+        """Replaces the population by the next generation, the elite is copied unchanged."""
+        ranking = numpy.argsort(-self.fitness)
+        orders = [self.orders[index].copy() for index in ranking[:self.elite_count]]
+        rotations = [self.rotations[index].copy() for index in ranking[:self.elite_count]]
+        package_count = self.orders.shape[1]
+        while len(orders) < self.population_size:
+            parent_a, parent_b = self.select(), self.select()
+            if self.rng.random() < self.crossover_rate and package_count > 1:
+                order = order_crossover(self.orders[parent_a], self.orders[parent_b], self.rng)
+                rotation = numpy.where(self.rng.random(package_count) < 0.5,
+                                       self.rotations[parent_a], self.rotations[parent_b])
+            else:
+                order, rotation = self.orders[parent_a].copy(), self.rotations[parent_a].copy()
+            if self.rng.random() < self.swap_mutation_rate and package_count > 1:
+                first, second = self.rng.choice(package_count, 2, replace=False)
+                order[first], order[second] = order[second], order[first]
+            mutated = self.rng.random(package_count) < self.rotation_mutation_rate
+            rotation[mutated] = self.rng.integers(0, len(ORIENTATIONS), int(mutated.sum()))
+            orders.append(order)
+            rotations.append(rotation)
+        self.orders = numpy.array(orders)
+        self.rotations = numpy.array(rotations)
+
+    def run(self, generations: int = 50, patience: int = 10, tolerance: float = 1e-9, verbose: bool = False):
+        """
+        Evolves the population.
+
+        :param generations: The maximum number of generations.
+        :param patience: Stop after this many generations without an improvement of the best fitness.
+        :param tolerance: The smallest change of the best fitness that counts as an improvement.
+        :param verbose: Print a line per generation.
+        :return: The best Layout found.
+        """
+        executor = None
+        if self.processes > 1:
+            executor = ProcessPoolExecutor(self.processes, initializer=_initialize_worker,
+                                           initargs=(self.manifest,))
+        try:
+            best_fitness = -numpy.inf
+            stale_generations = 0
+            for generation in range(generations):
+                start_time = time.perf_counter()
+                if generation > 0:
+                    self.breed()
+                self.evaluate(executor)
+                elapsed = time.perf_counter() - start_time
+                self.history.append({'generation': generation, 'seconds': elapsed,
+                                     'best_fitness': float(self.fitness.max()),
+                                     'mean_fitness': float(self.fitness[numpy.isfinite(self.fitness)].mean()),
+                                     'best_fitness_so_far': self.best_layout.fitness})
+                if verbose:
+                    print(f'generation {generation}: best {self.fitness.max():.4f}, '
+                          f'best so far {self.best_layout.fitness:.4f}, {elapsed:.2f} s, '
+                          f'{self.population_size / elapsed:.1f} individuals/s')
+                if self.best_layout.fitness > best_fitness + tolerance:
+                    best_fitness = self.best_layout.fitness
+                    stale_generations = 0
+                else:
+                    stale_generations += 1
+                    if stale_generations >= patience:
+                        break
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return self.best_layout
+
+
+def genetic_test():
+    training_instance = TrainingInstance(numpy.array([100, 100, 100]), numpy.array([5, 20]), numpy.array([1, 10]),
+                                         numpy.array([100, 100]), numpy.array([50, 50, 20]))
+    algorithm = GeneticAlgorithm(training_instance, population_size=16, seed=0)
+    best = algorithm.run(generations=10, patience=5, verbose=True)
+    print(f'best fitness {best.fitness:.4f} with {len(best.order)} packages')
+
+
+if __name__ == '__main__':
+    genetic_test()
@@ -0,0 +1,230 @@
+import atexit
+import functools
+import json
+import os
+import random
+import time
+import tracemalloc
+
+import numpy
+
+# set CARGO_STATS to a file path to record the stats of the whole run and dump them there at exit
+STATS_ENVIRONMENT_VARIABLE = 'CARGO_STATS'
+
+
+class OperationStats:
+    """
+    Call count, timings and memory of one instrumented operation.
+    The memory is measured with tracemalloc while allocations are tracked, it covers the Python objects and the
+    numpy arrays. The peak bytes of a call are the most memory the call held at once on top of what was allocated
+    when it started, the retained bytes are what it still holds when it returns, negative if it freed more.
+    """
+
+    __slots__ = ('count', 'total_seconds', 'max_seconds', 'samples', 'total_peak_bytes', 'max_peak_bytes',
+                 'retained_bytes', 'rng')
+
+    max_samples = 10000
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        # reservoir of durations for the percentiles
+        self.samples = []
+        self.total_peak_bytes = 0
+        self.max_peak_bytes = 0
+        self.retained_bytes = 0
+        # private generator, recording stats does not change the random sequences of the instrumented code
+        self.rng = random.Random(0)
+
+    def record(self, seconds: float, peak_bytes: int = 0, retained_bytes: int = 0):
+        self.count += 1
+        self.total_seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+        self.total_peak_bytes += peak_bytes
+        if peak_bytes > self.max_peak_bytes:
+            self.max_peak_bytes = peak_bytes
+        self.retained_bytes += retained_bytes
+        if len(self.samples) < self.max_samples:
+            self.samples.append(seconds)
+        else:
+            index = self.rng.randrange(self.count)
+            if index < self.max_samples:
+                self.samples[index] = seconds
+
+    def to_dict(self):
+        percentiles = numpy.percentile(self.samples, [50, 90, 99]) if self.samples else [0.0, 0.0, 0.0]
+        return {'count': self.count, 'total_seconds': self.total_seconds,
+                'mean_seconds': self.total_seconds / self.count if self.count else 0.0,
+                'p50_seconds': float(percentiles[0]), 'p90_seconds': float(percentiles[1]),
+                'p99_seconds': float(percentiles[2]), 'max_seconds': self.max_seconds,
+                'mean_peak_bytes': self.total_peak_bytes / self.count if self.count else 0.0,
+                'max_peak_bytes': self.max_peak_bytes, 'retained_bytes': self.retained_bytes}
+
+
+class _State:
+    enabled = False
+    track_allocations = False
+    # whether enable started tracemalloc, disable only stops what it started
+    started_tracing = False
+    # [traced bytes at the start, highest peak seen] of the operations that are running, innermost last
+    allocation_frames = []
+    dump_path = None
+    stats = {}
+
+
+_state = _State()
+
+
+def is_enabled():
+    return _state.enabled
+
+
+def enable(track_allocations: bool = False, dump_path: str = None):
+    """
+    Starts recording the instrumented operations.
+
+    :param track_allocations: Also record the peak and retained memory of every operation with tracemalloc,
+        which slows down every allocation while it traces.
+    :param dump_path: Write the stats as JSON to this file when the interpreter exits.
+    """
+    _state.enabled = True
+    _state.track_allocations = track_allocations
+    if track_allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _state.started_tracing = True
+    if dump_path is not None:
+        if _state.dump_path is None:
+            atexit.register(_dump_at_exit)
+        _state.dump_path = dump_path
+
+
+def disable():
+    _state.enabled = False
+    _state.track_allocations = False
+    _state.allocation_frames = []
+    if _state.started_tracing:
+        tracemalloc.stop()
+        _state.started_tracing = False
+
+
+def reset():
+    _state.stats = {}
+
+
+def record(name: str, seconds: float, peak_bytes: int = 0, retained_bytes: int = 0):
+    """
+    Records one call of an operation, for code that is timed by hand.
+    """
+    stats = _state.stats.get(name)
+    if stats is None:
+        stats = _state.stats[name] = OperationStats()
+    stats.record(seconds, peak_bytes, retained_bytes)
+
+
+def _start_allocations():
+    """
+    Starts measuring the memory of an operation. tracemalloc has a single peak, it is reset for the new operation
+    after the peak so far was handed to the operation around it.
+    """
+    if not tracemalloc.is_tracing():
+        return
+    current, peak = tracemalloc.get_traced_memory()
+    frames = _state.allocation_frames
+    if frames and peak > frames[-1][1]:
+        frames[-1][1] = peak
+    tracemalloc.reset_peak()
+    frames.append([current, current])
+
+
+def _stop_allocations():
+    """
+    :return: The peak and the retained bytes of the operation started last.
+    """
+    frames = _state.allocation_frames
+    if not frames or not tracemalloc.is_tracing():
+        return 0, 0
+    current, peak = tracemalloc.get_traced_memory()
+    start, seen = frames.pop()
+    peak = max(peak, seen)
+    if frames and peak > frames[-1][1]:
+        frames[-1][1] = peak
+    return peak - start, current - start
+
+
+def get_stats():
+    """
+    :return: Dict of operation name to its stats dict.
+    """
+    return {name: stats.to_dict() for name, stats in sorted(_state.stats.items())}
+
+
+def dump(path: str):
+    with open(path, 'w') as file:
+        json.dump(get_stats(), file, indent=2)
+
+
+def _dump_at_exit():
+    if _state.dump_path is not None and _state.stats:
+        dump(_state.dump_path)
+
+
+def instrumented(name: str):
+    """
+    Decorator recording every call of a function under a name.
+    While the instrumentation is disabled the only cost is one flag check per call.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return function(*args, **kwargs)
+            track_allocations = _state.track_allocations
+            if track_allocations:
+                _start_allocations()
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start_time
+                if track_allocations:
+                    record(name, seconds, *_stop_allocations())
+                else:
+                    record(name, seconds)
+        return wrapper
+    return decorator
+
+
+class measure:
+    """
+    Context manager recording a block of code under a name, for hot paths that are not a function of their own.
+    """
+
+    __slots__ = ('name', 'start_time', 'track_allocations')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start_time = None
+        self.track_allocations = False
+
+    def __enter__(self):
+        if _state.enabled:
+            self.track_allocations = _state.track_allocations
+            if self.track_allocations:
+                _start_allocations()
+            self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        if _state.enabled and self.start_time is not None:
+            seconds = time.perf_counter() - self.start_time
+            if self.track_allocations:
+                record(self.name, seconds, *_stop_allocations())
+            else:
+                record(self.name, seconds)
+        return False
+
+
+if os.environ.get(STATS_ENVIRONMENT_VARIABLE):
+    enable(dump_path=os.environ[STATS_ENVIRONMENT_VARIABLE])
@@ -0,0 +1,157 @@
+import numpy
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# the kernels work on plain arrays and scalars so that they can be compiled by numba,
+# without numba the NumPy versions are used
+NUMBA_AVAILABLE = numba is not None
+
+
+def landing_height_numpy(height_map: numpy.array, x_start: int, x_end: int, y_start: int, y_end: int):
+    """
+    Get the highest value of the height map over a footprint.
+
+    :param height_map: The 2d height map.
+    :param x_start: The first cell in x direction.
+    :param x_end: The cell after the last one in x direction.
+    :param y_start: The first cell in y direction.
+    :param y_end: The cell after the last one in y direction.
+    :return: The landing height, 0 for an empty footprint.
+    """
+    footprint = height_map[x_start:x_end, y_start:y_end]
+    if footprint.size == 0:
+        return 0.0
+    return float(footprint.max())
+
+
+def place_footprint_numpy(height_map: numpy.array, top_package_map: numpy.array, x_start: int, x_end: int,
+                          y_start: int, y_end: int, height: float, package_index: int):
+    """
+    Writes the top of a package into the height map and the top package map over its footprint.
+    """
+    height_map[x_start:x_end, y_start:y_end] = height
+    top_package_map[x_start:x_end, y_start:y_end] = package_index
+
+
+def update_center_of_gravity_numpy(center_of_gravity: numpy.array, total_weight: float, package_center: numpy.array,
+                                   package_weight: float):
+    """
+    Adds a package to a center of gravity.
+
+    :param center_of_gravity: The center of gravity without the package.
+    :param total_weight: The total weight without the package.
+    :param package_center: The center of the package.
+    :param package_weight: The weight of the package.
+    :return: The new center of gravity.
+    """
+    return (center_of_gravity * total_weight + package_center * package_weight) / (total_weight + package_weight)
+
+
+def fitness_numpy(container_dimensions: numpy.array, max_height: float, package_volume: float,
+                  center_of_gravity: numpy.array, target_center_of_gravity: numpy.array):
+    """
+    The fitness of a layout, see TrainingInstance.update_fitness.
+    """
+    occupied_volume = container_dimensions[0] * container_dimensions[1] * max_height
+    density = package_volume / occupied_volume if occupied_volume > 0 else 0.0
+    distance = numpy.sqrt(numpy.sum((center_of_gravity - target_center_of_gravity) ** 2))
+    return density - distance / numpy.sqrt(numpy.sum(container_dimensions ** 2))
+
+
+def fitness_batch_numpy(container_dimensions: numpy.array, max_heights: numpy.array, package_volumes: numpy.array,
+                        centers_of_gravity: numpy.array, target_center_of_gravity: numpy.array):
+    """
+    The fitness of many layouts of the same container at once.
+
+    :param container_dimensions: The dimensions of the container.
+    :param max_heights: The (n,) height of the highest package top of every layout.
+    :param package_volumes: The (n,) summed package volume of every layout.
+    :param centers_of_gravity: The (n, 3) center of gravity of every layout.
+    :param target_center_of_gravity: The target center of gravity.
+    :return: The (n,) fitness values.
+    """
+    occupied_volumes = container_dimensions[0] * container_dimensions[1] * numpy.asarray(max_heights, dtype=float)
+    densities = numpy.divide(package_volumes, occupied_volumes, out=numpy.zeros(len(occupied_volumes)),
+                             where=occupied_volumes > 0)
+    distances = numpy.sqrt(numpy.sum((centers_of_gravity - target_center_of_gravity) ** 2, axis=1))
+    return densities - distances / numpy.sqrt(numpy.sum(container_dimensions ** 2))
+
+
+# loop versions of the kernels, these are the ones numba compiles
+
+def _landing_height_loop(height_map, x_start, x_end, y_start, y_end):
+    height = 0.0
+    for x in range(x_start, x_end):
+        for y in range(y_start, y_end):
+            if height_map[x, y] > height:
+                height = height_map[x, y]
+    return height
+
+
+def _place_footprint_loop(height_map, top_package_map, x_start, x_end, y_start, y_end, height, package_index):
+    for x in range(x_start, x_end):
+        for y in range(y_start, y_end):
+            height_map[x, y] = height
+            top_package_map[x, y] = package_index
+
+
+def _update_center_of_gravity_loop(center_of_gravity, total_weight, package_center, package_weight):
+    result = numpy.empty(3)
+    for axis in range(3):
+        result[axis] = (center_of_gravity[axis] * total_weight + package_center[axis] * package_weight) / \
+            (total_weight + package_weight)
+    return result
+
+
+def _fitness_loop(container_dimensions, max_height, package_volume, center_of_gravity, target_center_of_gravity):
+    squared_distance = 0.0
+    squared_diagonal = 0.0
+    for axis in range(3):
+        squared_distance += (center_of_gravity[axis] - target_center_of_gravity[axis]) ** 2
+        squared_diagonal += container_dimensions[axis] ** 2
+    occupied_volume = container_dimensions[0] * container_dimensions[1] * max_height
+    density = 0.0
+    if occupied_volume > 0:
+        density = package_volume / occupied_volume
+    return density - numpy.sqrt(squared_distance) / numpy.sqrt(squared_diagonal)
+
+
+def _fitness_batch_loop(container_dimensions, max_heights, package_volumes, centers_of_gravity,
+                        target_center_of_gravity):
+    fitness = numpy.empty(len(max_heights))
+    for index in range(len(max_heights)):
+        fitness[index] = _fitness_loop(container_dimensions, max_heights[index], package_volumes[index],
+                                       centers_of_gravity[index], target_center_of_gravity)
+    return fitness
+
+
+if NUMBA_AVAILABLE:
+    # error_model='numpy' makes a division by zero return inf or nan like the NumPy versions instead of raising
+    landing_height_jit = numba.njit(cache=True, error_model='numpy')(_landing_height_loop)
+    place_footprint_jit = numba.njit(cache=True, error_model='numpy')(_place_footprint_loop)
+    update_center_of_gravity_jit = numba.njit(cache=True, error_model='numpy')(_update_center_of_gravity_loop)
+    _fitness_loop = numba.njit(cache=True, error_model='numpy')(_fitness_loop)
+    fitness_jit = _fitness_loop
+    fitness_batch_jit = numba.njit(cache=True, error_model='numpy')(_fitness_batch_loop)
+
+    landing_height = landing_height_jit
+    place_footprint = place_footprint_jit
+    update_center_of_gravity = update_center_of_gravity_jit
+    fitness = fitness_jit
+    fitness_batch = fitness_batch_jit
+else:
+    landing_height_jit = _landing_height_loop
+    place_footprint_jit = _place_footprint_loop
+    update_center_of_gravity_jit = _update_center_of_gravity_loop
+    fitness_jit = _fitness_loop
+    fitness_batch_jit = _fitness_batch_loop
+
+    landing_height = landing_height_numpy
+    place_footprint = place_footprint_numpy
+    update_center_of_gravity = update_center_of_gravity_numpy
+    fitness = fitness_numpy
+    fitness_batch = fitness_batch_numpy
+
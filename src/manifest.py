@@ -0,0 +1,174 @@
+import csv
+import gzip
+import json
+from itertools import islice
+
+import numpy
+
+from packages import Container, Package, PackageStore
+
+# accepted column names of the package dimensions, the first matching set is used
+DIMENSION_COLUMNS = (('x', 'y', 'z'), ('length', 'width', 'height'), ('dx', 'dy', 'dz'))
+
+
+class ManifestChunk:
+    """A block of manifest rows in columnar form."""
+
+    __slots__ = ('weights', 'dimensions', 'descriptions')
+
+    def __init__(self, weights: numpy.array, dimensions: numpy.array, descriptions: list):
+        self.weights = weights
+        self.dimensions = dimensions
+        self.descriptions = descriptions
+
+    def __len__(self):
+        return len(self.weights)
+
+
+def open_manifest(path: str):
+    if str(path).endswith('.gz'):
+        return gzip.open(path, 'rt', newline='')
+    return open(path, newline='')
+
+
+def get_format(path: str):
+    name = str(path)
+    if name.endswith('.gz'):
+        name = name[:-3]
+    if name.endswith('.jsonl') or name.endswith('.ndjson'):
+        return 'jsonl'
+    if name.endswith('.csv'):
+        return 'csv'
+    raise ValueError(f'unknown manifest format of {path}, expected .csv or .jsonl')
+
+
+def get_dimension_columns(columns):
+    for names in DIMENSION_COLUMNS:
+        if all(name in columns for name in names):
+            return names
+    raise ValueError(f'manifest has no dimension columns, expected one of {DIMENSION_COLUMNS}')
+
+
+def _iter_csv_chunks(file, chunk_size: int):
+    reader = csv.reader(file)
+    header = [column.strip() for column in next(reader)]
+    dimension_indices = [header.index(name) for name in get_dimension_columns(header)]
+    weight_index = header.index('weight')
+    description_index = header.index('description') if 'description' in header else None
+    while True:
+        rows = list(islice(reader, chunk_size))
+        if not rows:
+            return
+        rows = [row for row in rows if row]
+        values = numpy.array([[row[weight_index]] + [row[index] for index in dimension_indices] for row in rows],
+                             dtype=float).reshape(-1, 4)
+        descriptions = [''] * len(rows) if description_index is None else [row[description_index] for row in rows]
+        yield ManifestChunk(values[:, 0], values[:, 1:], descriptions)
+
+
+def _iter_jsonl_chunks(file, chunk_size: int):
+    dimension_columns = None
+    while True:
+        records = [json.loads(line) for line in islice(file, chunk_size) if line.strip()]
+        if not records:
+            return
+        weights = numpy.array([record['weight'] for record in records], dtype=float)
+        if 'dimensions' in records[0]:
+            dimensions = numpy.array([record['dimensions'] for record in records], dtype=float)
+        else:
+            if dimension_columns is None:
+                dimension_columns = get_dimension_columns(records[0])
+            dimensions = numpy.array([[record[name] for name in dimension_columns] for record in records],
+                                     dtype=float)
+        descriptions = [str(record.get('description', '')) for record in records]
+        yield ManifestChunk(weights, dimensions.reshape(-1, 3), descriptions)
+
+
+def iter_manifest_chunks(path: str, chunk_size: int = 10000, manifest_format: str = None):
+    """
+    Reads a manifest lazily, chunk_size rows at a time.
+    CSV files need a header with a weight column and x, y, z (or length, width, height or dx, dy, dz) columns,
+    JSONL records the same keys or a dimensions list. A description column is optional, .gz files are
+    decompressed on the fly.
+
+    :param path: The manifest file.
+    :param chunk_size: The number of rows parsed at once, it bounds the memory used by the reader.
+    :param manifest_format: 'csv' or 'jsonl', taken from the file extension if None.
+    :return: Generator of ManifestChunk.
+    """
+    manifest_format = manifest_format or get_format(path)
+    with open_manifest(path) as file:
+        if manifest_format == 'csv':
+            yield from _iter_csv_chunks(file, chunk_size)
+        elif manifest_format == 'jsonl':
+            yield from _iter_jsonl_chunks(file, chunk_size)
+        else:
+            raise ValueError(f'unknown manifest format {manifest_format}')
+
+
+def iter_manifest(path: str, chunk_size: int = 10000, manifest_format: str = None):
+    """
+    Reads a manifest lazily as Package records.
+
+    :return: Generator of Package.
+    """
+    for chunk in iter_manifest_chunks(path, chunk_size, manifest_format):
+        for weight, dimensions, description in zip(chunk.weights, chunk.dimensions, chunk.descriptions):
+            yield Package(weight, dimensions.copy(), description)
+
+
+def load_manifest(path: str, store: PackageStore = None, chunk_size: int = 10000, manifest_format: str = None):
+    """
+    Reads a whole manifest into a columnar PackageStore chunk by chunk, without creating Package objects.
+
+    :param store: The store to append to, a new one if None.
+    :return: The store.
+    """
+    if store is None:
+        store = PackageStore()
+    for chunk in iter_manifest_chunks(path, chunk_size, manifest_format):
+        store.extend(chunk.weights, chunk.dimensions, descriptions=chunk.descriptions)
+    return store
+
+
+def pack_manifest(container: Container, packages, placement=None):
+    """
+    Places a stream of packages into a container as they arrive, the stream is never held in memory.
+
+    :param container: The container to fill.
+    :param packages: Iterable of Package, e.g. iter_manifest(path).
+    :param placement: Function (container, package) -> (position, rotation) or None,
+        Container.get_lowest_placement by default.
+    :return: The number of placed packages and the number of packages that did not fit.
+    """
+    if placement is None:
+        placement = Container.get_lowest_placement
+    placed = 0
+    rejected = 0
+    for package in packages:
+        result = placement(container, package)
+        if result is None:
+            rejected += 1
+            continue
+        container.add_package(package, result[0][:2], result[1])
+        placed += 1
+    return placed, rejected
+
+
+def manifest_test(path: str = 'manifest_test.csv', size: int = 100000):
+    rng = numpy.random.default_rng(0)
+    with open(path, 'w') as file:
+        file.write('description,weight,length,width,height\n')
+        for index in range(size):
+            dimensions = rng.integers(1, 10, 3)
+            file.write(f'package {index},{rng.uniform(1, 10):.2f},{dimensions[0]},{dimensions[1]},{dimensions[2]}\n')
+    store = load_manifest(path)
+    print(f'{len(store)} packages, total volume {store.get_total_volume():.0f}, '
+          f'total weight {store.get_total_weight():.1f}')
+    container = Container(numpy.array([100, 100, 100]), numpy.array([0, 0, 0]))
+    placed, rejected = pack_manifest(container, islice(iter_manifest(path), 1000))
+    print(f'{placed} packages placed, {rejected} did not fit, max height {container.max_height}')
+
+
+if __name__ == '__main__':
+    manifest_test()
@@ -4,158 +4,1031 @@ from enum import Enum
 from itertools import combinations, product
 from multiprocessing import freeze_support
 from time import sleep
+from typing import NamedTuple
 
 import numpy
 import numpy as np
-from direct.showbase.ShowBase import ShowBase
-from direct.stdpy import threading
-from matplotlib import pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+from numpy.lib.stride_tricks import sliding_window_view
 
-from viewer_camera import World
+import kernels
+from instrumentation import instrumented
+from range_max import RangeMaxTable
+from spatial_index import SpatialIndex, UniformGridIndex
+from validation import validate_layout
 
-fig = plt.figure()
-ax = Axes3D(fig, auto_add_to_figure=False)
+# the six axis-aligned orientations as permutations of the package dimensions, the oriented dimensions are
+# dimensions[ORIENTATIONS[orientation]]. The first three are the numpy.roll rotations, the last three swap two axes
+ORIENTATIONS = numpy.array([[0, 1, 2], [2, 0, 1], [1, 2, 0], [0, 2, 1], [1, 0, 2], [2, 1, 0]])
+# ORIENTATION_PRODUCTS[a, b] is the orientation of a package in orientation a rotated by b
+ORIENTATION_PRODUCTS = numpy.array([[numpy.flatnonzero((ORIENTATIONS == first[second]).all(axis=1))[0]
+                                     for second in ORIENTATIONS] for first in ORIENTATIONS])
+# INVERSE_ORIENTATIONS[a] rotates a package in orientation a back to its original dimensions
+INVERSE_ORIENTATIONS = numpy.argmin(ORIENTATION_PRODUCTS, axis=1)
 
 
-def get_cuboid_triangulated_vertices(position: numpy.array, dimension: numpy.array):
+class OrientationScores(NamedTuple):
     """
-    Get the triangulated vertices of a cuboid.
+    The outcome of placing a package at one position in each of its orientations, see
+    Container.evaluate_orientations. Orientations that do not fit have a fitness of -inf.
+    """
+    dimensions: numpy.ndarray
+    landing_heights: numpy.ndarray
+    support_ratios: numpy.ndarray
+    fitness: numpy.ndarray
+    feasible: numpy.ndarray
+
+    def get_best(self):
+        """
+        :return: The fittest feasible orientation, None if none fits.
+        """
+        if not self.feasible.any():
+            return None
+        return int(numpy.argmax(self.fitness))
+
+
+class UndoRecord(NamedTuple):
+    """
+    What Container.add_package changed, saved while the container keeps an undo log.
+    Only the footprint of the package is saved from the maps, so a record costs O(footprint) and not O(container).
+    """
+    package: 'Package'
+    rotation: int
+    package_position: numpy.ndarray
+    footprint: tuple
+    height_map: numpy.ndarray
+    top_package_map: numpy.ndarray
+    pixels: tuple
+    image: numpy.ndarray
+    supporters: numpy.ndarray
+    stacked_loads: numpy.ndarray
+    scalars: tuple
+    extreme_points: tuple
+
 
-    :param position: The position of the bottom left corner of the cuboid.
-    :param dimension: The dimension of the cuboid.
-    :return: The vertices of the cuboid.
+# the packing model never imports matplotlib or panda3d, the plotting module and the viewer are only
+# imported when something is drawn
+
+
+def get_pixel_ranges(x_map: numpy.array, y_map: numpy.array, positions: numpy.array, dimensions: numpy.array):
     """
-    x, y, z = position
-    dx, dy, dz = dimension
-
-    cuboid_vertices = numpy.array([
-        [x, y, z],
-        [x + dx, y, z],
-        [x, y + dy, z],
-        [x, y, z + dz],
-        [x + dx, y + dy, z],
-        [x + dx, y, z + dz],
-        [x, y + dy, z + dz],
-        [x + dx, y + dy, z + dz],
-
-    ])
-
-    triangles = numpy.array([
-        [1, 4, 2],
-        [0, 1, 2],
-        [4, 2, 7],
-        [6, 2, 7],
-        [6, 2, 0],
-        [6, 0, 3],
-        [3, 1, 0],
-        [3, 1, 5],
-        [4, 1, 5],
-        [4, 5, 7],
-        [5, 3, 7],
-        [3, 6, 7],
-    ])
-
-    vertices = []
-    for triangle in triangles:
-        vertices.append([cuboid_vertices[vertex] for vertex in triangle])
-    return vertices
+    Get the range of image pixels whose sample point lies inside each footprint, borders included.
+
+    :param x_map: The sample points of the image in x direction.
+    :param y_map: The sample points of the image in y direction.
+    :param positions: The (n, 2+) positions of the bottom left corners of the footprints.
+    :param dimensions: The (n, 2+) dimensions of the footprints.
+    :return: (x_start, x_end, y_start, y_end) pixel indices of every footprint, the end is exclusive.
+    """
+    positions = numpy.asarray(positions, dtype=float).reshape(-1, positions.shape[-1])
+    dimensions = numpy.asarray(dimensions, dtype=float).reshape(-1, dimensions.shape[-1])
+    x_start = numpy.searchsorted(x_map, positions[:, 0], side='left')
+    x_end = numpy.searchsorted(x_map, positions[:, 0] + dimensions[:, 0], side='right')
+    y_start = numpy.searchsorted(y_map, positions[:, 1], side='left')
+    y_end = numpy.searchsorted(y_map, positions[:, 1] + dimensions[:, 1], side='right')
+    return x_start, x_end, y_start, y_end
+
+
+def rasterize_top_down_view(positions: numpy.array, dimensions: numpy.array, weights: numpy.array,
+                            container_dimensions: numpy.array, resolution_x: int, resolution_y: int):
+    """
+    Paints all package footprints into a top-down image in one pass.
+    A pixel shows the last package (in placement order) covering its sample point.
+
+    :param positions: The (n, 3) positions of the packages.
+    :param dimensions: The (n, 3) dimensions of the packages.
+    :param weights: The (n,) weights of the packages.
+    :param container_dimensions: The dimensions of the container.
+    :param resolution_x: The resolution in x direction.
+    :param resolution_y: The resolution in y direction.
+    :return: The 2d image, see Container.generate_top_down_view.
+    """
+    image = numpy.zeros((resolution_x, resolution_y, 3), dtype=numpy.float32)
+    if len(weights) == 0:
+        return image
+    positions = numpy.asarray(positions, dtype=float)
+    x_map = np.linspace(0, container_dimensions[0], resolution_x)
+    y_map = np.linspace(0, container_dimensions[1], resolution_y)
+    x_start, x_end, y_start, y_end = get_pixel_ranges(x_map, y_map, positions, dimensions)
+    width_x = numpy.maximum(x_end - x_start, 0)
+    width_y = numpy.maximum(y_end - y_start, 0)
+
+    # expand every footprint into its covered pixels and keep the latest package per pixel
+    counts = width_x * width_y
+    package_indices = numpy.repeat(numpy.arange(len(counts)), counts)
+    offsets = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    pixel_x = x_start[package_indices] + offsets // width_y[package_indices]
+    pixel_y = y_start[package_indices] + offsets % width_y[package_indices]
+    top_package = numpy.full((resolution_x, resolution_y), -1, dtype=numpy.int64)
+    numpy.maximum.at(top_package, (pixel_x, pixel_y), package_indices)
+
+    heights = (container_dimensions[2] - positions[:, 2]) / container_dimensions[2]
+    covered = top_package >= 0
+    image[covered, 0] = heights[top_package[covered]]
+    image[:, :, 1] = numpy.sum(weights)
+    return image
 
 
 class Package:
-    """Rectangle Package class."""
+    """
+    Rectangle Package class.
+
+    A package is a lightweight handle, once it is added to a container its data lives in the PackageStore of the
+    container and the handle only keeps its index.
+    """
+
+    __slots__ = ('_store', '_index', '_weight', '_dimensions', '_position', '_orientation', '_description')
 
     def __init__(self, weight: float, dimensions: numpy.array, description: str = ''):
-        self.weight = weight
-        self.description = description
-        self.dimensions = dimensions
-        self.position = numpy.array([0, 0, 0], dtype=float)
+        self._store = None
+        self._index = -1
+        self._weight = weight
+        self._description = description
+        self._dimensions = numpy.asarray(dimensions)
+        self._position = numpy.array([0, 0, 0], dtype=float)
+        self._orientation = 0
+
+    @classmethod
+    def view(cls, store: 'PackageStore', index: int):
+        """
+        Get a handle on a package of a store without copying its data.
+
+        :param store: The store holding the package.
+        :param index: The index of the package in the store.
+        :return: The package.
+        """
+        package = cls.__new__(cls)
+        package._store = store
+        package._index = index
+        return package
+
+    def bind(self, store: 'PackageStore', index: int):
+        """
+        Moves the package data into a store, the package becomes a view on it.
+
+        :param store: The store holding the package from now on.
+        :param index: The index of the package in the store.
+        """
+        self._store = store
+        self._index = index
+        self._weight = self._dimensions = self._position = self._orientation = self._description = None
+
+    def unbind(self):
+        """
+        Copies the package data out of its store, the package no longer is a view.
+        """
+        if self._store is None:
+            return
+        store, index = self._store, self._index
+        self._weight = store.weights[index]
+        self._dimensions = store.dimensions[index].copy()
+        self._position = store.positions[index].copy()
+        self._orientation = int(store.orientations[index])
+        self._description = store.descriptions[index]
+        self._store = None
+        self._index = -1
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def weight(self):
+        if self._store is None:
+            return self._weight
+        return self._store.weights[self._index]
+
+    @weight.setter
+    def weight(self, weight: float):
+        if self._store is None:
+            self._weight = weight
+        else:
+            self._store.weights[self._index] = weight
+
+    @property
+    def dimensions(self):
+        if self._store is None:
+            return self._dimensions
+        return self._store.dimensions[self._index]
+
+    @dimensions.setter
+    def dimensions(self, dimensions: numpy.array):
+        if self._store is None:
+            self._dimensions = numpy.asarray(dimensions)
+        else:
+            self._store.dimensions[self._index] = dimensions
+
+    @property
+    def position(self):
+        if self._store is None:
+            return self._position
+        return self._store.positions[self._index]
+
+    @position.setter
+    def position(self, position: numpy.array):
+        if self._store is None:
+            self._position = numpy.asarray(position, dtype=float)
+        else:
+            self._store.positions[self._index] = position
+
+    @property
+    def orientation(self):
+        if self._store is None:
+            return self._orientation
+        return int(self._store.orientations[self._index])
+
+    @orientation.setter
+    def orientation(self, orientation: int):
+        if self._store is None:
+            self._orientation = orientation
+        else:
+            self._store.orientations[self._index] = orientation
+
+    @property
+    def description(self):
+        if self._store is None:
+            return self._description
+        return self._store.descriptions[self._index]
+
+    @property
+    def support_ratio(self):
+        """The fraction of the base resting on the floor or on other packages, 1 before the package is placed."""
+        if self._store is None:
+            return 1.0
+        return self._store.support_ratios[self._index]
+
+    @property
+    def overhang(self):
+        return 1.0 - self.support_ratio
+
+    @property
+    def stacked_load(self):
+        """The weight of the packages resting directly on this one, shared by supported area."""
+        if self._store is None:
+            return 0.0
+        return self._store.stacked_loads[self._index]
 
     def __str__(self):
         return f'Package( {self.weight}, {self.dimensions}, {self.description})'
 
     def rotate(self, axis: int):
-        self.dimensions = numpy.roll(self.dimensions, axis)
+        """
+        Rotates the package in place into one of the ORIENTATIONS relative to its current dimensions.
+        """
+        self.dimensions = self.dimensions[ORIENTATIONS[axis]]
+        self.orientation = ORIENTATION_PRODUCTS[self.orientation, axis]
+
+    def get_rotated_dimensions(self, axis: int):
+        """
+        Get the dimensions the package would have after rotate(axis), without rotating it.
+        """
+        return self.dimensions[ORIENTATIONS[axis]]
+
+    def get_orientation_table(self):
+        """
+        Get the dimensions of the package in all ORIENTATIONS, without rotating it.
+
+        :return: The (6, 3) dimensions, row i is get_rotated_dimensions(i).
+        """
+        return numpy.asarray(self.dimensions, dtype=float)[ORIENTATIONS]
 
     def get_volume(self):
         return numpy.prod(self.dimensions)
 
-    def plot_center(self):
-        ax.scatter(self.get_center()[0], self.get_center()[
-                   1], self.get_center()[2], color='red')
-
     def get_center(self):
         center = self.position + self.dimensions / 2
         return center
 
 
+class PackageStore:
+    """
+    Struct-of-arrays storage of the packages of a container.
+    The arrays are preallocated and grow geometrically, iterating over the store yields Package views.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        self._positions = numpy.zeros((capacity, 3), dtype=float)
+        self._dimensions = numpy.zeros((capacity, 3), dtype=float)
+        self._weights = numpy.zeros(capacity, dtype=float)
+        self._orientations = numpy.zeros(capacity, dtype=numpy.int8)
+        # stability metrics filled in by Container.add_package
+        self._support_ratios = numpy.ones(capacity, dtype=float)
+        self._stacked_loads = numpy.zeros(capacity, dtype=float)
+        self.descriptions = []
+
+    @property
+    def capacity(self):
+        return len(self._weights)
+
+    @property
+    def positions(self):
+        return self._positions[:self.size]
+
+    @property
+    def dimensions(self):
+        return self._dimensions[:self.size]
+
+    @property
+    def weights(self):
+        return self._weights[:self.size]
+
+    @property
+    def orientations(self):
+        return self._orientations[:self.size]
+
+    @property
+    def support_ratios(self):
+        return self._support_ratios[:self.size]
+
+    @property
+    def stacked_loads(self):
+        return self._stacked_loads[:self.size]
+
+    def reserve(self, capacity: int):
+        """
+        Makes sure the store can hold at least capacity packages without reallocating.
+
+        :param capacity: The number of packages.
+        """
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, 2 * self.capacity)
+        for name in ('_positions', '_dimensions', '_weights', '_orientations', '_support_ratios', '_stacked_loads'):
+            array = getattr(self, name)
+            grown = numpy.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            setattr(self, name, grown)
+
+    def append(self, weight: float, dimensions: numpy.array, position: numpy.array, orientation: int = 0,
+               description: str = '', support_ratio: float = 1.0):
+        """
+        Appends a package to the store.
+
+        :return: The index of the package.
+        """
+        self.reserve(self.size + 1)
+        index = self.size
+        self._weights[index] = weight
+        self._dimensions[index] = dimensions
+        self._positions[index] = position
+        self._orientations[index] = orientation
+        self._support_ratios[index] = support_ratio
+        self._stacked_loads[index] = 0
+        self.descriptions.append(description)
+        self.size += 1
+        return index
+
+    def extend(self, weights: numpy.array, dimensions: numpy.array, positions: numpy.array = None,
+               descriptions: list = None):
+        """
+        Appends many packages at once.
+
+        :param weights: The (k,) weights.
+        :param dimensions: The (k, 3) dimensions.
+        :param positions: The (k, 3) positions, zeros if None.
+        :param descriptions: The k descriptions, empty if None.
+        :return: The indices of the packages.
+        """
+        count = len(weights)
+        self.reserve(self.size + count)
+        indices = numpy.arange(self.size, self.size + count)
+        self._weights[indices] = weights
+        self._dimensions[indices] = dimensions
+        self._positions[indices] = 0 if positions is None else positions
+        self._orientations[indices] = 0
+        self._support_ratios[indices] = 1
+        self._stacked_loads[indices] = 0
+        self.descriptions.extend([''] * count if descriptions is None else descriptions)
+        self.size += count
+        return indices
+
+    def add(self, package: Package, support_ratio: float = 1.0):
+        """
+        Moves a package into the store and turns it into a view.
+
+        :param package: The package to add.
+        :param support_ratio: The supported fraction of the package base.
+        :return: The index of the package.
+        """
+        index = self.append(package.weight, package.dimensions, package.position, package.orientation,
+                            package.description, support_ratio)
+        package.bind(self, index)
+        return index
+
+    def pop(self):
+        """
+        Removes the last package of the store, the handles on it must be unbound before.
+        """
+        self.size -= 1
+        self.descriptions.pop()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('package index out of range')
+        return Package.view(self, index)
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield Package.view(self, index)
+
+    def __repr__(self):
+        return f'PackageStore({self.size} packages)'
+
+    def get_volumes(self):
+        return numpy.prod(self.dimensions, axis=1)
+
+    def get_total_volume(self):
+        return self.get_volumes().sum()
+
+    def get_total_weight(self):
+        return self.weights.sum()
+
+    def get_centers(self):
+        return self.positions + self.dimensions / 2
+
+    def get_bounding_boxes(self):
+        """
+        Get the axis aligned bounding boxes of all packages.
+
+        :return: (n, 2, 3) array with the minimum and the maximum corner of every package.
+        """
+        return numpy.stack((self.positions, self.positions + self.dimensions), axis=1)
+
+    def get_bounding_box(self):
+        """
+        Get the bounding box of all packages.
+
+        :return: (2, 3) array with the minimum and the maximum corner, None if the store is empty.
+        """
+        if self.size == 0:
+            return None
+        boxes = self.get_bounding_boxes()
+        return numpy.stack((boxes[:, 0].min(axis=0), boxes[:, 1].max(axis=0)))
+
+
+class ExtremePoints:
+    """
+    Extreme points (corner points) of a container, the positions where the next package can be placed snugly.
+
+    Every placed package spawns the points at its three outer corners and the projections of its x and y corners
+    onto the container walls. Points that end up inside a placed package are dropped.
+    """
+
+    def __init__(self, container_dimensions: numpy.array):
+        self.container_dimensions = numpy.asarray(container_dimensions, dtype=float)
+        self._points = numpy.zeros((1, 3), dtype=float)
+        # placements are only applied to the points when the points are requested,
+        # so that add_package does not pay for the points of the whole container
+        self.pending = []
+
+    def __len__(self):
+        return len(self.points)
+
+    @property
+    def points(self):
+        """The (m, 3) extreme points, sorted and without duplicates."""
+        if self.pending:
+            points = self._points
+            for position, dimensions in self.pending:
+                points = self.apply(points, position, dimensions)
+            self._points = numpy.unique(points, axis=0)
+            self.pending = []
+        return self._points
+
+    def update(self, position: numpy.array, dimensions: numpy.array):
+        """
+        Updates the points after a package was placed.
+
+        :param position: The position of the placed package.
+        :param dimensions: The dimensions of the placed package.
+        """
+        self.pending.append((numpy.array(position, dtype=float), numpy.array(dimensions, dtype=float)))
+
+    def apply(self, points: numpy.array, position: numpy.array, dimensions: numpy.array):
+        x, y, z = position
+        dx, dy, dz = dimensions
+        # points under the top of the new package and inside its footprint can no longer be reached
+        inside = (points[:, 0] >= x) & (points[:, 0] < x + dx) & \
+                 (points[:, 1] >= y) & (points[:, 1] < y + dy) & (points[:, 2] < z + dz)
+        new_points = numpy.array([
+            [x + dx, y, z],
+            [x, y + dy, z],
+            [x, y, z + dz],
+            [x + dx, 0, z],
+            [0, y + dy, z],
+        ])
+        in_container = numpy.all(new_points < self.container_dimensions, axis=1)
+        return numpy.concatenate((points[~inside], new_points[in_container]))
+
+
 class Container:
     """Pallet class"""
 
-    # TODO: make numba compatible
-    def __init__(self, dimensions: numpy.array, position: numpy.array, image_resolution_x: int = 100, image_resolution_y: int = 100):
-        self.packages = []
+    def __init__(self, dimensions: numpy.array, position: numpy.array, image_resolution_x: int = 100, image_resolution_y: int = 100,
+                 package_capacity: int = 1024, spatial_index: type = UniformGridIndex,
+                 range_max_bytes: int = 64 * 2 ** 20):
+        self.packages = PackageStore(package_capacity)
         self.dimensions = dimensions
         self.position = position  # is the bottom left corner of the container
-        self.total_package_weight = 500
+        self.empty_weight = 500
+        self.total_package_weight = self.empty_weight
         self.total_package_volume = 0
-        self.center_of_gravity = self.get_center()
+        # relative to the bottom left corner of the container, like the package positions
+        self.center_of_gravity = self.get_local_center()
         self.highest_package = None
+        self.max_height = 0.0  # top of the highest package
         self.image = numpy.zeros(
             (image_resolution_x, image_resolution_y, 3), dtype=numpy.float32)
         self.x_map = np.linspace(0, self.dimensions[0], image_resolution_x)
         self.y_map = np.linspace(0, self.dimensions[1], image_resolution_y)
+        # discretized floor of the container, each cell holds the height of the highest package top over it
+        # and the index (in self.packages) of that package, -1 if the cell is empty
+        self.cell_size = numpy.array([self.dimensions[0] / image_resolution_x,
+                                      self.dimensions[1] / image_resolution_y], dtype=float)
+        self.height_map = numpy.zeros(
+            (image_resolution_x, image_resolution_y), dtype=float)
+        self.top_package_map = numpy.full(
+            (image_resolution_x, image_resolution_y), -1, dtype=numpy.int64)
+        # sparse table of height map maxima for constant time footprint queries, its levels are capped to
+        # range_max_bytes and it is left out if not even the first level fits
+        max_level = RangeMaxTable.get_max_level(self.height_map.shape, range_max_bytes, self.height_map.itemsize)
+        self.range_max = None if max_level is not None and max_level < 1 else RangeMaxTable(self.height_map, max_level)
+        # the weight channel of self.image is the same everywhere, it is only refreshed when the view is requested
+        self.image_weight_dirty = False
+        # index over the package bounding boxes for support, overlap and neighbour queries
+        self.spatial_index: SpatialIndex = spatial_index(self.packages, self.dimensions)
+        self.extreme_points = ExtremePoints(self.dimensions)
+        # running stability aggregates, a package is unstable if less than stability_threshold of its base is supported
+        self.stability_threshold = 0.75
+        self.min_support_ratio = 1.0
+        self.support_ratio_sum = 0.0
+        self.unstable_package_count = 0
+        self.max_stacked_load = 0.0
+        # objects notified after every add_package, e.g. plotting.MatplotlibObserver
+        self.observers = []
+        # UndoRecords of the placements since the first checkpoint, None while no checkpoint was taken
+        self.undo_log = None
+
+    def add_observer(self, observer):
+        """
+        Registers an observer, its on_package_added(container, package) method is called after every placement.
+        """
+        self.observers.append(observer)
 
     def get_center(self):
         return self.position + self.dimensions / 2
 
+    def get_local_center(self):
+        return numpy.asarray(self.dimensions, dtype=float) / 2
+
+    def get_summed_weight(self):
+        return self.total_package_weight
+
+    def get_footprint_cells(self, position_2d: numpy.array, dimensions: numpy.array):
+        """
+        Get the range of height map cells covered by a footprint.
+
+        :param position_2d: The position of the bottom left corner of the footprint.
+        :param dimensions: The dimensions of the package, only x and y are used.
+        :return: (x_start, x_end, y_start, y_end) cell indices, the end is exclusive.
+        """
+        resolution_x, resolution_y = self.height_map.shape
+        # the epsilon keeps footprints that end exactly on a cell border from spilling into the next cell
+        x_start = int(numpy.floor(position_2d[0] / self.cell_size[0] + 1e-9))
+        y_start = int(numpy.floor(position_2d[1] / self.cell_size[1] + 1e-9))
+        x_end = int(numpy.ceil((position_2d[0] + dimensions[0]) / self.cell_size[0] - 1e-9))
+        y_end = int(numpy.ceil((position_2d[1] + dimensions[1]) / self.cell_size[1] - 1e-9))
+        x_start, x_end = min(max(x_start, 0), resolution_x), min(max(x_end, x_start + 1), resolution_x)
+        y_start, y_end = min(max(y_start, 0), resolution_y), min(max(y_end, y_start + 1), resolution_y)
+        return x_start, x_end, y_start, y_end
+
+    def get_footprint_cells_batch(self, positions_2d: numpy.array, dimensions: numpy.array):
+        """
+        Vectorized get_footprint_cells for many footprints.
+
+        :param positions_2d: The (k, 2) positions of the bottom left corners of the footprints.
+        :param dimensions: The (2+,) dimensions shared by all footprints or the (k, 2+) dimensions of every footprint.
+        :return: (x_start, x_end, y_start, y_end) arrays of cell indices, the end is exclusive.
+        """
+        positions_2d = numpy.asarray(positions_2d, dtype=float).reshape(-1, 2)
+        dimensions = numpy.broadcast_to(numpy.asarray(dimensions, dtype=float)[..., :2], positions_2d.shape)
+        resolution = numpy.array(self.height_map.shape)
+        starts = numpy.floor(positions_2d / self.cell_size + 1e-9).astype(numpy.int64)
+        ends = numpy.ceil((positions_2d + dimensions) / self.cell_size - 1e-9).astype(numpy.int64)
+        starts = numpy.clip(starts, 0, resolution)
+        ends = numpy.minimum(numpy.maximum(ends, starts + 1), resolution)
+        return starts[:, 0], ends[:, 0], starts[:, 1], ends[:, 1]
+
+    @instrumented('Container.get_landing_heights')
+    def get_landing_heights(self, positions_2d: numpy.array, dimensions: numpy.array):
+        """
+        Vectorized get_landing_height for many positions.
+        The footprints are looked up in the range max table, without it footprints with the same size in cells
+        share one sliding window maximum over the height map.
+
+        :param positions_2d: The (k, 2) positions of the bottom left corners of the packages.
+        :param dimensions: The dimensions shared by all packages or the (k, 3) dimensions of every package.
+        :return: The (k,) landing heights.
+        """
+        x_start, x_end, y_start, y_end = self.get_footprint_cells_batch(positions_2d, dimensions)
+        if self.range_max is not None:
+            return self.range_max.query(x_start, x_end, y_start, y_end)
+        heights = numpy.zeros(len(x_start), dtype=float)
+        widths = numpy.stack((x_end - x_start, y_end - y_start), axis=1)
+        valid = numpy.all(widths > 0, axis=1)
+        for width_x, width_y in numpy.unique(widths[valid], axis=0):
+            group = valid & (widths[:, 0] == width_x) & (widths[:, 1] == width_y)
+            window_max = sliding_window_view(self.height_map, width_x, axis=0).max(axis=-1)
+            window_max = sliding_window_view(window_max, width_y, axis=1).max(axis=-1)
+            heights[group] = window_max[x_start[group], y_start[group]]
+        return heights
+
+    @instrumented('Container.get_landing_height_grid')
+    def get_landing_height_grid(self, dimensions: numpy.array):
+        """
+        Get the landing height of a package at every cell of the container floor.
+
+        :param dimensions: The dimensions of the package.
+        :return: The (resolution_x, resolution_y) landing heights of the package with its bottom left corner on the
+            corner of each cell, inf where it sticks out of the container.
+        """
+        widths = numpy.maximum(numpy.ceil(numpy.asarray(dimensions[:2], dtype=float) / self.cell_size - 1e-9), 1)
+        width_x, width_y = widths.astype(numpy.int64)
+        if self.range_max is not None:
+            maxima = self.range_max.get_window_maxima(width_x, width_y)
+        else:
+            maxima = sliding_window_view(self.height_map, (width_x, width_y)).max(axis=(-2, -1))
+        grid = numpy.full(self.height_map.shape, numpy.inf)
+        grid[:maxima.shape[0], :maxima.shape[1]] = maxima
+        # the footprint must also fit in the container itself, not only on the height map
+        corners_x = numpy.arange(grid.shape[0]) * self.cell_size[0] + dimensions[0]
+        corners_y = numpy.arange(grid.shape[1]) * self.cell_size[1] + dimensions[1]
+        grid[corners_x > self.dimensions[0] + 1e-9] = numpy.inf
+        grid[:, corners_y > self.dimensions[1] + 1e-9] = numpy.inf
+        grid[grid + dimensions[2] > self.dimensions[2]] = numpy.inf
+        return grid
+
+    def get_landing_height(self, position_2d: numpy.array, dimensions: numpy.array):
+        """
+        Get the height a package would rest at when dropped at the given position.
+
+        :param position_2d: The position of the bottom left corner of the package.
+        :param dimensions: The dimensions of the package.
+        :return: The highest package top under the footprint, 0 for the container floor.
+        """
+        x_start, x_end, y_start, y_end = self.get_footprint_cells(position_2d, dimensions)
+        return kernels.landing_height(self.height_map, x_start, x_end, y_start, y_end)
+
+    def get_top_package(self, position_2d: numpy.array):
+        """
+        Get the package at the top of the stack over a floor position.
+
+        :param position_2d: The position on the container floor.
+        :return: The package or None if nothing is stacked there.
+        """
+        x_start, _, y_start, _ = self.get_footprint_cells(position_2d, numpy.zeros(2))
+        x_start = min(x_start, self.top_package_map.shape[0] - 1)
+        y_start = min(y_start, self.top_package_map.shape[1] - 1)
+        index = self.top_package_map[x_start, y_start]
+        if index < 0:
+            return None
+        return self.packages[index]
+
+    @instrumented('Container.get_candidate_placements')
+    def get_candidate_placements(self, package: Package):
+        """
+        Enumerates the feasible placements of a package at the extreme points of the container.
+        A placement is feasible if the package fits in the container after landing on the packages below.
+
+        :param package: The package to place, it is not modified.
+        :return: (k, 3) positions (with the landing height) and (k,) rotations for add_package.
+        """
+        positions = [numpy.zeros((0, 3))]
+        rotations = [numpy.zeros(0, dtype=numpy.int64)]
+        floor_points = numpy.unique(self.extreme_points.points[:, :2], axis=0)
+        tried = set()
+        for rotation, dimensions in enumerate(package.get_orientation_table()):
+            if tuple(dimensions) in tried:
+                continue
+            tried.add(tuple(dimensions))
+            points = floor_points[numpy.all(floor_points + dimensions[:2] <= self.dimensions[:2], axis=1)]
+            landing_heights = self.get_landing_heights(points, dimensions)
+            fits = landing_heights + dimensions[2] <= self.dimensions[2]
+            positions.append(numpy.column_stack((points[fits], landing_heights[fits])))
+            rotations.append(numpy.full(int(fits.sum()), rotation, dtype=numpy.int64))
+        return numpy.concatenate(positions), numpy.concatenate(rotations)
+
+    def get_lowest_placement(self, package: Package):
+        """
+        Get the candidate placement with the lowest landing height, ties are broken towards the back left corner.
+
+        :param package: The package to place, it is not modified.
+        :return: The position and the rotation, None if the package does not fit anywhere.
+        """
+        positions, rotations = self.get_candidate_placements(package)
+        if len(rotations) == 0:
+            return None
+        best = numpy.lexsort((positions[:, 0], positions[:, 1], positions[:, 2]))[0]
+        return positions[best], int(rotations[best])
+
+    @instrumented('Container.evaluate_orientations')
+    def evaluate_orientations(self, package: Package, position_2d: numpy.array,
+                              target_center_of_gravity: numpy.array = None):
+        """
+        Scores a placement of a package in all ORIENTATIONS at once, the package is not modified.
+        The footprints of the orientations share their start cell, so one window of the height map covers all of them
+        and the landing heights and supports are reduced over a (6, x, y) footprint mask.
+
+        :param package: The package.
+        :param position_2d: The position of the bottom left corner of the package.
+        :param target_center_of_gravity: The target of the fitness, see TrainingInstance.update_fitness,
+            the center of the container if None.
+        :return: The OrientationScores, row i is the outcome of add_package(package, position_2d, i).
+        """
+        if target_center_of_gravity is None:
+            target_center_of_gravity = self.get_local_center()
+        position_2d = numpy.asarray(position_2d, dtype=float)[:2]
+        dimensions = package.get_orientation_table()
+        x_start, x_end, y_start, y_end = self.get_footprint_cells_batch(
+            numpy.broadcast_to(position_2d, (len(dimensions), 2)), dimensions)
+        window = self.height_map[x_start[0]:x_end.max(), y_start[0]:y_end.max()]
+        cells_x = numpy.arange(x_start[0], x_start[0] + window.shape[0])
+        cells_y = numpy.arange(y_start[0], y_start[0] + window.shape[1])
+        footprints = (cells_x[numpy.newaxis, :, numpy.newaxis] < x_end[:, numpy.newaxis, numpy.newaxis]) & \
+                     (cells_y[numpy.newaxis, numpy.newaxis, :] < y_end[:, numpy.newaxis, numpy.newaxis])
+        landing_heights = numpy.where(footprints, window, 0).max(axis=(1, 2), initial=0.0)
+        supported = footprints & numpy.isclose(window, landing_heights[:, numpy.newaxis, numpy.newaxis])
+        support_ratios = numpy.where(landing_heights == 0, 1.0, supported.sum(axis=(1, 2)) /
+                                     numpy.maximum(footprints.sum(axis=(1, 2)), 1))
+
+        tops = landing_heights + dimensions[:, 2]
+        feasible = numpy.all(position_2d + dimensions[:, :2] <= self.dimensions[:2], axis=1) & \
+            numpy.all(position_2d >= 0) & (tops <= self.dimensions[2])
+        centers = numpy.column_stack((position_2d + dimensions[:, :2] / 2, landing_heights + dimensions[:, 2] / 2))
+        centers_of_gravity = (self.center_of_gravity * self.total_package_weight + centers * package.weight) / \
+            (self.total_package_weight + package.weight)
+        fitness = kernels.fitness_batch(numpy.asarray(self.dimensions, dtype=float),
+                                        numpy.maximum(self.max_height, tops),
+                                        numpy.full(len(dimensions), self.total_package_volume + package.get_volume()),
+                                        centers_of_gravity, numpy.asarray(target_center_of_gravity, dtype=float))
+        return OrientationScores(dimensions, landing_heights, support_ratios, numpy.where(feasible, fitness, -numpy.inf),
+                                 feasible)
+
+    @instrumented('Container.get_support')
+    def get_support(self, position_2d: numpy.array, dimensions: numpy.array):
+        """
+        Get how a package would rest when dropped at a position, from the height map cells under its footprint.
+
+        :param position_2d: The position of the bottom left corner of the package.
+        :param dimensions: The dimensions of the package.
+        :return: The landing height, the supported fraction of the base and the supporting package indices
+            with the number of footprint cells each of them supports.
+        """
+        x_start, x_end, y_start, y_end = self.get_footprint_cells(position_2d, dimensions)
+        footprint = self.height_map[x_start:x_end, y_start:y_end]
+        landing_height = kernels.landing_height(self.height_map, x_start, x_end, y_start, y_end)
+        if landing_height == 0 or footprint.size == 0:
+            return landing_height, 1.0, numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+        supported = numpy.isclose(footprint, landing_height)
+        supporters, counts = numpy.unique(self.top_package_map[x_start:x_end, y_start:y_end][supported],
+                                          return_counts=True)
+        return landing_height, supported.sum() / footprint.size, supporters, counts
+
+    def get_mean_support_ratio(self):
+        if len(self.packages) == 0:
+            return 1.0
+        return self.support_ratio_sum / len(self.packages)
+
+    @instrumented('Container.add_package')
     def add_package(self, package: Package, position_2d: numpy.array, rotation: int):
         package.rotate(rotation)
-        # iterate over all packages and find the highest one over the package cross-section
-        highest_package_height = 0
-        highest_package = None
-        for package_ in self.packages:
-            cross_section_rect = numpy.array([package_.position[0],
-                                              package_.position[1],
-                                              package.dimensions[0],
-                                              package.dimensions[1]])
-            # check if the package is in the cross-section
-            if cross_section_rect[0] <= position_2d[0] <= cross_section_rect[0] + cross_section_rect[2] and \
-                    cross_section_rect[1] <= position_2d[1] <= cross_section_rect[1] + cross_section_rect[3]:
-                if package_.position[2] >= highest_package_height:
-                    highest_package_height = package_.position[2]
-                    highest_package = package_
-        if highest_package is not None:
-            package.position = numpy.array(
-                [position_2d[0], position_2d[1], highest_package_height + highest_package.dimensions[2]])
-        else:
-            package.position = numpy.array([position_2d[0], position_2d[1], 0])
-        self.packages.append(package)
+        # the package lands on the highest package top under its footprint,
+        # so the cost only depends on the footprint size and not on the number of packages
+        x_start, x_end, y_start, y_end = self.get_footprint_cells(position_2d, package.dimensions)
+        landing_height, support_ratio, supporters, support_counts = self.get_support(position_2d, package.dimensions)
+        package_position = package.position
+        package.position = numpy.array([position_2d[0], position_2d[1], landing_height], dtype=float)
+        package_top = landing_height + package.dimensions[2]
+        if self.undo_log is not None:
+            self.undo_log.append(self.get_undo_record(package, rotation, package_position,
+                                                      (x_start, x_end, y_start, y_end), supporters))
+
+        # the weight of the package is shared by the packages directly beneath it by supported area
+        if len(supporters):
+            stacked_loads = self.packages.stacked_loads
+            stacked_loads[supporters] += package.weight * support_counts / support_counts.sum()
+            self.max_stacked_load = max(self.max_stacked_load, stacked_loads[supporters].max())
+        self.min_support_ratio = min(self.min_support_ratio, support_ratio)
+        self.support_ratio_sum += support_ratio
+        if support_ratio < self.stability_threshold:
+            self.unstable_package_count += 1
+
+        # update the height map in the container over the cross-section of the package
+        kernels.place_footprint(self.height_map, self.top_package_map, x_start, x_end, y_start, y_end,
+                                package_top, len(self.packages))
+        if self.range_max is not None:
+            self.range_max.update(x_start, x_end, y_start, y_end, package_top)
+        self.update_top_down_view(package)
+
+        self.spatial_index.insert(self.packages.add(package, support_ratio))
+        self.extreme_points.update(package.position, package.dimensions)
         self.total_package_volume += package.get_volume()
-        self.total_package_weight += package.weight
-        if self.highest_package is None or package.position[2] > self.highest_package.position[2]:
+        self.update_center_of_gravity(package)
+        if self.highest_package is None or package_top > self.max_height:
             self.highest_package = package
+            self.max_height = package_top
+
+        self.notify_observers(package)
+
+    def get_undo_record(self, package: Package, rotation: int, package_position: numpy.array, footprint: tuple,
+                        supporters: numpy.array):
+        """
+        Saves the state add_package is about to change, the package must already have its landing position.
+        """
+        x_start, x_end, y_start, y_end = footprint
+        pixels = tuple(int(bound[0]) for bound in get_pixel_ranges(self.x_map, self.y_map,
+                                                                   package.position[numpy.newaxis],
+                                                                   package.dimensions[numpy.newaxis]))
+        extreme_points = self.extreme_points
+        return UndoRecord(package, rotation, package_position, footprint,
+                          self.height_map[x_start:x_end, y_start:y_end].copy(),
+                          self.top_package_map[x_start:x_end, y_start:y_end].copy(), pixels,
+                          self.image[pixels[0]:pixels[1], pixels[2]:pixels[3], 0].copy(), supporters,
+                          self.packages.stacked_loads[supporters].copy(),
+                          (self.total_package_weight, self.total_package_volume, self.center_of_gravity,
+                           self.highest_package, self.max_height, self.min_support_ratio, self.support_ratio_sum,
+                           self.unstable_package_count, self.max_stacked_load),
+                          (extreme_points._points, extreme_points.pending, len(extreme_points.pending)))
+
+    def checkpoint(self):
+        """
+        Marks the current layout so that the packages added after it can be taken out again with rollback.
+        The first checkpoint starts the undo log, every add_package after it saves what it changes.
+
+        :return: The token of the checkpoint.
+        """
+        if self.undo_log is None:
+            self.undo_log = []
+        return len(self.undo_log)
+
+    @instrumented('Container.rollback')
+    def rollback(self, token: int = 0):
+        """
+        Takes out the packages added since a checkpoint, newest first, and restores the container as it was.
+        The packages get their original dimensions and position back and can be added again. Observers are not
+        notified. The range max table only has to be rebuilt if it was queried since the checkpoint.
+
+        :param token: The token returned by checkpoint.
+        """
+        if self.undo_log is None:
+            return
+        count = max(len(self.undo_log) - token, 0)
+        while len(self.undo_log) > token:
+            record = self.undo_log.pop()
+            index = len(self.packages) - 1
+            self.spatial_index.remove(index)
+            record.package.unbind()
+            self.packages.pop()
+            package = record.package
+            package.rotate(INVERSE_ORIENTATIONS[record.rotation])
+            package.position = record.package_position
 
-        self.center_of_gravity = (self.center_of_gravity * (self.total_package_weight-package.weight) + package.position*package.weight
-                                  ) / self.total_package_weight
+            x_start, x_end, y_start, y_end = record.footprint
+            self.height_map[x_start:x_end, y_start:y_end] = record.height_map
+            self.top_package_map[x_start:x_end, y_start:y_end] = record.top_package_map
+            x_start, x_end, y_start, y_end = record.pixels
+            self.image[x_start:x_end, y_start:y_end, 0] = record.image
+            self.packages.stacked_loads[record.supporters] = record.stacked_loads
+            (self.total_package_weight, self.total_package_volume, self.center_of_gravity, self.highest_package,
+             self.max_height, self.min_support_ratio, self.support_ratio_sum, self.unstable_package_count,
+             self.max_stacked_load) = record.scalars
+            points, pending, pending_count = record.extreme_points
+            self.extreme_points._points = points
+            self.extreme_points.pending = pending[:pending_count]
+            self.image_weight_dirty = True
+        if self.range_max is not None:
+            self.range_max.discard_updates(count)
 
-        # update the image in the container over the cross-section of the package
+    def discard_undo_log(self):
+        """Stops recording the placements, the checkpoints taken so far can no longer be rolled back to."""
+        self.undo_log = None
 
-        # for x in range(int(position_2d[0]), int(position_2d[0] + package.dimensions[0])):
-        #     for y in range(int(position_2d[1]), int(position_2d[1] + package.dimensions[1])):
+    @instrumented('Container.update_center_of_gravity')
+    def update_center_of_gravity(self, package: Package):
+        self.center_of_gravity = kernels.update_center_of_gravity(self.center_of_gravity, self.total_package_weight,
+                                                                  package.get_center(), package.weight)
+        self.total_package_weight += package.weight
 
-        ax.scatter(self.center_of_gravity[0], self.center_of_gravity[1],
-                   self.center_of_gravity[2], color='green')
+    @instrumented('Container.notify_observers')
+    def notify_observers(self, package: Package):
+        for observer in self.observers:
+            observer.on_package_added(self, package)
+
+    def get_overlapping_packages(self, box_min: numpy.array, box_max: numpy.array):
+        """
+        Get the packages that intersect a box with a positive volume.
+
+        :param box_min: The minimum corner of the box, relative to the container.
+        :param box_max: The maximum corner of the box, relative to the container.
+        :return: Sorted array of package indices.
+        """
+        return self.spatial_index.query(numpy.asarray(box_min, dtype=float), numpy.asarray(box_max, dtype=float))
+
+    def get_supporting_packages(self, index: int):
+        """
+        Get the packages a package rests on, their top touches its bottom and their footprints overlap.
+
+        :param index: The index of the package.
+        :return: Sorted array of package indices.
+        """
+        position = self.packages.positions[index]
+        end = position + self.packages.dimensions[index]
+        box_min = numpy.array([position[0], position[1], position[2] - 1e-9])
+        box_max = numpy.array([end[0], end[1], position[2]])
+        candidates = self.spatial_index.query(box_min, box_max)
+        tops = self.packages.positions[candidates, 2] + self.packages.dimensions[candidates, 2]
+        return candidates[numpy.isclose(tops, position[2])]
+
+    def get_neighbours(self, index: int, distance: float = 0.0):
+        """
+        Get the packages within a distance of a package, touching packages included.
+
+        :param index: The index of the package.
+        :param distance: The maximum gap between the bounding boxes.
+        :return: Sorted array of package indices, without the package itself.
+        """
+        position = self.packages.positions[index]
+        end = position + self.packages.dimensions[index]
+        neighbours = self.spatial_index.query(position - distance, end + distance, strict=False)
+        return neighbours[neighbours != index]
+
+    @instrumented('Container.validate')
+    def validate(self, tolerance: float = 1e-9):
+        """
+        Checks the layout for intersecting packages and packages sticking out of the container,
+        add_package does not prevent either.
+
+        :return: The validation.LayoutViolations.
+        """
+        return validate_layout(self.packages.positions, self.packages.dimensions, self.dimensions, tolerance)
 
     def get_volume(self, height=None):
         if height is None:
             height = self.dimensions[2]
         return self.dimensions[0] * self.dimensions[1] * height
 
+    def get_packages_volume(self):
+        return self.packages.get_total_volume()
+
+    def calculate_center_of_gravity(self):
+        """
+        Recomputes the center of gravity of the container from all packages in one array operation,
+        add_package keeps self.center_of_gravity up to date incrementally with the same formula.
+
+        :return: The center of gravity.
+        """
+        weights = self.packages.weights
+        return (self.get_local_center() * self.empty_weight + weights @ self.packages.get_centers()) / \
+            (self.empty_weight + weights.sum())
+
+    def get_bounding_box(self):
+        return self.packages.get_bounding_box()
+
     def __str__(self):
         return f'Container: ({self.packages}, {self.dimensions}, {self.center_of_gravity}, {self.position})'
 
+    @instrumented('Container.update_top_down_view')
+    def update_top_down_view(self, package: Package):
+        """
+        Paints a newly added package into the cached top-down view, only the pixels under its footprint are touched.
+
+        :param package: The package that was just placed.
+        """
+        x_start, x_end, y_start, y_end = get_pixel_ranges(self.x_map, self.y_map,
+                                                          package.position[numpy.newaxis],
+                                                          package.dimensions[numpy.newaxis])
+        self.image[x_start[0]:x_end[0], y_start[0]:y_end[0], 0] = \
+            (self.dimensions[2] - package.position[2]) / self.dimensions[2]
+        self.image_weight_dirty = True
+
+    def get_top_down_view(self):
+        """
+        Get the cached top-down view at the container image resolution, it is kept up to date by add_package.
+        The returned array is the cache itself and must not be modified.
+
+        :return: The 2d image, see generate_top_down_view.
+        """
+        if self.image_weight_dirty:
+            self.image[:, :, 1] = self.total_package_weight - self.empty_weight
+            self.image_weight_dirty = False
+        return self.image
+
+    @instrumented('Container.generate_top_down_view')
     def generate_top_down_view(self, resolution_x, resolution_y):
         """
         Generates a 2d image of the top-down view with the packages height in the red channel and the packages weight in
@@ -164,51 +1037,69 @@ class Container:
         :param resolution_y: The resolution in y direction.
         :return: The 2d image.
         """
-        image = numpy.zeros((resolution_x, resolution_y, 3),
-                            dtype=numpy.float32)
-        # ray-cast all packages for each pixel
-        for index_x, x in enumerate(np.linspace(0, self.dimensions[0], resolution_x)):
-            for index_y, y in enumerate(np.linspace(0, self.dimensions[1], resolution_y)):
-                weight = 0
-                for package in self.packages:
-                    weight += package.weight
-                    if package.position[0] <= x <= package.position[0] + package.dimensions[0] and \
-                            package.position[1] <= y <= package.position[1] + package.dimensions[1]:
-                        image[index_x, index_y, 0] = (
-                            self.dimensions[2] - package.position[2]) / self.dimensions[2]
-                image[index_x, index_y, 1] = weight
-        return image
+        if (resolution_x, resolution_y) == self.image.shape[:2]:
+            return self.get_top_down_view().copy()
+        return rasterize_top_down_view(self.packages.positions, self.packages.dimensions, self.packages.weights,
+                                       self.dimensions, resolution_x, resolution_y)
 
+    @instrumented('Container.draw_in_plot')
     def draw_in_plot(self):
-        # set the limits of the plot
-        ax.set_xlim3d(0, self.dimensions[0])
-        ax.set_ylim3d(0, self.dimensions[1])
-        ax.set_zlim3d(0, self.dimensions[2])
-        fig.add_axes(ax)
-        # draw the container
-        ax.add_collection3d(
-            Poly3DCollection(get_cuboid_triangulated_vertices(self.position, self.dimensions), facecolors='w',
-                             linewidths=1, edgecolors='k', alpha=.25))
-
-        # draw the packages in random colors
-        for package in self.packages:
-            ax.add_collection3d(
-                Poly3DCollection(get_cuboid_triangulated_vertices(package.position + self.position, package.dimensions),
-                                 facecolors=(random.random(), random.random(), random.random()), linewidths=1,
-                                 edgecolors='k', alpha=.0))
-            package.plot_center()
-        ax.scatter(self.get_center()[0], self.get_center()[
-                   1], self.get_center()[2], c='b')
-        plt.show()
+        """
+        Draws the container with matplotlib, the center of gravity trail is shown if a MatplotlibObserver
+        was registered before the packages were added.
+        """
+        from plotting import MatplotlibObserver
+
+        observer = next((observer for observer in self.observers if isinstance(observer, MatplotlibObserver)),
+                        None)
+        if observer is None:
+            observer = MatplotlibObserver()
+        observer.draw(self)
+
+
+class CenterOfGravityEnvelope:
+    """
+    Allowed range of the aircraft center of gravity, an axis aligned box in plane coordinates.
+    Use -inf and inf for the axes that are not limited.
+    """
+
+    def __init__(self, minimum: numpy.array, maximum: numpy.array):
+        self.minimum = numpy.asarray(minimum, dtype=float)
+        self.maximum = numpy.asarray(maximum, dtype=float)
+
+    def contains(self, centers_of_gravity: numpy.array):
+        """
+        :param centers_of_gravity: (..., 3) centers of gravity.
+        :return: (...) boolean array, True where the center of gravity is inside the envelope.
+        """
+        return numpy.all((centers_of_gravity >= self.minimum) & (centers_of_gravity <= self.maximum), axis=-1)
+
+    def get_margin(self, centers_of_gravity: numpy.array):
+        """
+        :param centers_of_gravity: (..., 3) centers of gravity.
+        :return: (...) distance to the closest envelope limit, negative outside of the envelope.
+        """
+        return numpy.minimum(centers_of_gravity - self.minimum, self.maximum - centers_of_gravity).min(axis=-1)
+
+    def __str__(self):
+        return f'CenterOfGravityEnvelope({self.minimum}, {self.maximum})'
 
 
 class Plane:
     """Plane class"""
 
-    def __init__(self, dimensions: numpy.array, position: numpy.array):
+    def __init__(self, dimensions: numpy.array, position: numpy.array, empty_weight: float = 0,
+                 empty_center_of_gravity: numpy.array = None, datum: numpy.array = None,
+                 envelope: CenterOfGravityEnvelope = None):
         self.pallets = []
         self.dimensions = dimensions
         self.position = position
+        # the aircraft without cargo and the reference point of the moments
+        self.empty_weight = empty_weight
+        self.empty_center_of_gravity = numpy.asarray(dimensions, dtype=float) / 2 \
+            if empty_center_of_gravity is None else numpy.asarray(empty_center_of_gravity, dtype=float)
+        self.datum = numpy.zeros(3) if datum is None else numpy.asarray(datum, dtype=float)
+        self.envelope = envelope
 
     def get_volume(self):
         return numpy.prod(self.dimensions)
@@ -220,18 +1111,102 @@ class Plane:
     def __str__(self):
         return f'Plane({self.pallets}, {self.dimensions}, {self.position})'
 
+    def get_pallet_slots(self, pallet_dimensions: numpy.array):
+        """
+        Get the floor positions of a grid of equal pallets, rows along the x axis of the plane.
+
+        :param pallet_dimensions: The dimensions of a pallet.
+        :return: (s, 3) positions of the bottom left corners of the slots.
+        """
+        counts = (numpy.asarray(self.dimensions[:2]) // numpy.asarray(pallet_dimensions[:2])).astype(int)
+        x, y = numpy.meshgrid(numpy.arange(counts[0]) * pallet_dimensions[0],
+                              numpy.arange(counts[1]) * pallet_dimensions[1], indexing='ij')
+        return numpy.column_stack((x.ravel(), y.ravel(), numpy.zeros(x.size))).astype(float)
+
+    def load_pallets(self, pallets: list, slots: numpy.array, arrangement: numpy.array):
+        """
+        Replaces the pallets of the plane, pallet i goes to slot arrangement[i].
+        """
+        self.pallets = []
+        for pallet, slot in zip(pallets, arrangement):
+            self.add_pallet(pallet, slots[slot][:2])
+
     def get_summed_weight(self):
-        weight = 0
-        for pallet in self.pallets:
-            weight += pallet.get_summed_weight()
-        return weight
+        if not self.pallets:
+            return 0.0
+        return float(numpy.sum([pallet.get_summed_weight() for pallet in self.pallets]))
 
     def calculate_center_of_gravity(self):
-        center_of_gravity = numpy.array([0, 0, 0])
-        for pallet in self.pallets:
-            center_of_gravity += pallet.center_of_gravity * pallet.get_summed_weight()
-        center_of_gravity /= self.get_summed_weight()
-        return center_of_gravity
+        """
+        Get the center of gravity of the loaded plane, the empty plane included.
+        """
+        weights, centers_of_gravity = get_pallet_arrays(self.pallets)
+        positions = numpy.array([pallet.position for pallet in self.pallets], dtype=float).reshape(-1, 3)
+        return self.score_arrangements(weights, centers_of_gravity, positions, numpy.arange(len(weights))[None])[0][0]
+
+    def calculate_moments(self):
+        """
+        Get the moments of the loaded plane around the datum, the empty plane included.
+        """
+        weights, centers_of_gravity = get_pallet_arrays(self.pallets)
+        positions = numpy.array([pallet.position for pallet in self.pallets], dtype=float).reshape(-1, 3)
+        return self.score_arrangements(weights, centers_of_gravity, positions, numpy.arange(len(weights))[None])[1][0]
+
+    def score_arrangements(self, pallet_weights: numpy.array, pallet_centers_of_gravity: numpy.array,
+                           slots: numpy.array, arrangements: numpy.array):
+        """
+        Computes the center of gravity and the moments of many pallet arrangements in one reduction.
+
+        :param pallet_weights: The (n,) total weights of the pallets.
+        :param pallet_centers_of_gravity: The (n, 3) centers of gravity of the pallets, relative to the pallets.
+        :param slots: The (s, 3) floor positions the pallets can be placed at.
+        :param arrangements: (k, n) slot index of every pallet in every arrangement.
+        :return: The (k, 3) centers of gravity, the (k, 3) moments around the datum and the (k,) envelope check
+            (all True without an envelope).
+        """
+        positions = slots[arrangements] + pallet_centers_of_gravity
+        moments = numpy.einsum('n,knd->kd', pallet_weights, positions - self.datum) + \
+            self.empty_weight * (self.empty_center_of_gravity - self.datum)
+        total_weight = pallet_weights.sum() + self.empty_weight
+        centers_of_gravity = self.datum + moments / total_weight
+        if self.envelope is None:
+            within = numpy.ones(len(arrangements), dtype=bool)
+        else:
+            within = self.envelope.contains(centers_of_gravity)
+        return centers_of_gravity, moments, within
+
+    def find_arrangement(self, pallets: list, slots: numpy.array, candidates: int = 1000, seed: int = None):
+        """
+        Scores random arrangements of the pallets in the slots and loads the one with the largest envelope margin
+        (or, without an envelope, the one closest to the empty center of gravity).
+
+        :param pallets: The containers to load.
+        :param slots: The (s, 3) floor positions, s >= len(pallets).
+        :param candidates: The number of random arrangements to score.
+        :param seed: The seed of the random arrangements.
+        :return: The arrangement and whether its center of gravity is inside the envelope.
+        """
+        rng = numpy.random.default_rng(seed)
+        weights, centers_of_gravity = get_pallet_arrays(pallets)
+        arrangements = numpy.argsort(rng.random((candidates, len(slots))), axis=1)[:, :len(pallets)]
+        plane_centers_of_gravity, _, within = self.score_arrangements(weights, centers_of_gravity, slots,
+                                                                      arrangements)
+        if self.envelope is None:
+            score = -numpy.linalg.norm(plane_centers_of_gravity - self.empty_center_of_gravity, axis=1)
+        else:
+            score = self.envelope.get_margin(plane_centers_of_gravity)
+        best = int(numpy.argmax(score))
+        self.load_pallets(pallets, slots, arrangements[best])
+        return arrangements[best], bool(within[best])
+
+
+def get_pallet_arrays(pallets: list):
+    """
+    :return: The (n,) total weights and the (n, 3) local centers of gravity of the pallets.
+    """
+    weights = numpy.array([pallet.get_summed_weight() for pallet in pallets], dtype=float)
+    centers_of_gravity = numpy.array([pallet.center_of_gravity for pallet in pallets], dtype=float).reshape(-1, 3)
+    return weights, centers_of_gravity
 
 
 # wrapper class for a training instance
@@ -252,19 +1227,37 @@ class TrainingInstance:
     def __str__(self):
         return f'TrainingInstance({self.container}, {self.fitness})'
 
+    def sample_package_count(self, rng: numpy.random.Generator):
+        """
+        Draws a number of packages from package_count_range, the ranges are [minimum, maximum] inclusive.
+        """
+        return int(rng.integers(self.package_count_range[0], self.package_count_range[1] + 1))
+
+    def sample_packages(self, count: int, rng: numpy.random.Generator):
+        """
+        Draws random package dimensions and weights from the ranges of the instance.
+
+        :param count: The number of packages.
+        :param rng: The random generator.
+        :return: The (count, 3) dimensions and the (count,) weights.
+        """
+        dimensions = rng.integers(numpy.asarray(self.package_dimensions_range[0]),
+                                  numpy.asarray(self.package_dimensions_range[1]) + 1, size=(count, 3))
+        weights = rng.uniform(self.package_weight_range[0], self.package_weight_range[1], size=count)
+        return dimensions.astype(float), weights
+
+    @instrumented('TrainingInstance.update_fitness')
     def update_fitness(self):
         """
-        Calculates the fitness of the training instance
-        The fitness is the volume of the container to the highest package minus the volumes of the packages
-        divided by the distance of the center of gravity to the target center of gravity
+        Calculates the fitness of the training instance, higher is better.
+        The fitness is the density of the layout, the volume of the packages divided by the volume of the container
+        up to the highest package, minus the distance of the center of gravity to the target center of gravity
+        relative to the container diagonal. It is in [-1, 1] and 0 for an empty container on its target.
         :return:
         """
-        occupied_volume = self.container.get_volume(
-            self.container.highest_package.position[2] + self.container.highest_package.dimensions[2])
-        package_volume = self.container.total_package_volume
-        distance = numpy.linalg.norm(
-            self.container.center_of_gravity - self.target_center_of_gravity)
-        self.fitness = (occupied_volume - package_volume) / distance
+        self.fitness = kernels.fitness(self.container.dimensions.astype(float), self.container.max_height,
+                                       float(self.container.total_package_volume),
+                                       self.container.center_of_gravity, self.target_center_of_gravity)
 
 
 def matplotlib_test():
@@ -272,14 +1265,17 @@ def matplotlib_test():
     start_time = time.time()
     container1 = Container(numpy.array(
         [100, 100, 100]), numpy.array([0, 0, 0]))
+    from plotting import MatplotlibObserver
+    container1.add_observer(MatplotlibObserver())
     # add a 100 random packages of nearly every type to the container
     for i in range(500):
         dimensions = numpy.array(
             [random.randint(1, 10), random.randint(1, 10), random.randint(1, 10)])
         package = Package(random.randint(
             1, 2), numpy.array(dimensions), f'package {i}')
-        container1.add_package(package, numpy.array([random.randint(0, 100 - 10), random.randint(0, 100 - 10)]),
-                               random.randint(0, 2))
+        placement = container1.get_lowest_placement(package)
+        if placement is not None:
+            container1.add_package(package, placement[0][:2], placement[1])
 
     # show the 2d top-down view
     #plt.imshow(container1.generate_top_down_view(200, 200))
@@ -291,6 +1287,10 @@ def matplotlib_test():
 
 
 def panda3d_test():
+    from direct.showbase.ShowBase import ShowBase
+    from direct.stdpy import threading
+    from viewer_camera import World
+
     # time the execution
     start_time = time.time()
     freeze_support()
@@ -308,8 +1308,10 @@ def panda3d_test():
         dim = numpy.array(
             [random.randint(1, 10), random.randint(1, 10), random.randint(1, 10)])
         package = Package(random.randint(1,10),dim)
-        container1.add_package(package, numpy.array([random.randint(0, 100 - 10), random.randint(0, 100 - 10)]),
-                               random.randint(0, 2))
+        placement = container1.get_lowest_placement(package)
+        if placement is None:
+            return
+        container1.add_package(package, placement[0][:2], placement[1])
         w.makePackage(package,[random.randint(0,255)/255,random.randint(0,255)/255,random.randint(0,255)/255,0.5])
         # sleep(0.01)
         print("cube added")
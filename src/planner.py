@@ -0,0 +1,170 @@
+import time
+from typing import NamedTuple
+
+import numpy
+
+from packages import Package, TrainingInstance
+from solver import Layout, get_package_order
+
+
+class BeamNode(NamedTuple):
+    """
+    A placement sequence of the beam. actions[i] is (x, y, rotation) of the i-th package of the planning order,
+    None if that package did not fit.
+    """
+    fitness: float
+    actions: tuple
+
+
+class BeamSearchPlanner:
+    """
+    Beam search over placement sequences of a manifest, scored with TrainingInstance.update_fitness.
+
+    All sequences are played on one container: moving from a node to the next one rolls back to their common prefix
+    with the undo log of the container and replays the rest. The beam is kept in lexicographic order of the actions,
+    so the next node usually shares most of its prefix with the current one, like walking a trie.
+    """
+
+    def __init__(self, training_instance: TrainingInstance, beam_width: int = 8, branching: int = 4,
+                 depth: int = None, ordering: str = 'volume', seed: int = None):
+        """
+        :param training_instance: The instance whose container and target center of gravity are used.
+        :param beam_width: The number of sequences kept after every step.
+        :param branching: The number of candidate placements tried per sequence and step, the lowest ones first.
+        :param depth: The number of packages planned, the whole manifest if None.
+        :param ordering: The order the packages are planned in, see solver.ORDERINGS.
+        """
+        self.training_instance = training_instance
+        self.container = training_instance.container
+        self.beam_width = beam_width
+        self.branching = branching
+        self.depth = depth
+        self.ordering = ordering
+        self.rng = numpy.random.default_rng(seed)
+        self.package_dimensions = None
+        self.package_weights = None
+        self.order = None
+        # the actions currently played on the container and the checkpoint taken before each of them
+        self.path = []
+        self.tokens = []
+        self.nodes = 0
+        self.seconds = 0.0
+        self.history = []
+
+    def goto(self, actions: tuple):
+        """
+        Brings the container into the layout of a placement sequence.
+        """
+        common = 0
+        while common < min(len(self.path), len(actions)) and self.path[common] == actions[common]:
+            common += 1
+        if common < len(self.path):
+            self.container.rollback(self.tokens[common])
+            del self.path[common:], self.tokens[common:]
+        for step in range(common, len(actions)):
+            self.play(step, actions[step])
+
+    def play(self, step: int, action: tuple):
+        self.tokens.append(self.container.checkpoint())
+        self.path.append(action)
+        if action is not None:
+            index = self.order[step]
+            self.container.add_package(Package(self.package_weights[index], self.package_dimensions[index].copy()),
+                                       action[:2], action[2])
+
+    def get_fitness(self):
+        if len(self.container.packages) == 0:
+            return -numpy.inf
+        self.training_instance.update_fitness()
+        return float(self.training_instance.fitness)
+
+    def expand(self, node: BeamNode):
+        """
+        Tries the lowest candidate placements of the next package after a sequence.
+
+        :return: The list of child nodes.
+        """
+        self.goto(node.actions)
+        step = len(node.actions)
+        index = self.order[step]
+        package = Package(self.package_weights[index], self.package_dimensions[index].copy())
+        positions, rotations = self.container.get_candidate_placements(package)
+        if len(rotations) == 0:
+            return [BeamNode(node.fitness, node.actions + (None,))]
+        children = []
+        for best in numpy.lexsort((positions[:, 0], positions[:, 1], positions[:, 2]))[:self.branching]:
+            action = (float(positions[best, 0]), float(positions[best, 1]), int(rotations[best]))
+            self.play(step, action)
+            children.append(BeamNode(self.get_fitness(), node.actions + (action,)))
+            self.nodes += 1
+            self.container.rollback(self.tokens.pop())
+            self.path.pop()
+        return children
+
+    def plan(self, package_dimensions: numpy.array = None, package_weights: numpy.array = None,
+             verbose: bool = False):
+        """
+        Plans a manifest, the container is left with the best layout.
+
+        :param package_dimensions: The (n, 3) dimensions, drawn from the training instance if None.
+        :param package_weights: The (n,) weights.
+        :param verbose: Print a line per step.
+        :return: The best Layout.
+        """
+        if package_dimensions is None:
+            count = self.training_instance.sample_package_count(self.rng)
+            package_dimensions, package_weights = self.training_instance.sample_packages(count, self.rng)
+        self.package_dimensions = numpy.asarray(package_dimensions, dtype=float)
+        self.package_weights = numpy.asarray(package_weights, dtype=float)
+        self.order = get_package_order(self.package_dimensions, self.package_weights, self.ordering, self.rng)
+        depth = len(self.order) if self.depth is None else min(self.depth, len(self.order))
+        self.goto(())
+        self.nodes = 0
+        self.history = []
+
+        beam = [BeamNode(-numpy.inf, ())]
+        start_time = time.perf_counter()
+        for step in range(depth):
+            step_start = time.perf_counter()
+            nodes = self.nodes
+            children = [child for node in beam for child in self.expand(node)]
+            ranking = numpy.argsort([-child.fitness for child in children], kind='stable')[:self.beam_width]
+            beam = sorted((children[rank] for rank in ranking),
+                          key=lambda child: [(-1.0, -1.0, -1) if action is None else action for action in child.actions])
+            elapsed = time.perf_counter() - step_start
+            self.history.append({'step': step, 'seconds': elapsed, 'nodes': self.nodes - nodes,
+                                 'nodes_per_second': (self.nodes - nodes) / elapsed if elapsed else 0.0,
+                                 'best_fitness': max(node.fitness for node in beam)})
+            if verbose:
+                print(f'step {step}: best {self.history[-1]["best_fitness"]:.4f}, '
+                      f'{self.history[-1]["nodes_per_second"]:.0f} nodes/s')
+        self.seconds = time.perf_counter() - start_time
+
+        best = max(beam, key=lambda node: node.fitness)
+        self.goto(best.actions)
+        placed = [(self.order[step], action) for step, action in enumerate(best.actions) if action is not None]
+        return Layout(best.fitness, -1, 'beam', self.ordering,
+                      numpy.array([index for index, _ in placed], dtype=numpy.int32),
+                      numpy.array([action[:2] for _, action in placed], dtype=float).reshape(-1, 2),
+                      numpy.array([action[2] for _, action in placed], dtype=numpy.int8))
+
+    def get_nodes_per_second(self):
+        return self.nodes / self.seconds if self.seconds else 0.0
+
+
+def planner_test():
+    rng = numpy.random.default_rng(0)
+    package_dimensions = rng.integers(5, 21, (60, 3)).astype(float)
+    package_weights = rng.uniform(1, 10, 60)
+    for beam_width in (1, 4, 16):
+        training_instance = TrainingInstance(numpy.array([100, 100, 100]), None, None, None,
+                                             numpy.array([50, 50, 20]))
+        planner = BeamSearchPlanner(training_instance, beam_width=beam_width, seed=0)
+        best = planner.plan(package_dimensions, package_weights)
+        print(f'beam width {beam_width}: fitness {best.fitness:.4f} with {len(best.order)} packages, '
+              f'{planner.nodes} nodes in {planner.seconds:.2f} s ({planner.get_nodes_per_second():.0f} nodes/s), '
+              f'{training_instance.container.validate()}')
+
+
+if __name__ == '__main__':
+    planner_test()
@@ -0,0 +1,96 @@
+import random
+
+import numpy
+from matplotlib import pyplot as plt
+from mpl_toolkits.mplot3d import Axes3D
+from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+
+
+def get_cuboid_triangulated_vertices(position: numpy.array, dimension: numpy.array):
+    """
+    Get the triangulated vertices of a cuboid.
+
+    :param position: The position of the bottom left corner of the cuboid.
+    :param dimension: The dimension of the cuboid.
+    :return: The vertices of the cuboid.
+    """
+    x, y, z = position
+    dx, dy, dz = dimension
+
+    cuboid_vertices = numpy.array([
+        [x, y, z],
+        [x + dx, y, z],
+        [x, y + dy, z],
+        [x, y, z + dz],
+        [x + dx, y + dy, z],
+        [x + dx, y, z + dz],
+        [x, y + dy, z + dz],
+        [x + dx, y + dy, z + dz],
+
+    ])
+
+    triangles = numpy.array([
+        [1, 4, 2],
+        [0, 1, 2],
+        [4, 2, 7],
+        [6, 2, 7],
+        [6, 2, 0],
+        [6, 0, 3],
+        [3, 1, 0],
+        [3, 1, 5],
+        [4, 1, 5],
+        [4, 5, 7],
+        [5, 3, 7],
+        [3, 6, 7],
+    ])
+
+    vertices = []
+    for triangle in triangles:
+        vertices.append([cuboid_vertices[vertex] for vertex in triangle])
+    return vertices
+
+
+class MatplotlibObserver:
+    """
+    Draws containers with matplotlib.
+    Registered with Container.add_observer it records the center of gravity after every placement,
+    the trail is drawn together with the container.
+    """
+
+    def __init__(self):
+        self.fig = plt.figure()
+        self.ax = Axes3D(self.fig, auto_add_to_figure=False)
+        self.centers_of_gravity = []
+
+    def on_package_added(self, container, package):
+        self.centers_of_gravity.append(numpy.array(container.center_of_gravity))
+
+    def plot_center(self, package):
+        center = package.get_center()
+        self.ax.scatter(center[0], center[1], center[2], color='red')
+
+    def draw(self, container):
+        ax = self.ax
+        # set the limits of the plot
+        ax.set_xlim3d(0, container.dimensions[0])
+        ax.set_ylim3d(0, container.dimensions[1])
+        ax.set_zlim3d(0, container.dimensions[2])
+        self.fig.add_axes(ax)
+        # draw the container
+        ax.add_collection3d(
+            Poly3DCollection(get_cuboid_triangulated_vertices(container.position, container.dimensions), facecolors='w',
+                             linewidths=1, edgecolors='k', alpha=.25))
+
+        # draw the packages in random colors
+        for package in container.packages:
+            ax.add_collection3d(
+                Poly3DCollection(get_cuboid_triangulated_vertices(package.position + container.position, package.dimensions),
+                                 facecolors=(random.random(), random.random(), random.random()), linewidths=1,
+                                 edgecolors='k', alpha=.0))
+            self.plot_center(package)
+        if self.centers_of_gravity:
+            centers_of_gravity = numpy.array(self.centers_of_gravity)
+            ax.scatter(centers_of_gravity[:, 0], centers_of_gravity[:, 1], centers_of_gravity[:, 2], color='green')
+        ax.scatter(container.get_center()[0], container.get_center()[
+                   1], container.get_center()[2], c='b')
+        plt.show()
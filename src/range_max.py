@@ -0,0 +1,173 @@
+import numpy
+
+
+class RangeMaxTable:
+    """
+    2d sparse table over a grid of values: table[kx, ky, x, y] is the maximum of the 2^kx by 2^ky window whose
+    lowest corner is (x, y). The maximum of any rectangle is the maximum of the (usually four) overlapping windows
+    that cover it, so a query does not depend on the size of the rectangle.
+
+    The values are expected to only grow, like the height map of a container. A growth is recorded with update and
+    applied to the affected windows of every level the next time the table is read. After any other change of the
+    values call invalidate.
+    """
+
+    def __init__(self, values: numpy.array, max_level: int = None):
+        """
+        :param values: The 2d grid, it is referenced and not copied.
+        :param max_level: The largest window is 2^max_level cells wide, all levels if None. Rectangles wider than
+            two windows of the largest level are covered by more windows.
+        """
+        self.values = values
+        size_x, size_y = values.shape
+        self.levels_x = int(size_x).bit_length() - 1
+        self.levels_y = int(size_y).bit_length() - 1
+        if max_level is not None:
+            self.levels_x = min(self.levels_x, max_level)
+            self.levels_y = min(self.levels_y, max_level)
+        self.table = numpy.zeros((self.levels_x + 1, self.levels_y + 1, size_x, size_y), dtype=values.dtype)
+        # floor(log2(width)) of every width
+        self.log2 = numpy.zeros(max(size_x, size_y) + 1, dtype=numpy.int64)
+        for width in range(2, len(self.log2)):
+            self.log2[width] = self.log2[width // 2] + 1
+        # growths that are not in the table yet, they are applied one by one or by a rebuild if there are many
+        self.pending = []
+        self.dirty = False
+        self.rebuild_threshold = 8
+        self.rebuild()
+
+    @staticmethod
+    def get_max_level(shape: tuple, max_bytes: int, itemsize: int = 8):
+        """
+        Get the largest max_level whose table fits in a memory budget.
+
+        :return: The level, None if all levels fit and -1 if not even the first one does.
+        """
+        size_x, size_y = shape
+        levels_x, levels_y = int(size_x).bit_length() - 1, int(size_y).bit_length() - 1
+        level = -1
+        while level < max(levels_x, levels_y) and \
+                (min(level + 1, levels_x) + 1) * (min(level + 1, levels_y) + 1) * size_x * size_y * itemsize <= max_bytes:
+            level += 1
+        return None if level == max(levels_x, levels_y) else level
+
+    def rebuild(self):
+        """Recomputes all levels from the values."""
+        size_x, size_y = self.values.shape
+        table = self.table
+        table[0, 0] = self.values
+        for level_x in range(self.levels_x + 1):
+            if level_x > 0:
+                shift = 1 << (level_x - 1)
+                count = size_x - (1 << level_x) + 1
+                numpy.maximum(table[level_x - 1, 0, :count], table[level_x - 1, 0, shift:shift + count],
+                              out=table[level_x, 0, :count])
+            for level_y in range(1, self.levels_y + 1):
+                shift = 1 << (level_y - 1)
+                count = size_y - (1 << level_y) + 1
+                numpy.maximum(table[level_x, level_y - 1, :, :count], table[level_x, level_y - 1, :, shift:shift + count],
+                              out=table[level_x, level_y, :, :count])
+        self.pending = []
+        self.dirty = False
+
+    def invalidate(self):
+        """Marks the whole table as stale, e.g. after values were lowered."""
+        self.dirty = True
+        self.pending = []
+
+    def discard_updates(self, count: int):
+        """
+        Forgets the last count updates after the values were set back to what they were before them.
+        Updates that already reached the table cannot be taken out, the table is rebuilt in that case.
+        """
+        if self.dirty or count == 0:
+            return
+        if count <= len(self.pending):
+            del self.pending[len(self.pending) - count:]
+        else:
+            self.invalidate()
+
+    def update(self, x_start: int, x_end: int, y_start: int, y_end: int, value: float):
+        """
+        Records that the values in [x_start, x_end) x [y_start, y_end) were raised to value.
+        """
+        if not self.dirty:
+            self.pending.append((x_start, x_end, y_start, y_end, value))
+            if len(self.pending) > self.rebuild_threshold:
+                self.invalidate()
+
+    def flush(self):
+        """Brings the table up to date with the values."""
+        if self.dirty:
+            self.rebuild()
+            return
+        size_x, size_y = self.values.shape
+        for x_start, x_end, y_start, y_end, value in self.pending:
+            # every window that overlaps the raised rectangle now has at least value as its maximum
+            for level_x in range(self.levels_x + 1):
+                i_start = max(x_start - (1 << level_x) + 1, 0)
+                i_end = min(x_end, size_x - (1 << level_x) + 1)
+                for level_y in range(self.levels_y + 1):
+                    j_start = max(y_start - (1 << level_y) + 1, 0)
+                    j_end = min(y_end, size_y - (1 << level_y) + 1)
+                    window = self.table[level_x, level_y, i_start:i_end, j_start:j_end]
+                    numpy.maximum(window, value, out=window)
+        self.pending = []
+
+    def get_offsets(self, widths: numpy.array, levels: int):
+        """
+        Get the level of the covering windows of every width and the window offsets relative to the rectangle start,
+        the last window is aligned with the rectangle end.
+
+        :return: The (n,) levels and the (n, m) offsets, offsets past the last window repeat it.
+        """
+        level = numpy.minimum(self.log2[widths], levels)
+        window = 1 << level
+        count = int(numpy.max(-(-widths // window), initial=1))
+        offsets = numpy.minimum(numpy.arange(count)[numpy.newaxis] * window[:, numpy.newaxis],
+                                (widths - window)[:, numpy.newaxis])
+        return level, offsets
+
+    def query(self, x_start: numpy.array, x_end: numpy.array, y_start: numpy.array, y_end: numpy.array):
+        """
+        Get the maximum of the values in many rectangles [x_start, x_end) x [y_start, y_end).
+
+        :return: The (n,) maxima, 0 for empty rectangles.
+        """
+        self.flush()
+        x_start, x_end, y_start, y_end = (numpy.asarray(bound, dtype=numpy.int64).reshape(-1)
+                                          for bound in (x_start, x_end, y_start, y_end))
+        result = numpy.zeros(len(x_start), dtype=self.table.dtype)
+        valid = (x_end > x_start) & (y_end > y_start)
+        if not valid.any():
+            return result
+        x_start, y_start = x_start[valid], y_start[valid]
+        level_x, offsets_x = self.get_offsets(x_end[valid] - x_start, self.levels_x)
+        level_y, offsets_y = self.get_offsets(y_end[valid] - y_start, self.levels_y)
+        maxima = numpy.zeros(len(x_start), dtype=self.table.dtype)
+        for offset_x in offsets_x.T:
+            for offset_y in offsets_y.T:
+                numpy.maximum(maxima, self.table[level_x, level_y, x_start + offset_x, y_start + offset_y],
+                              out=maxima)
+        result[valid] = maxima
+        return result
+
+    def get_window_maxima(self, width_x: int, width_y: int):
+        """
+        Get the maximum of every width_x by width_y window of the values, what a sliding window maximum computes.
+
+        :return: The (size_x - width_x + 1, size_y - width_y + 1) maxima.
+        """
+        self.flush()
+        size_x, size_y = self.values.shape
+        count_x, count_y = size_x - width_x + 1, size_y - width_y + 1
+        level_x, offsets_x = self.get_offsets(numpy.array([width_x]), self.levels_x)
+        level_y, offsets_y = self.get_offsets(numpy.array([width_y]), self.levels_y)
+        maxima = numpy.zeros((max(count_x, 0), max(count_y, 0)), dtype=self.table.dtype)
+        if maxima.size == 0:
+            return maxima
+        level = self.table[level_x[0], level_y[0]]
+        for offset_x in numpy.unique(offsets_x):
+            for offset_y in numpy.unique(offsets_y):
+                numpy.maximum(maxima, level[offset_x:offset_x + count_x, offset_y:offset_y + count_y], out=maxima)
+        return maxima
@@ -0,0 +1,306 @@
+from collections import namedtuple
+
+import numpy
+import torch
+
+from instrumentation import instrumented
+
+ReplayBatch = namedtuple('ReplayBatch',
+                         ('states', 'actions', 'next_states', 'rewards', 'dones', 'indices', 'weights'))
+
+
+class SumTree:
+    """
+    Binary tree whose leaves hold the priorities of the transitions and whose inner nodes hold the sums of their
+    children, tree[1] is the total. Updates and proportional sampling are O(log n) and done for whole batches.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.leaf_count = 1 << max(capacity - 1, 0).bit_length()
+        self.depth = self.leaf_count.bit_length() - 1
+        self.tree = numpy.zeros(2 * self.leaf_count, dtype=numpy.float64)
+        self.max_priority = 1.0
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def get(self, indices: numpy.array):
+        return self.tree[numpy.asarray(indices) + self.leaf_count]
+
+    def update(self, indices: numpy.array, priorities: numpy.array):
+        """
+        Sets the priorities of leaves and recomputes the sums above them, one tree level at a time.
+        """
+        nodes = numpy.asarray(indices, dtype=numpy.int64) + self.leaf_count
+        self.tree[nodes] = priorities
+        self.max_priority = max(self.max_priority, float(numpy.max(priorities, initial=0.0)))
+        for _ in range(self.depth):
+            nodes = numpy.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, prefix_sums: numpy.array):
+        """
+        Get the leaves at which the running sum of the priorities reaches the prefix sums.
+
+        :param prefix_sums: (n,) values in [0, total).
+        :return: (n,) leaf indices.
+        """
+        prefix_sums = numpy.array(prefix_sums, dtype=numpy.float64)
+        nodes = numpy.ones(len(prefix_sums), dtype=numpy.int64)
+        for _ in range(self.depth):
+            left = self.tree[2 * nodes]
+            # rounding can leave a prefix sum past the last positive leaf, never walk into an empty subtree
+            right = (prefix_sums >= left) & (self.tree[2 * nodes + 1] > 0)
+            prefix_sums -= numpy.where(right, left, 0)
+            nodes = 2 * nodes + right
+        return nodes - self.leaf_count
+
+
+# numpy equivalents of the image storage types, for memory mapped storage
+NUMPY_DTYPES = {torch.float32: numpy.float32, torch.float16: numpy.float16, torch.uint8: numpy.uint8}
+
+
+class ReplayBuffer:
+    """
+    Ring buffer of transitions stored in preallocated tensors, one per field.
+    Pushing a batch of transitions is a single indexed copy per field and sampling returns the batch tensors
+    directly. In prioritized mode the transitions are drawn proportionally to priority^alpha from a SumTree and
+    come with importance sampling weights.
+
+    The observation images are kept in a pool of frames that the transitions point to. A batch whose states are the
+    next states of the previous push of the same stream (what a training loop does with state = next_state) reuses
+    their frames, so consecutive transitions share one frame instead of storing it twice. Every frame counts the
+    transitions that point to it and goes back to the pool when the last one is overwritten. The pool is sized for
+    shared frames, when it runs out the oldest transitions are evicted early. The frames can be quantized to float16
+    or uint8 and kept in a memory mapped file instead of RAM.
+    """
+
+    def __init__(self, capacity: int, image_shape: tuple, package_size: int, prioritized: bool = False,
+                 alpha: float = 0.6, beta: float = 0.4, epsilon: float = 1e-6,
+                 storage_device: torch.device = torch.device('cpu'), device: torch.device = None,
+                 image_dtype: torch.dtype = torch.float32, image_scale: float = 1.0, storage_path: str = None,
+                 frame_capacity: int = None):
+        """
+        :param capacity: The number of transitions kept, the oldest ones are overwritten.
+        :param image_shape: The shape of one observation image, e.g. (1, x, y).
+        :param package_size: The length of the package dimensions vector of one observation.
+        :param prioritized: Sample proportionally to the priorities instead of uniformly.
+        :param alpha: How much the priorities count, 0 is uniform sampling.
+        :param beta: The exponent of the importance sampling weights, 1 fully corrects the sampling bias.
+        :param epsilon: Added to the priorities so that every transition can be drawn.
+        :param storage_device: Where the transitions are stored.
+        :param device: Where the sampled batches are returned, the storage device if None.
+        :param image_dtype: torch.float32, torch.float16 or torch.uint8, uint8 maps [0, image_scale] to 256 levels.
+        :param image_scale: The largest image value, the container height maps are normalized to 1.
+        :param storage_path: Keep the frames in a memory mapped file at this path, the storage device must be the cpu.
+        :param frame_capacity: The number of frames, 5/4 of the capacity if None. Consecutive transitions share
+            a frame, so about one frame per transition is used, 2 * capacity never evicts early.
+        """
+        self.capacity = capacity
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.storage_device = storage_device
+        self.device = storage_device if device is None else device
+        self.image_dtype = image_dtype
+        self.image_scale = image_scale
+        self.frame_capacity = capacity + max(capacity // 4, 1) if frame_capacity is None else frame_capacity
+        frames_shape = (self.frame_capacity,) + tuple(image_shape)
+        if storage_path is None:
+            self.frames = torch.empty(frames_shape, dtype=image_dtype, device=storage_device)
+        else:
+            if torch.device(storage_device).type != 'cpu':
+                raise ValueError('memory mapped replay storage must be on the cpu')
+            self.frames = torch.from_numpy(numpy.memmap(storage_path, dtype=NUMPY_DTYPES[image_dtype], mode='w+',
+                                                        shape=frames_shape))
+        # the frame bookkeeping is on the cpu: the number of references of every frame and a stack of free frames
+        self.frame_references = numpy.zeros(self.frame_capacity, dtype=numpy.int64)
+        self.free_frames = numpy.arange(self.frame_capacity - 1, -1, -1, dtype=numpy.int64)
+        self.free_count = self.frame_capacity
+        self.state_frames = numpy.zeros(capacity, dtype=numpy.int64)
+        self.next_state_frames = numpy.zeros(capacity, dtype=numpy.int64)
+        # per stream, the next states of its last push and their frames, for reusing them as the states of its next
+        # push, the frames hold a reference until they are replaced
+        self.last_next_states = {}
+        self.package_dimensions = torch.empty((capacity, package_size), dtype=torch.float32, device=storage_device)
+        self.next_package_dimensions = torch.empty_like(self.package_dimensions)
+        self.actions = torch.empty((capacity, 1), dtype=torch.long, device=storage_device)
+        self.rewards = torch.empty(capacity, dtype=torch.float32, device=storage_device)
+        self.dones = torch.empty(capacity, dtype=torch.bool, device=storage_device)
+        # the transitions are the size slots before position
+        self.position = 0
+        self.size = 0
+        self.tree = SumTree(capacity) if prioritized else None
+
+    def __len__(self):
+        return self.size
+
+    @instrumented('ReplayBuffer.push_batch')
+    def push_batch(self, states, actions, next_states, rewards, dones, stream: int = 0):
+        """
+        Saves the transitions of a batch of environments.
+        If the state images are the tensor passed as next state images to the previous push of the stream, their
+        frames are reused.
+
+        :param states: (images, package_dimensions) batch.
+        :param actions: (N, 1) actions.
+        :param next_states: (images, package_dimensions) batch, ignored where done.
+        :param rewards: (N,) rewards.
+        :param dones: (N,) done flags.
+        :param stream: The producer of the batch, e.g. the actor, the frames are only shared within a stream.
+        """
+        count = actions.size(0)
+        if count > self.capacity:
+            states, actions, next_states = ((states[0][-self.capacity:], states[1][-self.capacity:]),
+                                            actions[-self.capacity:],
+                                            (next_states[0][-self.capacity:], next_states[1][-self.capacity:]))
+            rewards, dones, count = rewards[-self.capacity:], dones[-self.capacity:], self.capacity
+        last_next_images, last_next_frames = self.last_next_states.get(stream, (None, None))
+        reuse = states[0] is last_next_images and len(last_next_frames) == count
+        # the slots of the batch are taken from the oldest transitions, then enough frames are made free
+        self.evict(self.size + count - self.capacity)
+        frame_count = count if reuse else 2 * count
+        while self.free_count < frame_count and self.size > 0:
+            self.evict(frame_count - self.free_count)
+        if self.free_count < frame_count:
+            raise RuntimeError(f'{frame_count} replay frames needed but only {self.free_count} of '
+                               f'{self.frame_capacity} are free, increase frame_capacity')
+
+        state_frames = last_next_frames if reuse else self.write_frames(states[0])
+        next_state_frames = self.write_frames(next_states[0])
+        indices = (self.position + numpy.arange(count)) % self.capacity
+        self.state_frames[indices] = state_frames
+        self.next_state_frames[indices] = next_state_frames
+        numpy.add.at(self.frame_references, state_frames, 1)
+        # one reference of the transitions and one of the stream, which may reuse the frames in its next push
+        numpy.add.at(self.frame_references, next_state_frames, 2)
+        if last_next_frames is not None:
+            self.release_frames(last_next_frames)
+        self.last_next_states[stream] = (next_states[0], next_state_frames)
+
+        storage_indices = torch.as_tensor(indices, device=self.storage_device)
+        for storage, values in ((self.package_dimensions, states[1]), (self.next_package_dimensions, next_states[1]),
+                                (self.actions, actions.view(-1, 1)), (self.rewards, rewards.view(-1)),
+                                (self.dones, dones.view(-1))):
+            storage.index_copy_(0, storage_indices, values.to(self.storage_device, storage.dtype))
+        if self.prioritized:
+            # new transitions get the highest priority so far, they are replayed at least once soon
+            self.tree.update(indices, numpy.full(count, self.tree.max_priority))
+        self.position = (self.position + count) % self.capacity
+        self.size += count
+
+    def evict(self, count: int):
+        """
+        Drops the oldest transitions and releases their frames.
+        """
+        count = min(max(count, 0), self.size)
+        if count == 0:
+            return
+        indices = (self.position - self.size + numpy.arange(count)) % self.capacity
+        self.release_frames(numpy.concatenate((self.state_frames[indices], self.next_state_frames[indices])))
+        if self.prioritized:
+            self.tree.update(indices, numpy.zeros(count))
+        self.size -= count
+
+    def release_frames(self, frames: numpy.array):
+        """
+        Removes one reference from every frame, the frames without references go back to the pool.
+        """
+        numpy.add.at(self.frame_references, frames, -1)
+        freed = numpy.unique(frames[self.frame_references[frames] == 0])
+        self.free_frames[self.free_count:self.free_count + len(freed)] = freed
+        self.free_count += len(freed)
+
+    def write_frames(self, images):
+        """
+        Stores a batch of images in free frames.
+
+        :return: The (N,) frame indices.
+        """
+        count = images.size(0)
+        frames = self.free_frames[self.free_count - count:self.free_count].copy()
+        self.free_count -= count
+        self.frames.index_copy_(0, torch.as_tensor(frames, device=self.storage_device),
+                                self.encode_images(images.to(self.storage_device)))
+        return frames
+
+    def encode_images(self, images):
+        if self.image_dtype == torch.uint8:
+            return (images / self.image_scale * 255).round_().clamp_(0, 255).to(torch.uint8)
+        return images.to(self.image_dtype)
+
+    def decode_images(self, frames):
+        if self.image_dtype == torch.uint8:
+            return frames.to(self.device, torch.float32) * (self.image_scale / 255)
+        return frames.to(self.device, torch.float32)
+
+    def get_storage_bytes(self):
+        """
+        :return: The number of bytes of the frames and of the other transition fields.
+        """
+        fields = (self.package_dimensions, self.next_package_dimensions, self.actions, self.rewards, self.dones)
+        return (self.frames.numel() * self.frames.element_size(),
+                sum(field.numel() * field.element_size() for field in fields) +
+                self.state_frames.nbytes + self.next_state_frames.nbytes)
+
+    def push(self, state, action, next_state, reward):
+        """Saves a single transition, next_state is None if the episode ended."""
+        done = next_state is None
+        if done:
+            next_state = state
+        self.push_batch(state, action.view(1, 1), next_state, reward.view(1),
+                        torch.tensor([done], device=reward.device))
+
+    def is_valid(self, indices: numpy.array):
+        """
+        :return: Whether the slots still hold a transition.
+        """
+        return (numpy.asarray(indices) - (self.position - self.size)) % self.capacity < self.size
+
+    @instrumented('ReplayBuffer.sample')
+    def sample(self, batch_size: int):
+        """
+        Draws a batch of transitions, uniformly or proportionally to their priorities.
+
+        :return: The ReplayBatch, its weights are the importance sampling weights normalized to a maximum of 1,
+            all ones when sampling uniformly.
+        """
+        if self.prioritized:
+            # one draw per equal slice of the total priority, the batch covers the whole distribution
+            total = self.tree.total
+            prefix_sums = (numpy.arange(batch_size) + numpy.random.random(batch_size)) * (total / batch_size)
+            indices = self.tree.find(numpy.minimum(prefix_sums, total * (1 - 1e-12)))
+            probabilities = self.tree.get(indices) / total
+            weights = (self.size * probabilities) ** -self.beta
+            weights = torch.as_tensor(weights / weights.max(), dtype=torch.float32, device=self.device)
+        else:
+            indices = (self.position - self.size + numpy.random.randint(self.size, size=batch_size)) % self.capacity
+            weights = torch.ones(batch_size, device=self.device)
+        storage_indices = torch.as_tensor(indices, device=self.storage_device)
+        state_frames = torch.as_tensor(self.state_frames[indices], device=self.storage_device)
+        next_state_frames = torch.as_tensor(self.next_state_frames[indices], device=self.storage_device)
+        return ReplayBatch((self.decode_images(self.frames[state_frames]),
+                            self.package_dimensions[storage_indices].to(self.device)),
+                           self.actions[storage_indices].to(self.device),
+                           (self.decode_images(self.frames[next_state_frames]),
+                            self.next_package_dimensions[storage_indices].to(self.device)),
+                           self.rewards[storage_indices].to(self.device), self.dones[storage_indices].to(self.device),
+                           indices, weights)
+
+    def update_priorities(self, indices, errors):
+        """
+        Sets the priorities of sampled transitions from their temporal difference errors.
+        Transitions evicted since they were sampled are skipped.
+
+        :param indices: The indices of a ReplayBatch.
+        :param errors: The (n,) errors.
+        """
+        if not self.prioritized:
+            return
+        errors = errors.detach().abs().cpu().numpy() if isinstance(errors, torch.Tensor) else numpy.abs(errors)
+        indices = indices.cpu().numpy() if isinstance(indices, torch.Tensor) else numpy.asarray(indices)
+        valid = self.is_valid(indices)
+        self.tree.update(indices[valid], (errors[valid] + self.epsilon) ** self.alpha)
@@ -0,0 +1,241 @@
+import json
+import struct
+
+import numpy
+
+from packages import Container, Package
+
+# file layout: the fixed prefix, a JSON header with the scalars and the offset of every array, then the raw arrays
+MAGIC = b'CARGOSNP'
+VERSION = 1
+PREFIX = struct.Struct('<8sII')
+# arrays start on cache line boundaries so that the memory mapped views are aligned
+ALIGNMENT = 64
+
+
+def _align(offset: int):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def get_snapshot_arrays(container: Container):
+    """
+    Get the arrays of a container layout that go into a snapshot.
+
+    :return: Dict of array name to array.
+    """
+    store = container.packages
+    descriptions = [description.encode('utf-8') for description in store.descriptions]
+    description_offsets = numpy.zeros(len(descriptions) + 1, dtype=numpy.int64)
+    description_offsets[1:] = numpy.cumsum([len(description) for description in descriptions])
+    return {
+        'positions': store.positions,
+        'dimensions': store.dimensions,
+        'weights': store.weights,
+        'orientations': store.orientations,
+        'support_ratios': store.support_ratios,
+        'stacked_loads': store.stacked_loads,
+        'height_map': container.height_map,
+        'top_package_map': container.top_package_map,
+        'image': container.get_top_down_view(),
+        'extreme_points': container.extreme_points.points,
+        'description_offsets': description_offsets,
+        'description_bytes': numpy.frombuffer(b''.join(descriptions), dtype=numpy.uint8),
+    }
+
+
+def save_snapshot(container: Container, path: str):
+    """
+    Writes the full layout of a container (packages, height map, top-down view and the running aggregates)
+    to a binary file, every array is written in one piece.
+
+    :param container: The container.
+    :param path: The snapshot file.
+    :return: The number of bytes written.
+    """
+    arrays = {name: numpy.ascontiguousarray(array) for name, array in get_snapshot_arrays(container).items()}
+    highest_package = -1
+    if container.highest_package is not None:
+        highest_package = int(numpy.argmax(container.packages.positions[:, 2] + container.packages.dimensions[:, 2]))
+    header = {
+        'package_count': len(container.packages),
+        'dimensions': numpy.asarray(container.dimensions, dtype=float).tolist(),
+        'position': numpy.asarray(container.position, dtype=float).tolist(),
+        'empty_weight': float(container.empty_weight),
+        'total_package_weight': float(container.total_package_weight),
+        'total_package_volume': float(container.total_package_volume),
+        'center_of_gravity': numpy.asarray(container.center_of_gravity, dtype=float).tolist(),
+        'max_height': float(container.max_height),
+        'highest_package': highest_package,
+        'stability_threshold': float(container.stability_threshold),
+        'min_support_ratio': float(container.min_support_ratio),
+        'support_ratio_sum': float(container.support_ratio_sum),
+        'unstable_package_count': int(container.unstable_package_count),
+        'max_stacked_load': float(container.max_stacked_load),
+        'arrays': {},
+    }
+    # the offsets depend on the header length, which depends on the offsets,
+    # so the header is padded to a fixed size that leaves room for them
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _align(offset + array.nbytes)
+    data_start = _align(PREFIX.size + len(json.dumps(header).encode('utf-8')) + 16 * len(arrays) + ALIGNMENT)
+    for description in header['arrays'].values():
+        description['offset'] += data_start
+    header_bytes = json.dumps(header).encode('utf-8')
+    if PREFIX.size + len(header_bytes) > data_start:
+        raise ValueError('snapshot header does not fit in its reserved space')
+
+    with open(path, 'wb') as file:
+        file.write(PREFIX.pack(MAGIC, VERSION, len(header_bytes)))
+        file.write(header_bytes)
+        for name, array in arrays.items():
+            file.seek(header['arrays'][name]['offset'])
+            array.tofile(file)
+        file.truncate(max(file.tell(), data_start))
+        return file.tell()
+
+
+class Snapshot:
+    """
+    A container layout read from a snapshot file.
+    The arrays are read-only memory maps of the file by default, so opening a snapshot does not read the arrays.
+    """
+
+    def __init__(self, header: dict, arrays: dict):
+        self.header = header
+        self.arrays = arrays
+
+    def __len__(self):
+        return self.header['package_count']
+
+    def __getattr__(self, name: str):
+        arrays = self.__dict__.get('arrays', {})
+        if name in arrays:
+            return arrays[name]
+        header = self.__dict__.get('header', {})
+        if name in header:
+            return header[name]
+        raise AttributeError(name)
+
+    def __str__(self):
+        return f'Snapshot: ({len(self)} packages, {self.header["dimensions"]}, {self.header["center_of_gravity"]})'
+
+    def get_descriptions(self):
+        offsets = self.arrays['description_offsets']
+        data = self.arrays['description_bytes'].tobytes()
+        return [data[offsets[index]:offsets[index + 1]].decode('utf-8') for index in range(len(self))]
+
+    def to_container(self, package_capacity: int = None):
+        """
+        Rebuilds a container from the snapshot without placing the packages again.
+        The arrays are copied, the returned container does not keep the file open.
+
+        :param package_capacity: The capacity of the package store, the package count if None.
+        :return: The Container.
+        """
+        header = self.header
+        resolution_x, resolution_y = self.arrays['height_map'].shape
+        count = len(self)
+        container = Container(numpy.array(header['dimensions']), numpy.array(header['position']), resolution_x,
+                              resolution_y, package_capacity=max(package_capacity or count, 1))
+        store = container.packages
+        store.reserve(count)
+        store.size = count
+        for name in ('positions', 'dimensions', 'weights', 'orientations', 'support_ratios', 'stacked_loads'):
+            getattr(store, name)[:] = self.arrays[name]
+        store.descriptions = self.get_descriptions()
+        container.height_map[:] = self.arrays['height_map']
+        if container.range_max is not None:
+            container.range_max.invalidate()
+        container.top_package_map[:] = self.arrays['top_package_map']
+        container.image[:] = self.arrays['image']
+        container.extreme_points._points = numpy.array(self.arrays['extreme_points'])
+        for index in range(count):
+            container.spatial_index.insert(index)
+
+        for name in ('empty_weight', 'total_package_weight', 'total_package_volume', 'max_height',
+                     'stability_threshold', 'min_support_ratio', 'support_ratio_sum', 'unstable_package_count',
+                     'max_stacked_load'):
+            setattr(container, name, header[name])
+        container.center_of_gravity = numpy.array(header['center_of_gravity'])
+        if header['highest_package'] >= 0:
+            container.highest_package = Package.view(store, header['highest_package'])
+        return container
+
+
+def load_snapshot(path: str, mmap: bool = True):
+    """
+    Opens a snapshot file.
+
+    :param path: The snapshot file.
+    :param mmap: Memory map the arrays instead of reading them into memory.
+    :return: The Snapshot.
+    """
+    with open(path, 'rb') as file:
+        magic, version, header_length = PREFIX.unpack(file.read(PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a container snapshot')
+        if version != VERSION:
+            raise ValueError(f'unsupported snapshot version {version}, expected {VERSION}')
+        header = json.loads(file.read(header_length).decode('utf-8'))
+        arrays = {}
+        for name, description in header['arrays'].items():
+            dtype = numpy.dtype(description['dtype'])
+            shape = tuple(description['shape'])
+            if mmap and int(numpy.prod(shape)) > 0:
+                arrays[name] = numpy.memmap(path, dtype=dtype, mode='r', offset=description['offset'], shape=shape)
+            else:
+                file.seek(description['offset'])
+                arrays[name] = numpy.fromfile(file, dtype=dtype, count=int(numpy.prod(shape))).reshape(shape)
+    return Snapshot(header, arrays)
+
+
+def diff_snapshots(before: Snapshot, after: Snapshot, tolerance: float = 1e-9):
+    """
+    Compares two layouts of the same manifest or of the same container at two points in time.
+    Packages are matched by index.
+
+    :return: Dict with the indices of the moved, rotated, added and removed packages, the number of changed
+        height map cells and the displacement of the center of gravity.
+    """
+    common = min(len(before), len(after))
+    moved = numpy.flatnonzero(numpy.any(numpy.abs(before.positions[:common] - after.positions[:common]) > tolerance,
+                                        axis=1))
+    rotated = numpy.flatnonzero(before.orientations[:common] != after.orientations[:common])
+    changed_cells = -1
+    if before.height_map.shape == after.height_map.shape:
+        changed_cells = int(numpy.count_nonzero(numpy.abs(before.height_map - after.height_map) > tolerance))
+    return {
+        'moved': moved,
+        'rotated': rotated,
+        'added': numpy.arange(common, len(after)),
+        'removed': numpy.arange(common, len(before)),
+        'changed_height_cells': changed_cells,
+        'center_of_gravity_shift': numpy.asarray(after.center_of_gravity) - numpy.asarray(before.center_of_gravity),
+    }
+
+
+def snapshot_test(path: str = 'snapshot_test.cargo'):
+    import time
+
+    rng = numpy.random.default_rng(0)
+    container = Container(numpy.array([100, 100, 100]), numpy.array([0, 0, 0]))
+    for index in range(500):
+        package = Package(rng.uniform(1, 10), rng.integers(1, 10, 3).astype(float), f'package {index}')
+        container.add_package(package, rng.integers(0, 90, 2).astype(float), int(rng.integers(0, 3)))
+    before = time.perf_counter()
+    size = save_snapshot(container, path)
+    saved = time.perf_counter()
+    snapshot = load_snapshot(path)
+    loaded = time.perf_counter()
+    restored = snapshot.to_container()
+    rebuilt = time.perf_counter()
+    print(f'{size} bytes, saved in {(saved - before) * 1e3:.2f} ms, opened in {(loaded - saved) * 1e3:.2f} ms, '
+          f'rebuilt in {(rebuilt - loaded) * 1e3:.2f} ms')
+    print(snapshot)
+    print(diff_snapshots(snapshot, snapshot)['moved'], restored.center_of_gravity, container.center_of_gravity)
+
+
+if __name__ == '__main__':
+    snapshot_test()
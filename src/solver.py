@@ -0,0 +1,227 @@
+import multiprocessing
+import os
+import queue
+import time
+from typing import NamedTuple
+
+import numpy
+
+from packages import Container, Package, TrainingInstance
+
+ORDERINGS = ('volume', 'base_area', 'height', 'weight', 'random')
+ROTATION_CHOICES = ('lowest', 'random', 'fittest')
+
+
+class Layout(NamedTuple):
+    """
+    Compact result of a packing attempt, it is what the worker processes send back instead of a Container.
+    order[i] is the manifest index of the i-th placed package, positions[i] and rotations[i] are its placement.
+    The positions are float64 like the container, rounding them would move footprints across cell borders.
+    """
+    fitness: float
+    seed: int
+    ordering: str
+    rotation_choice: str
+    order: numpy.ndarray
+    positions: numpy.ndarray
+    rotations: numpy.ndarray
+
+
+def get_package_order(package_dimensions: numpy.array, package_weights: numpy.array, ordering: str,
+                      rng: numpy.random.Generator):
+    """
+    Get the order in which the packages of a manifest are placed, ties are broken randomly.
+
+    :param package_dimensions: The (n, 3) dimensions of the packages.
+    :param package_weights: The (n,) weights of the packages.
+    :param ordering: One of ORDERINGS, all but random place the biggest packages first.
+    :param rng: The random generator.
+    :return: The (n,) manifest indices.
+    """
+    tie_breaker = rng.random(len(package_weights))
+    if ordering == 'random':
+        return rng.permutation(len(package_weights))
+    if ordering == 'volume':
+        key = numpy.prod(package_dimensions, axis=1)
+    elif ordering == 'base_area':
+        key = numpy.sort(package_dimensions, axis=1)[:, 1:].prod(axis=1)
+    elif ordering == 'height':
+        key = package_dimensions.max(axis=1)
+    elif ordering == 'weight':
+        key = package_weights
+    else:
+        raise ValueError(f'unknown ordering {ordering}')
+    return numpy.lexsort((tie_breaker, -key))
+
+
+def choose_placement(container: Container, package: Package, rotation_choice: str, rng: numpy.random.Generator,
+                     target_center_of_gravity: numpy.array = None):
+    """
+    Picks a placement among the extreme point candidates of a package.
+
+    :param rotation_choice: 'lowest' takes the lowest candidate over all rotations,
+        'random' the lowest one of a random rotation (falling back to the others if it does not fit),
+        'fittest' the fittest orientation at the position of the lowest candidate.
+    :param target_center_of_gravity: The target of the fitness for 'fittest'.
+    :return: The position and the rotation, None if the package does not fit.
+    """
+    positions, rotations = container.get_candidate_placements(package)
+    if len(rotations) == 0:
+        return None
+    if rotation_choice == 'random':
+        rotation = rng.choice(numpy.unique(rotations))
+        positions, rotations = positions[rotations == rotation], rotations[rotations == rotation]
+    best = numpy.lexsort((positions[:, 0], positions[:, 1], positions[:, 2]))[0]
+    if rotation_choice == 'fittest':
+        scores = container.evaluate_orientations(package, positions[best][:2], target_center_of_gravity)
+        rotation = scores.get_best()
+        return numpy.append(positions[best][:2], scores.landing_heights[rotation]), rotation
+    return positions[best], int(rotations[best])
+
+
+def run_attempt(container_dimensions: numpy.array, package_dimensions: numpy.array, package_weights: numpy.array,
+                target_center_of_gravity: numpy.array, seed: int, ordering: str, rotation_choice: str):
+    """
+    Packs a manifest once with the given strategy and scores it with TrainingInstance.update_fitness.
+
+    :return: The Layout.
+    """
+    rng = numpy.random.default_rng(seed)
+    instance = TrainingInstance(container_dimensions, None, None, None, target_center_of_gravity)
+    order = []
+    positions = []
+    rotations = []
+    for index in get_package_order(package_dimensions, package_weights, ordering, rng):
+        package = Package(package_weights[index], package_dimensions[index].copy())
+        placement = choose_placement(instance.container, package, rotation_choice, rng, target_center_of_gravity)
+        if placement is None:
+            continue
+        instance.container.add_package(package, placement[0][:2], placement[1])
+        order.append(index)
+        positions.append(placement[0][:2])
+        rotations.append(placement[1])
+
+    fitness = -numpy.inf
+    if order:
+        instance.update_fitness()
+        fitness = float(instance.fitness)
+    return Layout(fitness, seed, ordering, rotation_choice, numpy.array(order, dtype=numpy.int32),
+                  numpy.array(positions, dtype=float).reshape(-1, 2), numpy.array(rotations, dtype=numpy.int8))
+
+
+def rebuild_container(container_dimensions: numpy.array, package_dimensions: numpy.array,
+                      package_weights: numpy.array, layout: Layout):
+    """
+    Replays a Layout into a new Container.
+    """
+    container = Container(container_dimensions, numpy.array([0, 0, 0]))
+    for index, position_2d, rotation in zip(layout.order, layout.positions, layout.rotations):
+        container.add_package(Package(package_weights[index], package_dimensions[index].copy()),
+                              position_2d.astype(float), int(rotation))
+    return container
+
+
+# the manifest is sent once to every worker process instead of once per attempt
+_worker_manifest = None
+
+
+def _initialize_worker(manifest):
+    global _worker_manifest
+    _worker_manifest = manifest
+
+
+def _run_worker_attempt(seed: int, ordering: str, rotation_choice: str):
+    return run_attempt(*_worker_manifest, seed, ordering, rotation_choice)
+
+
+def solve(container_dimensions: numpy.array, package_dimensions: numpy.array, package_weights: numpy.array,
+          target_center_of_gravity: numpy.array, attempts: int = 64, time_budget: float = None,
+          processes: int = None, seed: int = 0):
+    """
+    Runs independent packing attempts of a manifest on a process pool and keeps the fittest layout.
+    Attempt i uses the seed seed + i and cycles through ORDERINGS and ROTATION_CHOICES.
+
+    :param container_dimensions: The dimensions of the container.
+    :param package_dimensions: The (n, 3) dimensions of the packages.
+    :param package_weights: The (n,) weights of the packages.
+    :param target_center_of_gravity: The target center of gravity of the fitness.
+    :param attempts: The maximum number of attempts.
+    :param time_budget: Wall-clock seconds after which no attempt is started and the running ones are abandoned,
+        None to run all attempts.
+    :param processes: The number of worker processes, os.cpu_count() by default.
+    :param seed: The seed of the first attempt.
+    :return: The best Layout (None if no attempt finished) and the list of all finished layouts.
+    """
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    manifest = (numpy.asarray(container_dimensions), numpy.asarray(package_dimensions, dtype=float),
+                numpy.asarray(package_weights, dtype=float), numpy.asarray(target_center_of_gravity, dtype=float))
+    processes = processes or os.cpu_count()
+    strategies = [(seed + attempt, ORDERINGS[attempt % len(ORDERINGS)],
+                   ROTATION_CHOICES[(attempt // len(ORDERINGS)) % len(ROTATION_CHOICES)])
+                  for attempt in range(attempts)]
+
+    layouts = []
+    finished = queue.Queue()
+    pool = multiprocessing.Pool(processes, initializer=_initialize_worker, initargs=(manifest,))
+    abandoned = False
+    try:
+        # keep a couple of attempts queued per worker so that the budget is not spent on attempts never started
+        pending = 0
+        next_strategy = 0
+        while next_strategy < len(strategies) or pending:
+            while next_strategy < len(strategies) and pending < 2 * processes and \
+                    (deadline is None or time.perf_counter() < deadline):
+                pool.apply_async(_run_worker_attempt, strategies[next_strategy], callback=finished.put,
+                                 error_callback=finished.put)
+                pending += 1
+                next_strategy += 1
+            if not pending:
+                break
+            timeout = None if deadline is None else max(deadline - time.perf_counter(), 0)
+            try:
+                result = finished.get(timeout=timeout)
+            except queue.Empty:
+                abandoned = True
+                break
+            pending -= 1
+            if isinstance(result, BaseException):
+                raise result
+            layouts.append(result)
+            if deadline is not None and time.perf_counter() >= deadline:
+                abandoned = pending > 0
+                break
+    except BaseException:
+        abandoned = True
+        raise
+    finally:
+        # the attempts still running after the budget are killed instead of being left to finish in the background
+        if abandoned:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
+    best = max(layouts, key=lambda layout: layout.fitness, default=None)
+    return best, layouts
+
+
+def solver_test():
+    rng = numpy.random.default_rng(0)
+    container_dimensions = numpy.array([100, 100, 100])
+    package_dimensions = rng.integers(5, 21, (300, 3)).astype(float)
+    package_weights = rng.uniform(1, 10, 300)
+    target_center_of_gravity = numpy.array([50, 50, 20])
+    for processes in (1, os.cpu_count()):
+        start_time = time.time()
+        best, layouts = solve(container_dimensions, package_dimensions, package_weights, target_center_of_gravity,
+                              attempts=4 * processes, processes=processes)
+        elapsed = time.time() - start_time
+        print(f'{processes} processes: {len(layouts)} attempts in {elapsed:.2f} s '
+              f'({len(layouts) / elapsed:.2f} attempts/s), best fitness {best.fitness:.4f} '
+              f'with {len(best.order)} packages ({best.ordering}, {best.rotation_choice})')
+    container = rebuild_container(container_dimensions, package_dimensions, package_weights, best)
+    print(container.validate())
+
+
+if __name__ == '__main__':
+    solver_test()
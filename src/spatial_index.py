@@ -0,0 +1,180 @@
+import time
+from itertools import product
+
+import numpy
+
+
+class SpatialIndex:
+    """
+    Interface of the spatial indexes a Container keeps over the bounding boxes of its packages.
+    The boxes are read from the PackageStore of the container, the index only organizes package indices.
+    """
+
+    def __init__(self, store, container_dimensions: numpy.array):
+        self.store = store
+        self.container_dimensions = numpy.asarray(container_dimensions, dtype=float)
+
+    def insert(self, index: int):
+        """
+        Adds a package of the store to the index.
+
+        :param index: The index of the package in the store.
+        """
+        raise NotImplementedError
+
+    def remove(self, index: int):
+        """
+        Takes a package out of the index, used when placements are rolled back.
+
+        :param index: The index of the package in the store, the store must still hold it.
+        """
+        raise NotImplementedError
+
+    def get_candidates(self, box_min: numpy.array, box_max: numpy.array):
+        """
+        Get the packages that may intersect a box, a superset of the exact result.
+
+        :return: Array of package indices.
+        """
+        raise NotImplementedError
+
+    def query(self, box_min: numpy.array, box_max: numpy.array, strict: bool = True):
+        """
+        Get the packages whose bounding box intersects a box.
+
+        :param box_min: The minimum corner of the box.
+        :param box_max: The maximum corner of the box.
+        :param strict: Only count intersections with a positive volume, touching faces are ignored.
+        :return: Sorted array of package indices.
+        """
+        candidates = self.get_candidates(box_min, box_max)
+        if len(candidates) == 0:
+            return candidates
+        positions = self.store.positions[candidates]
+        ends = positions + self.store.dimensions[candidates]
+        if strict:
+            hits = numpy.all((positions < box_max) & (ends > box_min), axis=1)
+        else:
+            hits = numpy.all((positions <= box_max) & (ends >= box_min), axis=1)
+        return numpy.sort(candidates[hits])
+
+
+class LinearScanIndex(SpatialIndex):
+    """Checks every package, the reference for the other indexes."""
+
+    def insert(self, index: int):
+        pass
+
+    def remove(self, index: int):
+        pass
+
+    def get_candidates(self, box_min: numpy.array, box_max: numpy.array):
+        return numpy.arange(len(self.store))
+
+
+class UniformGridIndex(SpatialIndex):
+    """
+    Buckets the XY footprints of the packages into a uniform grid over the container floor.
+    A query only looks at the packages registered in the grid cells its footprint covers.
+    """
+
+    def __init__(self, store, container_dimensions: numpy.array, cell_size: float = None):
+        super().__init__(store, container_dimensions)
+        if cell_size is None:
+            cell_size = max(self.container_dimensions[0], self.container_dimensions[1]) / 32
+        self.cell_size = float(cell_size)
+        self.cells = {}
+
+    def get_cell_range(self, box_min: numpy.array, box_max: numpy.array):
+        x_start, y_start = (numpy.floor(numpy.asarray(box_min[:2], dtype=float) / self.cell_size)).astype(int)
+        x_end, y_end = (numpy.floor(numpy.asarray(box_max[:2], dtype=float) / self.cell_size)).astype(int)
+        return x_start, x_end, y_start, y_end
+
+    def insert(self, index: int):
+        position = self.store.positions[index]
+        x_start, x_end, y_start, y_end = self.get_cell_range(position, position + self.store.dimensions[index])
+        for cell in product(range(x_start, x_end + 1), range(y_start, y_end + 1)):
+            self.cells.setdefault(cell, []).append(index)
+
+    def remove(self, index: int):
+        position = self.store.positions[index]
+        x_start, x_end, y_start, y_end = self.get_cell_range(position, position + self.store.dimensions[index])
+        for cell in product(range(x_start, x_end + 1), range(y_start, y_end + 1)):
+            bucket = self.cells[cell]
+            # rollbacks remove the newest packages, which are at the end of the buckets
+            if bucket[-1] == index:
+                bucket.pop()
+            else:
+                bucket.remove(index)
+            if not bucket:
+                del self.cells[cell]
+
+    def get_candidates(self, box_min: numpy.array, box_max: numpy.array):
+        x_start, x_end, y_start, y_end = self.get_cell_range(box_min, box_max)
+        buckets = [self.cells[cell] for cell in product(range(x_start, x_end + 1), range(y_start, y_end + 1))
+                   if cell in self.cells]
+        if not buckets:
+            return numpy.zeros(0, dtype=numpy.int64)
+        return numpy.unique(numpy.concatenate(buckets).astype(numpy.int64))
+
+
+def scan_overlaps(store, box_min: numpy.array, box_max: numpy.array):
+    """The linear scan over all packages the container did before it had a spatial index."""
+    hits = []
+    for index, package in enumerate(store):
+        position = package.position
+        end = position + package.dimensions
+        if all(position[axis] < box_max[axis] and end[axis] > box_min[axis] for axis in range(3)):
+            hits.append(index)
+    return numpy.array(hits, dtype=numpy.int64)
+
+
+def benchmark(sizes=(1000, 10000, 100000), queries: int = 200, scan_queries: int = 10, seed: int = 0):
+    """
+    Compares the uniform grid and the vectorized scan index with the Python scan on random layouts.
+    The container floor grows with the package count so that the package density stays the same.
+
+    :return: List of dicts with the package count and the seconds per query of every method.
+    """
+    from packages import PackageStore
+
+    rng = numpy.random.default_rng(seed)
+    results = []
+    for size in sizes:
+        side = 10 * numpy.sqrt(size)
+        container_dimensions = numpy.array([side, side, 100.0])
+        store = PackageStore(size)
+        dimensions = rng.integers(1, 11, (size, 3)).astype(float)
+        positions = numpy.column_stack((rng.uniform(0, side - 10, size), rng.uniform(0, side - 10, size),
+                                        rng.uniform(0, 90, size)))
+        for index in range(size):
+            store.append(1.0, dimensions[index], positions[index])
+        indexes = {'grid': UniformGridIndex(store, container_dimensions, cell_size=10.0),
+                   'linear': LinearScanIndex(store, container_dimensions)}
+        start = time.perf_counter()
+        for index in range(size):
+            indexes['grid'].insert(index)
+        result = {'packages': size, 'grid_build': time.perf_counter() - start}
+
+        box_min = numpy.column_stack((rng.uniform(0, side - 10, queries), rng.uniform(0, side - 10, queries),
+                                      rng.uniform(0, 90, queries)))
+        box_max = box_min + rng.integers(1, 11, (queries, 3))
+        for name, index in indexes.items():
+            start = time.perf_counter()
+            for query in range(queries):
+                index.query(box_min[query], box_max[query])
+            result[name] = (time.perf_counter() - start) / queries
+        start = time.perf_counter()
+        for query in range(scan_queries):
+            expected = scan_overlaps(store, box_min[query], box_max[query])
+            assert numpy.array_equal(expected, indexes['grid'].query(box_min[query], box_max[query]))
+        result['python_scan'] = (time.perf_counter() - start) / scan_queries
+        results.append(result)
+        print(f'{size:>7} packages: grid {result["grid"] * 1e6:9.1f} us, linear {result["linear"] * 1e6:9.1f} us, '
+              f'python scan {result["python_scan"] * 1e6:11.1f} us per query '
+              f'(grid built in {result["grid_build"]:.2f} s)')
+    return results
+
+
+if __name__ == '__main__':
+    benchmark()
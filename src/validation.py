@@ -0,0 +1,158 @@
+from typing import NamedTuple
+
+import numpy
+
+
+class LayoutViolations(NamedTuple):
+    """
+    Every violation found in a layout.
+    overlaps[i] is a pair of package indices (first < second) whose boxes intersect with the volume
+    overlap_volumes[i], out_of_bounds holds the packages that stick out of the container.
+    """
+    overlaps: numpy.ndarray
+    overlap_volumes: numpy.ndarray
+    out_of_bounds: numpy.ndarray
+
+    @property
+    def valid(self):
+        return len(self.overlaps) == 0 and len(self.out_of_bounds) == 0
+
+    def __str__(self):
+        return f'LayoutViolations: ({len(self.overlaps)} overlaps, {len(self.out_of_bounds)} out of bounds)'
+
+
+def get_grid_cells(box_min: numpy.array, box_max: numpy.array, origin: numpy.array, cell_size: numpy.array,
+                   tolerance: float):
+    """
+    Lists the cells of a uniform grid that every box covers.
+
+    :return: The box index and the raveled cell of every (box, cell) entry and the shape of the grid.
+    """
+    first_cell = numpy.floor((box_min - origin) / cell_size).astype(numpy.int64)
+    # a box that ends exactly on a cell boundary does not enter the next cell
+    last_cell = numpy.maximum(numpy.floor((box_max - tolerance - origin) / cell_size).astype(numpy.int64), first_cell)
+    grid_shape = last_cell.max(axis=0) + 1
+    cell_spans = last_cell - first_cell + 1
+    cell_counts = numpy.prod(cell_spans, axis=1)
+    boxes = numpy.repeat(numpy.arange(len(box_min)), cell_counts)
+    local = numpy.arange(len(boxes)) - numpy.repeat(numpy.cumsum(cell_counts) - cell_counts, cell_counts)
+    spans = cell_spans[boxes]
+    cells = first_cell[boxes] + numpy.stack((local // (spans[:, 1] * spans[:, 2]), local // spans[:, 2] % spans[:, 1],
+                                              local % spans[:, 2]), axis=1)
+    return boxes, numpy.ravel_multi_index(cells.T, grid_shape), grid_shape
+
+
+def get_overlapping_pairs(box_min: numpy.array, box_max: numpy.array, tolerance: float = 1e-9,
+                          chunk_size: int = 1 << 22):
+    """
+    Finds all pairs of intersecting boxes, touching boxes do not count.
+    The broad phase buckets the boxes into a uniform 3d grid whose cells are about twice the mean box size and
+    pairs up the boxes that share a cell. The candidate pairs are then tested on all three axes at once, at most
+    chunk_size pairs at a time. A pair sharing several cells is only kept in the cell that holds the minimum corner
+    of the intersection, so every intersection is reported once.
+
+    :param box_min: The (n, 3) minimum corners.
+    :param box_max: The (n, 3) maximum corners.
+    :param tolerance: Intersections thinner than this on any axis are ignored.
+    :param chunk_size: The maximum number of candidate pairs tested at once, it bounds the memory used.
+    :return: The (m, 2) pairs with pairs[:, 0] < pairs[:, 1] sorted lexicographically and their (m,) intersection
+        volumes.
+    """
+    box_min = numpy.asarray(box_min, dtype=float)
+    box_max = numpy.asarray(box_max, dtype=float)
+    if len(box_min) < 2:
+        return numpy.zeros((0, 2), dtype=numpy.int64), numpy.zeros(0, dtype=float)
+
+    origin = box_min.min(axis=0)
+    cell_size = numpy.maximum(2 * (box_max - box_min).mean(axis=0), 1e-9)
+    boxes, cells, grid_shape = get_grid_cells(box_min, box_max, origin, cell_size, tolerance)
+    order = numpy.argsort(cells, kind='stable')
+    boxes = boxes[order]
+    cells = cells[order]
+    # every entry is paired with the entries after it in the same cell
+    count = len(cells)
+    candidate_counts = numpy.searchsorted(cells, cells, side='right') - numpy.arange(count) - 1
+    pair_offsets = numpy.concatenate(([0], numpy.cumsum(candidate_counts)))
+
+    pairs = []
+    volumes = []
+    start = 0
+    while start < count:
+        # the entries whose candidates fit into one chunk, at least one entry
+        stop = max(int(numpy.searchsorted(pair_offsets, pair_offsets[start] + chunk_size, side='right')) - 1,
+                   start + 1)
+        stop = min(stop, count)
+        counts = candidate_counts[start:stop]
+        total = int(counts.sum())
+        if total:
+            first = numpy.repeat(numpy.arange(start, stop), counts)
+            second = first + 1 + numpy.arange(total) - numpy.repeat(pair_offsets[start:stop] - pair_offsets[start],
+                                                                     counts)
+            box_a = boxes[first]
+            box_b = boxes[second]
+            intersection_min = numpy.maximum(box_min[box_a], box_min[box_b])
+            overlap = numpy.minimum(box_max[box_a], box_max[box_b]) - intersection_min
+            hit = numpy.all(overlap > tolerance, axis=1)
+            reference_cells = numpy.floor((intersection_min[hit] - origin) / cell_size).astype(numpy.int64)
+            hit[hit] = numpy.ravel_multi_index(reference_cells.T, grid_shape) == cells[first[hit]]
+            pairs.append(numpy.stack((box_a[hit], box_b[hit]), axis=1))
+            volumes.append(numpy.prod(overlap[hit], axis=1))
+        start = stop
+
+    if not pairs:
+        return numpy.zeros((0, 2), dtype=numpy.int64), numpy.zeros(0, dtype=float)
+    pairs = numpy.sort(numpy.concatenate(pairs), axis=1).astype(numpy.int64)
+    volumes = numpy.concatenate(volumes)
+    ranking = numpy.lexsort((pairs[:, 1], pairs[:, 0]))
+    return pairs[ranking], volumes[ranking]
+
+
+def get_out_of_bounds(box_min: numpy.array, box_max: numpy.array, container_dimensions: numpy.array,
+                      tolerance: float = 1e-9):
+    """
+    :return: The indices of the boxes that are not inside [0, container_dimensions].
+    """
+    outside = numpy.any(numpy.asarray(box_min) < -tolerance, axis=1) | \
+        numpy.any(numpy.asarray(box_max) > numpy.asarray(container_dimensions, dtype=float) + tolerance, axis=1)
+    return numpy.flatnonzero(outside)
+
+
+def validate_layout(positions: numpy.array, dimensions: numpy.array, container_dimensions: numpy.array,
+                    tolerance: float = 1e-9):
+    """
+    Checks a finished layout for packages that intersect each other or stick out of the container.
+
+    :param positions: The (n, 3) positions of the packages, relative to the container.
+    :param dimensions: The (n, 3) dimensions of the packages.
+    :param container_dimensions: The dimensions of the container.
+    :param tolerance: Violations smaller than this are ignored.
+    :return: The LayoutViolations.
+    """
+    box_min = numpy.asarray(positions, dtype=float).reshape(-1, 3)
+    box_max = box_min + numpy.asarray(dimensions, dtype=float).reshape(-1, 3)
+    overlaps, overlap_volumes = get_overlapping_pairs(box_min, box_max, tolerance)
+    return LayoutViolations(overlaps, overlap_volumes,
+                            get_out_of_bounds(box_min, box_max, container_dimensions, tolerance))
+
+
+def validation_test(size: int = 50000):
+    """Times the validation of a large layout, the results are checked in tests/test_validation.py."""
+    import time
+
+    rng = numpy.random.default_rng(0)
+    side = float(numpy.ceil(10 * numpy.sqrt(size)))
+    container_dimensions = numpy.array([side, side, 100.0])
+    # a grid of stacked packages, then a few broken ones
+    dimensions = numpy.full((size, 3), 5.0)
+    columns = int(side // 5)
+    positions = numpy.stack((numpy.arange(size) % columns * 5.0, numpy.arange(size) // columns % columns * 5.0,
+                             numpy.arange(size) // columns ** 2 * 5.0), axis=1)
+    positions[rng.choice(size, 10, replace=False), :2] += 2.5
+    positions[-1, 0] = side - 1
+    start_time = time.perf_counter()
+    violations = validate_layout(positions, dimensions, container_dimensions)
+    print(f'{size} packages validated in {(time.perf_counter() - start_time) * 1e3:.1f} ms: {violations}')
+
+
+if __name__ == '__main__':
+    validation_test()
@@ -0,0 +1,106 @@
+import multiprocessing
+import threading
+
+import numpy
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('torchvision')
+
+import ai_pytorch
+from ai_pytorch import ActorSettings, Net, decode_actions, run_actor
+from packages import TrainingInstance
+
+
+@pytest.mark.parametrize('action_stride', [1, 2, 4, 8, 16])
+@pytest.mark.parametrize('resolution', [(100, 100), (97, 61)])
+def test_q_map_covers_the_action_grid(action_stride: int, resolution: tuple):
+    net = Net(action_stride=action_stride)
+    with torch.no_grad():
+        output = net(torch.rand(2, 1, *resolution), torch.rand(2, ai_pytorch.PACKAGE_INPUT_NUM * ai_pytorch.PACKAGE_DIM))
+    assert output.shape == (2, net.get_action_count(*resolution))
+
+
+def test_action_stride_must_be_a_power_of_two():
+    with pytest.raises(ValueError):
+        Net(action_stride=3)
+    with pytest.raises(ValueError):
+        Net(channels=(8, 8), action_stride=8)
+
+
+def test_decode_actions():
+    net = Net(action_stride=4)
+    grid_x, grid_y = net.get_action_grid_shape(97, 61)
+    actions = torch.arange(net.get_action_count(97, 61)).view(-1, 1)
+    decoded = decode_actions(actions, 97, 61, net)
+    cells_x, cells_y = decoded[:, 0] // 4, decoded[:, 1] // 4
+    assert decoded[:, 0].max() < 97 and decoded[:, 1].max() < 61
+    assert torch.equal(((cells_x * grid_y + cells_y) * net.rotations + decoded[:, 2]) * net.package_slots +
+                       decoded[:, 3], actions.view(-1))
+
+
+@pytest.mark.parametrize('cell', [(1, 2), (13, 11)])
+def test_any_cell_can_be_the_greedy_action(cell: tuple):
+    # the deepest features have 7x7 cells at 100 px, an upsampled coarse Q-map could only peak near their centers
+    torch.manual_seed(0)
+    net = Net(action_stride=4)
+    grid_x, grid_y = net.get_action_grid_shape(100, 100)
+    image = torch.rand(1, 1, 100, 100)
+    package_dimensions = torch.rand(1, ai_pytorch.PACKAGE_INPUT_NUM * ai_pytorch.PACKAGE_DIM)
+    target = torch.zeros(grid_x, grid_y)
+    target[cell] = 1
+    optimizer = torch.optim.Adam(net.parameters(), lr=1e-3)
+    for _ in range(300):
+        q_values = net(image, package_dimensions).view(grid_x, grid_y, -1)[:, :, 0]
+        if int(q_values.argmax()) == cell[0] * grid_y + cell[1]:
+            break
+        optimizer.zero_grad()
+        torch.nn.functional.mse_loss(q_values, target).backward()
+        optimizer.step()
+    assert int(q_values.argmax()) == cell[0] * grid_y + cell[1]
+
+
+def test_training_step_activations_are_bounded():
+    # a concatenation of the full width skips kept about 40 MiB per 500 px image for the backward pass
+    result, = ai_pytorch.describe_net(Net(), resolutions=(500,), repeats=1)
+    assert result['activation_bytes'] < 25 * 2 ** 20
+
+
+class RecordingQueue:
+    """Stands in for the transition queue of train_parallel and stops the actor after a number of batches."""
+
+    def __init__(self, stop: threading.Event, count: int):
+        self.stop = stop
+        self.count = count
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+        if len(self.items) >= self.count:
+            self.stop.set()
+
+
+def test_actor_follows_the_learner_settings(monkeypatch):
+    monkeypatch.setattr(ai_pytorch, 'policy_net', None)
+    training_instance = TrainingInstance(numpy.array([100, 100, 100]), numpy.array([[5, 5, 5], [20, 20, 20]]),
+                                         numpy.array([1, 10]), numpy.array([20, 40]), numpy.array([50, 50, 20]))
+    # an architecture that differs from the defaults of the module
+    net = Net(action_stride=8, package_slots=3)
+    net.share_memory()
+    stop = threading.Event()
+    transitions = RecordingQueue(stop, 3)
+    threads = torch.get_num_threads()
+    try:
+        # no exploration, the module's EPS_START would explore most steps
+        run_actor(0, training_instance, 2, net, multiprocessing.Value('l', 0), transitions, stop, 0,
+                  ActorSettings(sync_every=1, eps_start=0.0, eps_end=0.0, eps_decay=1.0))
+    finally:
+        torch.set_num_threads(threads)
+    # the actor does not create the networks of the learner
+    assert ai_pytorch.policy_net is None
+    assert len(transitions.items) == 3
+    _, states, action, _, _, _ = transitions.items[0]
+    assert states[1].shape == (2, 3 * ai_pytorch.PACKAGE_DIM)
+    with torch.no_grad():
+        greedy = net(*map(torch.from_numpy, states)).argmax(1)
+    numpy.testing.assert_array_equal(action.reshape(-1), greedy.numpy())
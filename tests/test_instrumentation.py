@@ -0,0 +1,73 @@
+import tracemalloc
+
+import numpy
+import pytest
+
+import instrumentation
+from instrumentation import instrumented, measure
+
+MEGABYTE = 2 ** 20
+
+
+@pytest.fixture
+def tracking():
+    instrumentation.reset()
+    instrumentation.enable(track_allocations=True)
+    yield
+    instrumentation.disable()
+    instrumentation.reset()
+
+
+@instrumented('temporary')
+def allocate_temporary(size: int):
+    return float(numpy.ones(size, dtype=numpy.uint8).sum())
+
+
+@instrumented('retained')
+def allocate_retained(size: int):
+    return numpy.ones(size, dtype=numpy.uint8)
+
+
+@instrumented('outer')
+def allocate_nested():
+    allocate_temporary(8 * MEGABYTE)
+    return numpy.ones(MEGABYTE, dtype=numpy.uint8)
+
+
+def test_peak_and_retained_bytes(tracking):
+    retained = [allocate_retained(2 * MEGABYTE) for _ in range(3)]
+    for _ in range(3):
+        allocate_temporary(4 * MEGABYTE)
+    stats = instrumentation.get_stats()
+    assert stats['temporary']['max_peak_bytes'] == pytest.approx(4 * MEGABYTE, rel=0.05)
+    assert stats['temporary']['mean_peak_bytes'] == pytest.approx(4 * MEGABYTE, rel=0.05)
+    assert abs(stats['temporary']['retained_bytes']) < 0.05 * MEGABYTE
+    assert stats['retained']['retained_bytes'] == pytest.approx(6 * MEGABYTE, rel=0.05)
+    assert len(retained) == 3
+
+
+def test_nested_operations(tracking):
+    with measure('block'):
+        kept = allocate_nested()
+    stats = instrumentation.get_stats()
+    # the peak of the inner call counts for the operations around it
+    for name in ('temporary', 'outer', 'block'):
+        assert stats[name]['max_peak_bytes'] == pytest.approx(8 * MEGABYTE, rel=0.05), name
+    assert stats['outer']['retained_bytes'] == pytest.approx(MEGABYTE, rel=0.05)
+    assert stats['block']['retained_bytes'] == pytest.approx(MEGABYTE, rel=0.05)
+    assert len(kept) == MEGABYTE
+
+
+def test_disable_stops_tracing():
+    if tracemalloc.is_tracing():
+        pytest.skip('tracemalloc was started outside of the instrumentation')
+    instrumentation.enable(track_allocations=True)
+    assert tracemalloc.is_tracing()
+    instrumentation.disable()
+    assert not tracemalloc.is_tracing()
+    instrumentation.enable()
+    allocate_temporary(MEGABYTE)
+    instrumentation.disable()
+    stats = instrumentation.get_stats()['temporary']
+    assert stats['count'] == 1 and stats['max_peak_bytes'] == 0
+    instrumentation.reset()
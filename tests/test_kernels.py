@@ -0,0 +1,87 @@
+import numpy
+import pytest
+
+import kernels
+
+CONTAINER_DIMENSIONS = numpy.array([100.0, 100.0, 100.0])
+
+
+@pytest.fixture
+def rng():
+    return numpy.random.default_rng(0)
+
+
+def random_footprints(rng, count: int = 100):
+    for _ in range(count):
+        height_map = rng.integers(0, 100, (50, 40)).astype(float)
+        x_start, y_start = int(rng.integers(0, 50)), int(rng.integers(0, 40))
+        x_end, y_end = int(rng.integers(x_start, 51)), int(rng.integers(y_start, 41))
+        yield height_map, x_start, x_end, y_start, y_end
+
+
+def test_landing_height(rng):
+    for height_map, x_start, x_end, y_start, y_end in random_footprints(rng):
+        assert kernels.landing_height_jit(height_map, x_start, x_end, y_start, y_end) == \
+            kernels.landing_height_numpy(height_map, x_start, x_end, y_start, y_end)
+
+
+def test_place_footprint(rng):
+    for height_map, x_start, x_end, y_start, y_end in random_footprints(rng):
+        maps_jit = height_map.copy(), numpy.full(height_map.shape, -1, dtype=numpy.int64)
+        maps_numpy = height_map.copy(), numpy.full(height_map.shape, -1, dtype=numpy.int64)
+        kernels.place_footprint_jit(*maps_jit, x_start, x_end, y_start, y_end, 42.0, 7)
+        kernels.place_footprint_numpy(*maps_numpy, x_start, x_end, y_start, y_end, 42.0, 7)
+        numpy.testing.assert_array_equal(maps_jit[0], maps_numpy[0])
+        numpy.testing.assert_array_equal(maps_jit[1], maps_numpy[1])
+
+
+def test_update_center_of_gravity(rng):
+    for _ in range(100):
+        center_of_gravity, package_center = rng.random(3) * 100, rng.random(3) * 100
+        total_weight, package_weight = rng.random() * 1000, rng.random() * 10
+        numpy.testing.assert_allclose(
+            kernels.update_center_of_gravity_jit(center_of_gravity, total_weight, package_center, package_weight),
+            kernels.update_center_of_gravity_numpy(center_of_gravity, total_weight, package_center, package_weight),
+            rtol=1e-12, atol=0)
+
+
+def test_fitness(rng):
+    for _ in range(100):
+        max_heights, package_volumes = rng.random(8) * 100, rng.random(8) * 1000
+        centers_of_gravity, target = rng.random((8, 3)) * 100, rng.random(3) * 100
+        numpy.testing.assert_allclose(
+            kernels.fitness_jit(CONTAINER_DIMENSIONS, max_heights[0], package_volumes[0], centers_of_gravity[0],
+                                target),
+            kernels.fitness_numpy(CONTAINER_DIMENSIONS, max_heights[0], package_volumes[0], centers_of_gravity[0],
+                                  target),
+            rtol=1e-12, atol=0)
+        numpy.testing.assert_allclose(
+            kernels.fitness_batch_jit(CONTAINER_DIMENSIONS, max_heights, package_volumes, centers_of_gravity, target),
+            kernels.fitness_batch_numpy(CONTAINER_DIMENSIONS, max_heights, package_volumes, centers_of_gravity,
+                                        target),
+            rtol=1e-12, atol=0)
+
+
+def test_fitness_at_target(rng):
+    # a center of gravity on the target and an empty container must not raise or give inf in either version
+    target = rng.random(3) * 100
+    centers_of_gravity = numpy.stack((target, rng.random(3) * 100, target))
+    max_heights, package_volumes = numpy.array([50.0, 60.0, 0.0]), numpy.array([1000.0, 2000.0, 0.0])
+    for index in range(len(max_heights)):
+        expected = kernels.fitness_numpy(CONTAINER_DIMENSIONS, max_heights[index], package_volumes[index],
+                                         centers_of_gravity[index], target)
+        assert numpy.isfinite(expected)
+        assert kernels.fitness_jit(CONTAINER_DIMENSIONS, max_heights[index], package_volumes[index],
+                                   centers_of_gravity[index], target) == expected
+    numpy.testing.assert_array_equal(
+        kernels.fitness_batch_jit(CONTAINER_DIMENSIONS, max_heights, package_volumes, centers_of_gravity, target),
+        kernels.fitness_batch_numpy(CONTAINER_DIMENSIONS, max_heights, package_volumes, centers_of_gravity, target))
+
+
+def test_fitness_prefers_dense_layouts():
+    # the same packages and center of gravity, stacked higher than needed
+    target = numpy.array([50.0, 50.0, 20.0])
+    dense = kernels.fitness_numpy(CONTAINER_DIMENSIONS, 50.0, 400000.0, target + 5, target)
+    sparse = kernels.fitness_numpy(CONTAINER_DIMENSIONS, 80.0, 400000.0, target + 5, target)
+    off_target = kernels.fitness_numpy(CONTAINER_DIMENSIONS, 50.0, 400000.0, target + 20, target)
+    assert dense > sparse and dense > off_target
@@ -0,0 +1,108 @@
+import numpy
+import pytest
+
+from packages import Container, Package
+
+CONTAINER_DIMENSIONS = numpy.array([100.0, 100.0, 100.0])
+
+
+def make_packages(count: int, seed: int):
+    rng = numpy.random.default_rng(seed)
+    return [Package(weight, dimensions) for weight, dimensions in
+            zip(rng.uniform(1, 10, count), rng.uniform(3, 17, (count, 3)).round(2))]
+
+
+def add_packages(container: Container, packages: list, seed: int):
+    rng = numpy.random.default_rng(seed)
+    for package in packages:
+        container.add_package(package, rng.uniform(0, 80, 2), int(rng.integers(0, 6)))
+
+
+def get_state(container: Container):
+    """
+    :return: Copies of everything add_package changes.
+    """
+    count = len(container.packages)
+    store = container.packages
+    return {
+        'height_map': container.height_map.copy(),
+        'top_package_map': container.top_package_map.copy(),
+        'top_down_view': container.get_top_down_view().copy(),
+        'window_maxima': container.range_max.get_window_maxima(5, 7).copy(),
+        'spatial_index': sorted(container.spatial_index.get_candidates(numpy.zeros(3), CONTAINER_DIMENSIONS)),
+        'extreme_points': container.extreme_points.points.copy(),
+        'positions': store.positions[:count].copy(),
+        'dimensions': store.dimensions[:count].copy(),
+        'weights': store.weights[:count].copy(),
+        'orientations': store.orientations[:count].copy(),
+        'support_ratios': store.support_ratios[:count].copy(),
+        'stacked_loads': store.stacked_loads[:count].copy(),
+        'scalars': (count, container.total_package_weight, container.total_package_volume,
+                    tuple(container.center_of_gravity), container.highest_package, container.max_height,
+                    container.min_support_ratio, container.support_ratio_sum, container.unstable_package_count,
+                    container.max_stacked_load),
+    }
+
+
+def assert_same_state(state: dict, expected: dict):
+    assert state.keys() == expected.keys()
+    for name, value in expected.items():
+        if isinstance(value, numpy.ndarray):
+            numpy.testing.assert_array_equal(state[name], value, err_msg=name)
+        else:
+            assert state[name] == value, name
+
+
+@pytest.fixture
+def container():
+    return Container(CONTAINER_DIMENSIONS, numpy.zeros(3))
+
+
+def test_rollback_restores_the_checkpoint(container: Container):
+    add_packages(container, make_packages(20, 0), 0)
+    expected = get_state(container)
+    token = container.checkpoint()
+    packages = make_packages(15, 1)
+    add_packages(container, packages, 1)
+    container.rollback(token)
+    assert_same_state(get_state(container), expected)
+    for package in packages:
+        assert package.index == -1
+
+
+def test_nested_checkpoints(container: Container):
+    token = container.checkpoint()
+    empty = get_state(container)
+    add_packages(container, make_packages(10, 0), 0)
+    outer = get_state(container)
+    inner_token = container.checkpoint()
+    add_packages(container, make_packages(10, 1), 1)
+    inner = get_state(container)
+    innermost_token = container.checkpoint()
+    add_packages(container, make_packages(10, 2), 2)
+
+    container.rollback(innermost_token)
+    assert_same_state(get_state(container), inner)
+    container.rollback(inner_token)
+    assert_same_state(get_state(container), outer)
+    # a token that was rolled back past is a no-op
+    container.rollback(innermost_token)
+    assert_same_state(get_state(container), outer)
+    container.rollback(token)
+    assert_same_state(get_state(container), empty)
+
+
+def test_rolled_back_packages_can_be_added_again(container: Container):
+    add_packages(container, make_packages(10, 0), 0)
+    token = container.checkpoint()
+    packages = make_packages(20, 1)
+    dimensions = [package.dimensions.copy() for package in packages]
+    add_packages(container, packages, 1)
+    expected = get_state(container)
+
+    container.rollback(token)
+    # the packages get their dimensions from before the rotation of add_package back
+    for package, package_dimensions in zip(packages, dimensions):
+        numpy.testing.assert_array_equal(package.dimensions, package_dimensions)
+    add_packages(container, packages, 1)
+    assert_same_state(get_state(container), expected)
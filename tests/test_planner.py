@@ -0,0 +1,30 @@
+import numpy
+import pytest
+
+from packages import TrainingInstance
+from planner import BeamSearchPlanner
+from solver import rebuild_container
+
+CONTAINER_DIMENSIONS = numpy.array([100, 100, 100])
+TARGET_CENTER_OF_GRAVITY = numpy.array([50.0, 50.0, 20.0])
+
+
+@pytest.mark.parametrize('ordering', ['volume', 'random'])
+def test_best_layout_replays(ordering: str):
+    rng = numpy.random.default_rng(0)
+    package_dimensions = rng.uniform(3, 17, (40, 3)).round(2)
+    package_weights = rng.uniform(1, 10, 40)
+    training_instance = TrainingInstance(CONTAINER_DIMENSIONS, None, None, None, TARGET_CENTER_OF_GRAVITY)
+    planner = BeamSearchPlanner(training_instance, beam_width=4, branching=3, ordering=ordering, seed=0)
+    layout = planner.plan(package_dimensions, package_weights)
+    assert len(layout.order) > 0
+
+    container = rebuild_container(CONTAINER_DIMENSIONS, package_dimensions, package_weights, layout)
+    instance = TrainingInstance(CONTAINER_DIMENSIONS, None, None, None, TARGET_CENTER_OF_GRAVITY)
+    instance.container = container
+    instance.update_fitness()
+    assert instance.fitness == pytest.approx(layout.fitness, abs=1e-12)
+    assert container.validate().valid
+    # the planner leaves its container with the best layout, rebuilt through the undo log
+    numpy.testing.assert_array_equal(container.height_map, training_instance.container.height_map)
+    numpy.testing.assert_array_equal(container.packages.positions, training_instance.container.packages.positions)
@@ -0,0 +1,81 @@
+import numpy
+import pytest
+from numpy.lib.stride_tricks import sliding_window_view
+
+from range_max import RangeMaxTable
+
+MAX_LEVELS = [None, 0, 1, 3]
+
+
+def get_maxima(values: numpy.array, x_start, x_end, y_start, y_end):
+    return numpy.array([values[xs:xe, ys:ye].max() if xe > xs and ye > ys else 0
+                        for xs, xe, ys, ye in zip(x_start, x_end, y_start, y_end)])
+
+
+def check_table(table: RangeMaxTable, values: numpy.array, rng: numpy.random.Generator):
+    size_x, size_y = values.shape
+    x_start, x_end = numpy.sort(rng.integers(0, size_x + 1, (2, 200)), axis=0)
+    y_start, y_end = numpy.sort(rng.integers(0, size_y + 1, (2, 200)), axis=0)
+    numpy.testing.assert_array_equal(table.query(x_start, x_end, y_start, y_end),
+                                     get_maxima(values, x_start, x_end, y_start, y_end))
+    for width_x, width_y in ((1, 1), (3, 5), (8, 2), (size_x, size_y), (size_x - 1, 17)):
+        width_x, width_y = max(min(width_x, size_x), 1), max(min(width_y, size_y), 1)
+        numpy.testing.assert_array_equal(table.get_window_maxima(width_x, width_y),
+                                         sliding_window_view(values, (width_x, width_y)).max(axis=(2, 3)))
+
+
+@pytest.mark.parametrize('max_level', MAX_LEVELS)
+@pytest.mark.parametrize('shape', [(37, 53), (64, 1), (1, 1)])
+def test_query_matches_brute_force(max_level: int, shape: tuple):
+    rng = numpy.random.default_rng(0)
+    values = rng.uniform(0, 100, shape)
+    table = RangeMaxTable(values, max_level)
+    if shape == (1, 1):
+        numpy.testing.assert_array_equal(table.query([0, 0], [1, 0], [0, 0], [1, 1]), [values[0, 0], 0])
+        return
+    check_table(table, values, rng)
+
+
+@pytest.mark.parametrize('max_level', MAX_LEVELS)
+def test_updates_and_rollbacks(max_level: int):
+    # the values grow like a height map under new packages and are set back like Container.rollback does
+    rng = numpy.random.default_rng(1)
+    values = numpy.zeros((37, 53))
+    table = RangeMaxTable(values, max_level)
+    undo = []
+    for step in range(300):
+        if undo and rng.random() < 0.3:
+            count = int(rng.integers(1, min(len(undo), 12) + 1))
+            for _ in range(count):
+                x_start, x_end, y_start, y_end, previous = undo.pop()
+                values[x_start:x_end, y_start:y_end] = previous
+            table.discard_updates(count)
+        else:
+            x_start, y_start = rng.integers(0, 33), rng.integers(0, 49)
+            x_end, y_end = x_start + rng.integers(1, 5), y_start + rng.integers(1, 5)
+            undo.append((x_start, x_end, y_start, y_end, values[x_start:x_end, y_start:y_end].copy()))
+            value = values[x_start:x_end, y_start:y_end].max() + rng.uniform(1, 5)
+            values[x_start:x_end, y_start:y_end] = value
+            table.update(x_start, x_end, y_start, y_end, value)
+        if step % 7 == 0:
+            check_table(table, values, rng)
+    check_table(table, values, rng)
+
+
+def test_invalidate_after_lowering():
+    rng = numpy.random.default_rng(2)
+    values = rng.uniform(0, 100, (20, 30))
+    table = RangeMaxTable(values, 2)
+    check_table(table, values, rng)
+    values[5:15, 5:25] = 0
+    table.invalidate()
+    check_table(table, values, rng)
+
+
+@pytest.mark.parametrize('shape', [(100, 100), (1000, 37)])
+def test_max_level_fits_the_budget(shape: tuple):
+    for max_bytes in (2 ** 16, 2 ** 20, 2 ** 24, 2 ** 30):
+        level = RangeMaxTable.get_max_level(shape, max_bytes)
+        if level is not None and level >= 0:
+            table = RangeMaxTable(numpy.zeros(shape), level)
+            assert table.table.nbytes <= max_bytes
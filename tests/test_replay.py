@@ -0,0 +1,95 @@
+import numpy
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from replay import ReplayBuffer, SumTree
+
+
+def make_images(first: int, count: int):
+    # every image is filled with its own number, so a frame tells which image it holds
+    return torch.arange(first, first + count, dtype=torch.float32).view(-1, 1, 1, 1).expand(-1, 1, 2, 2).clone()
+
+
+def check_transitions(memory: ReplayBuffer, expected: dict):
+    """Every live transition must still point at the frames of the images it was pushed with."""
+    for index in range((memory.position - memory.size) % memory.capacity,
+                       (memory.position - memory.size) % memory.capacity + memory.size):
+        index %= memory.capacity
+        state, next_state = expected[index]
+        assert memory.frames[memory.state_frames[index]].flatten()[0].item() == state
+        assert memory.frames[memory.next_state_frames[index]].flatten()[0].item() == next_state
+
+
+@pytest.mark.parametrize('capacity, batch_size', [(13, 2), (37, 8), (30, 9), (27, 6), (16, 4)])
+@pytest.mark.parametrize('streams', [1, 2, 3])
+def test_shared_frames_stay_valid(capacity: int, batch_size: int, streams: int):
+    memory = ReplayBuffer(capacity, (1, 2, 2), 3)
+    next_images = [make_images(1000 * stream, batch_size) for stream in range(streams)]
+    image_number = 100000
+    expected = {}
+    for step in range(60):
+        stream = step % streams
+        states = next_images[stream]
+        next_images[stream] = make_images(image_number, batch_size)
+        image_number += batch_size
+        indices = (memory.position + numpy.arange(batch_size)) % capacity
+        memory.push_batch((states, torch.zeros(batch_size, 3)), torch.zeros(batch_size, 1, dtype=torch.long),
+                          (next_images[stream], torch.zeros(batch_size, 3)), torch.zeros(batch_size),
+                          torch.zeros(batch_size, dtype=torch.bool), stream=stream)
+        for offset, index in enumerate(indices):
+            expected[index] = (states[offset, 0, 0, 0].item(), next_images[stream][offset, 0, 0, 0].item())
+        check_transitions(memory, expected)
+        # every frame is referenced by the transitions and the streams that point at it, the rest are free
+        references = numpy.zeros(memory.frame_capacity, dtype=numpy.int64)
+        live = memory.is_valid(numpy.arange(capacity))
+        numpy.add.at(references, memory.state_frames[live], 1)
+        numpy.add.at(references, memory.next_state_frames[live], 1)
+        for _, frames in memory.last_next_states.values():
+            numpy.add.at(references, frames, 1)
+        numpy.testing.assert_array_equal(references, memory.frame_references)
+        assert memory.free_count == numpy.count_nonzero(references == 0)
+
+
+def test_shared_frames_use_less_memory():
+    capacity, batch_size = 1000, 10
+    memory = ReplayBuffer(capacity, (1, 2, 2), 3)
+    assert memory.frame_capacity < 2 * capacity
+    images = make_images(0, batch_size)
+    for step in range(3 * capacity // batch_size):
+        next_images = make_images(step * batch_size, batch_size)
+        memory.push_batch((images, torch.zeros(batch_size, 3)), torch.zeros(batch_size, 1, dtype=torch.long),
+                          (next_images, torch.zeros(batch_size, 3)), torch.zeros(batch_size),
+                          torch.zeros(batch_size, dtype=torch.bool))
+        images = next_images
+    # the shared frames never run out, no transition is evicted early
+    assert len(memory) == capacity
+
+
+def test_unshared_frames_evict_oldest():
+    capacity, batch_size = 20, 4
+    memory = ReplayBuffer(capacity, (1, 2, 2), 3, prioritized=True)
+    expected = {}
+    for step in range(20):
+        states, next_states = make_images(2 * step * batch_size, batch_size), make_images(
+            (2 * step + 1) * batch_size, batch_size)
+        indices = (memory.position + numpy.arange(batch_size)) % capacity
+        memory.push_batch((states, torch.zeros(batch_size, 3)), torch.zeros(batch_size, 1, dtype=torch.long),
+                          (next_states, torch.zeros(batch_size, 3)), torch.zeros(batch_size),
+                          torch.zeros(batch_size, dtype=torch.bool))
+        for offset, index in enumerate(indices):
+            expected[index] = (states[offset, 0, 0, 0].item(), next_states[offset, 0, 0, 0].item())
+        check_transitions(memory, expected)
+        assert len(memory) <= capacity
+        # evicted transitions are never sampled
+        batch = memory.sample(64)
+        assert memory.is_valid(batch.indices).all()
+
+
+def test_sum_tree_find():
+    tree = SumTree(10)
+    priorities = numpy.array([1.0, 0.0, 2.0, 0.5, 0.0, 3.0, 1.0, 0.0, 0.0, 2.5])
+    tree.update(numpy.arange(10), priorities)
+    prefix_sums = numpy.linspace(0, priorities.sum(), 200, endpoint=False)
+    numpy.testing.assert_array_equal(tree.find(prefix_sums),
+                                     numpy.searchsorted(numpy.cumsum(priorities), prefix_sums, side='right'))
@@ -0,0 +1,76 @@
+import numpy
+import pytest
+
+from packages import Container, Package
+from snapshot import diff_snapshots, load_snapshot, save_snapshot
+
+CONTAINER_DIMENSIONS = numpy.array([100.0, 100.0, 100.0])
+
+
+def add_packages(container: Container, count: int, seed: int):
+    rng = numpy.random.default_rng(seed)
+    for index in range(count):
+        package = Package(rng.uniform(1, 10), rng.uniform(3, 17, 3).round(2), f'package {seed} {index} é')
+        container.add_package(package, rng.uniform(0, 80, 2), int(rng.integers(0, 6)))
+
+
+def assert_same_layout(container: Container, expected: Container):
+    count = len(expected.packages)
+    assert len(container.packages) == count
+    for name in ('positions', 'dimensions', 'weights', 'orientations', 'support_ratios', 'stacked_loads'):
+        numpy.testing.assert_array_equal(getattr(container.packages, name), getattr(expected.packages, name),
+                                         err_msg=name)
+    assert container.packages.descriptions == expected.packages.descriptions
+    numpy.testing.assert_array_equal(container.height_map, expected.height_map)
+    numpy.testing.assert_array_equal(container.top_package_map, expected.top_package_map)
+    numpy.testing.assert_array_equal(container.get_top_down_view(), expected.get_top_down_view())
+    numpy.testing.assert_array_equal(container.extreme_points.points, expected.extreme_points.points)
+    numpy.testing.assert_array_equal(container.center_of_gravity, expected.center_of_gravity)
+    for name in ('total_package_weight', 'total_package_volume', 'max_height', 'min_support_ratio',
+                 'support_ratio_sum', 'unstable_package_count', 'max_stacked_load'):
+        assert getattr(container, name) == getattr(expected, name), name
+    if expected.highest_package is None:
+        assert container.highest_package is None
+    else:
+        numpy.testing.assert_array_equal(container.highest_package.position, expected.highest_package.position)
+    assert sorted(container.spatial_index.get_candidates(numpy.zeros(3), CONTAINER_DIMENSIONS)) == \
+        sorted(expected.spatial_index.get_candidates(numpy.zeros(3), CONTAINER_DIMENSIONS))
+
+
+@pytest.mark.parametrize('count', [0, 1, 60])
+@pytest.mark.parametrize('mmap', [True, False])
+def test_round_trip(tmp_path, count: int, mmap: bool):
+    container = Container(CONTAINER_DIMENSIONS, numpy.zeros(3))
+    add_packages(container, count, 0)
+    path = str(tmp_path / 'layout.cargo')
+    save_snapshot(container, path)
+    snapshot = load_snapshot(path, mmap=mmap)
+    assert len(snapshot) == count
+    assert snapshot.get_descriptions() == container.packages.descriptions
+    restored = snapshot.to_container()
+    del snapshot
+    assert_same_layout(restored, container)
+
+    # both containers go on packing the same packages into the same layout
+    add_packages(container, 40, 1)
+    add_packages(restored, 40, 1)
+    assert_same_layout(restored, container)
+
+
+def test_diff_of_a_grown_layout(tmp_path):
+    container = Container(CONTAINER_DIMENSIONS, numpy.zeros(3))
+    add_packages(container, 30, 0)
+    save_snapshot(container, str(tmp_path / 'before.cargo'))
+    add_packages(container, 10, 1)
+    save_snapshot(container, str(tmp_path / 'after.cargo'))
+    diff = diff_snapshots(load_snapshot(str(tmp_path / 'before.cargo')), load_snapshot(str(tmp_path / 'after.cargo')))
+    assert len(diff['moved']) == 0 and len(diff['rotated']) == 0 and len(diff['removed']) == 0
+    numpy.testing.assert_array_equal(diff['added'], numpy.arange(30, 40))
+    assert diff['changed_height_cells'] > 0
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.cargo'
+    path.write_bytes(b'not a snapshot file at all')
+    with pytest.raises(ValueError):
+        load_snapshot(str(path))
@@ -0,0 +1,45 @@
+import numpy
+import pytest
+
+from genetic import decode_individual
+from packages import TrainingInstance
+from solver import ORDERINGS, ROTATION_CHOICES, rebuild_container, run_attempt
+
+CONTAINER_DIMENSIONS = numpy.array([100, 100, 100])
+TARGET_CENTER_OF_GRAVITY = numpy.array([50.0, 50.0, 20.0])
+
+
+@pytest.fixture
+def manifest():
+    # dimensions that are not whole cells, their footprints end close to the cell borders
+    rng = numpy.random.default_rng(0)
+    return rng.uniform(3, 17, (150, 3)).round(2), rng.uniform(1, 10, 150)
+
+
+def check_replay(layout, package_dimensions: numpy.array, package_weights: numpy.array):
+    container = rebuild_container(CONTAINER_DIMENSIONS, package_dimensions, package_weights, layout)
+    instance = TrainingInstance(CONTAINER_DIMENSIONS, None, None, None, TARGET_CENTER_OF_GRAVITY)
+    instance.container = container
+    instance.update_fitness()
+    assert instance.fitness == pytest.approx(layout.fitness, abs=1e-12)
+    assert container.validate().valid
+
+
+@pytest.mark.parametrize('ordering', ORDERINGS)
+@pytest.mark.parametrize('rotation_choice', ROTATION_CHOICES)
+def test_attempt_replays(manifest, ordering: str, rotation_choice: str):
+    package_dimensions, package_weights = manifest
+    for seed in (1, 2):
+        layout = run_attempt(CONTAINER_DIMENSIONS, package_dimensions, package_weights, TARGET_CENTER_OF_GRAVITY,
+                             seed, ordering, rotation_choice)
+        check_replay(layout, package_dimensions, package_weights)
+
+
+def test_genetic_individual_replays(manifest):
+    package_dimensions, package_weights = manifest
+    rng = numpy.random.default_rng(1)
+    for _ in range(3):
+        layout = decode_individual(CONTAINER_DIMENSIONS, package_dimensions, package_weights,
+                                   TARGET_CENTER_OF_GRAVITY, rng.permutation(len(package_weights)),
+                                   rng.integers(0, 6, len(package_weights)))
+        check_replay(layout, package_dimensions, package_weights)
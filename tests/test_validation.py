@@ -0,0 +1,62 @@
+import numpy
+import pytest
+
+from validation import get_out_of_bounds, get_overlapping_pairs, validate_layout
+
+
+def get_pairwise_overlaps(box_min: numpy.array, box_max: numpy.array, tolerance: float = 1e-9):
+    overlap = numpy.minimum(box_max[:, numpy.newaxis], box_max[numpy.newaxis]) - \
+        numpy.maximum(box_min[:, numpy.newaxis], box_min[numpy.newaxis])
+    pairs = numpy.argwhere(numpy.triu(numpy.all(overlap > tolerance, axis=2), 1))
+    return pairs, numpy.prod(overlap[pairs[:, 0], pairs[:, 1]], axis=1)
+
+
+def make_boxes(layout: str, rng: numpy.random.Generator):
+    if layout == 'uniform':
+        box_min = rng.uniform(0, 50, (300, 3))
+        return box_min, box_min + rng.uniform(1, 10, (300, 3))
+    if layout == 'grid':
+        # boxes that touch on whole cell borders and a few shifted ones
+        cells = numpy.stack(numpy.unravel_index(numpy.arange(343), (7, 7, 7)), axis=1).astype(float)
+        box_min = cells * 5
+        box_min[rng.choice(343, 20, replace=False), :2] += 2.5
+        return box_min, box_min + 5
+    # a few large boxes over many small ones, the large boxes cover many grid cells
+    box_min = rng.uniform(0, 50, (200, 3))
+    sizes = rng.uniform(0.5, 3, (200, 3))
+    sizes[:5] = rng.uniform(20, 40, (5, 3))
+    return box_min, box_min + sizes
+
+
+@pytest.mark.parametrize('layout', ['uniform', 'grid', 'mixed'])
+@pytest.mark.parametrize('chunk_size', [1, 7, 1000, 1 << 22])
+def test_overlapping_pairs_match_the_pairwise_test(layout: str, chunk_size: int):
+    box_min, box_max = make_boxes(layout, numpy.random.default_rng(0))
+    pairs, volumes = get_overlapping_pairs(box_min, box_max, chunk_size=chunk_size)
+    expected_pairs, expected_volumes = get_pairwise_overlaps(box_min, box_max)
+    assert len(expected_pairs) > 0
+    numpy.testing.assert_array_equal(pairs, expected_pairs)
+    numpy.testing.assert_allclose(volumes, expected_volumes)
+
+
+def test_no_pairs():
+    pairs, volumes = get_overlapping_pairs(numpy.zeros((1, 3)), numpy.ones((1, 3)))
+    assert pairs.shape == (0, 2) and volumes.shape == (0,)
+    # touching boxes do not intersect
+    pairs, _ = get_overlapping_pairs(numpy.array([[0.0, 0, 0], [1, 0, 0]]), numpy.array([[1.0, 1, 1], [2, 1, 1]]))
+    assert pairs.shape == (0, 2)
+
+
+def test_validate_layout():
+    positions = numpy.array([[0.0, 0, 0], [5, 0, 0], [7, 0, 0], [96, 0, 0], [20, 0, -1]])
+    violations = validate_layout(positions, numpy.full((5, 3), 5.0), numpy.array([100, 100, 100]))
+    numpy.testing.assert_array_equal(violations.overlaps, [[1, 2]])
+    numpy.testing.assert_allclose(violations.overlap_volumes, [75.0])
+    numpy.testing.assert_array_equal(violations.out_of_bounds, [3, 4])
+    assert not violations.valid
+    assert validate_layout(positions[:2], numpy.full((2, 3), 5.0), numpy.array([100, 100, 100])).valid
+
+
+def test_out_of_bounds_tolerance():
+    box_min = numpy.array([[0.0, 0, 0], [-1e-12, 0, 0]])
+    assert len(get_out_of_bounds(box_min, box_min + 100 + 1e-12, numpy.array([100, 100, 100]))) == 0